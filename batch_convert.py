@@ -0,0 +1,95 @@
+"""
+文件名称: batch_convert.py
+功能描述:
+    批量像素格式转换：一批 N 帧相同几何 (宽、高、像素格式) 的原始数据使用同一个转换器，
+    输出写入预分配、跨批复用的缓冲区，不再为每帧分配新的输出图像。
+    1. 默认模式：每帧直接从源数据 (段文件映射或解码结果) 转换到复用的输出缓冲区，输入零拷贝。
+       每帧输出约 9 MB (2048x1536 BGR)，新分配的内存首次写入时需要逐页缺页，复用缓冲区即可省去这部分开销。
+    2. 堆叠模式 (stacked=True)：N 帧拷入预分配的 (N, H, W) 堆叠数组后上下拼接成一张高图，只调用一次
+       cv2.cvtColor；帧与帧接缝处的几行 (受相邻帧像素影响) 用单帧条带重新计算，结果与逐帧转换逐位一致。
+       多一次输入拷贝，但 OpenCV 可以在整批上并行，核数多时可能更快，用 benchmarks/bench_convert.py 对比。
+    3. Mono8 无需转换，直接返回源数据上的视图；RGB8 做 RGB -> BGR 通道翻转。
+
+特别注意事项:
+    1. convert() 产出的图像是内部缓冲区的视图：默认模式下所有帧共用一个输出缓冲区，
+       必须在取下一帧之前用完 (例如写出图片)。
+    2. 堆叠模式要求高度为偶数 (否则拼接会打乱 Bayer 排列)，不满足时退回默认模式。
+"""
+
+import numpy as np
+import cv2
+
+PIXEL_TYPE_MONO8 = 0x01080001
+PIXEL_TYPE_BAYERRG8 = 0x01080009
+PIXEL_TYPE_RGB8 = 0x02180014
+
+# 堆叠模式的接缝修正：对每帧顶部/底部 SEAM_STRIP 行单独去马赛克，取其中 SEAM_ROWS 行覆盖拼接结果
+# (VNG 的邻域半径为 2，3 行足够覆盖所有去马赛克算法的接缝影响)
+SEAM_STRIP = 8
+SEAM_ROWS = 3
+
+CHANNELS_IN = {PIXEL_TYPE_MONO8: 1, PIXEL_TYPE_BAYERRG8: 1, PIXEL_TYPE_RGB8: 3}
+
+
+class BatchConverter:
+    """
+    一种几何的批量转换器。capacity 为一批最多的帧数 (仅堆叠模式按它预分配)。
+    用法: for image in conv.convert(frames): cv2.imwrite(..., image)
+    """
+    def __init__(self, width, height, pixel_type, capacity, demosaic=cv2.COLOR_BayerRG2BGR, stacked=False):
+        if pixel_type not in CHANNELS_IN:
+            raise ValueError(f"Unsupported pixel type: {pixel_type}")
+        self.width = width
+        self.height = height
+        self.pixel_type = pixel_type
+        self.capacity = capacity
+        self.demosaic = demosaic
+        channels = CHANNELS_IN[pixel_type]
+        self.shape = (height, width) if channels == 1 else (height, width, channels)
+        self.frame_bytes = width * height * channels
+        self.stacked = (stacked and pixel_type == PIXEL_TYPE_BAYERRG8
+                        and height % 2 == 0 and height >= 2 * SEAM_STRIP)
+        self.raw = None
+        self.out = None
+        if pixel_type == PIXEL_TYPE_MONO8:
+            return
+        if self.stacked:
+            self.raw = np.empty((capacity, height, width), dtype=np.uint8)
+            self.out = np.empty((capacity, height, width, 3), dtype=np.uint8)
+        else:
+            self.out = np.empty((1, height, width, 3), dtype=np.uint8)
+
+    def _view(self, data):
+        return np.frombuffer(data, dtype=np.uint8, count=self.frame_bytes).reshape(self.shape)
+
+    def _code(self):
+        return self.demosaic if self.pixel_type == PIXEL_TYPE_BAYERRG8 else cv2.COLOR_RGB2BGR
+
+    def convert(self, frames):
+        """按顺序产出 frames (原始 payload 列表，最多 capacity 帧) 转换后的 BGR/灰度图像。"""
+        if self.pixel_type == PIXEL_TYPE_MONO8:
+            for data in frames:
+                yield self._view(data)
+        elif self.stacked and len(frames) > 1:
+            yield from self._convert_stacked(frames)
+        else:
+            dst = self.out[0]
+            for data in frames:
+                yield cv2.cvtColor(self._view(data), self._code(), dst=dst)
+
+    def _convert_stacked(self, frames):
+        n, h = len(frames), self.height
+        raw, out = self.raw[:n], self.out[:n]
+        for i, data in enumerate(frames):
+            raw[i] = self._view(data)
+        cv2.cvtColor(raw.reshape(n * h, self.width), self.demosaic, dst=out.reshape(n * h, self.width, 3))
+        # 修正接缝：第 1..n-1 帧的顶部和第 0..n-2 帧的底部
+        for i in range(n):
+            if i > 0:
+                top = cv2.cvtColor(raw[i, :SEAM_STRIP], self.demosaic)
+                out[i, :SEAM_ROWS] = top[:SEAM_ROWS]
+            if i < n - 1:
+                bottom = cv2.cvtColor(raw[i, h - SEAM_STRIP:], self.demosaic)
+                out[i, h - SEAM_ROWS:] = bottom[SEAM_STRIP - SEAM_ROWS:]
+        for i in range(n):
+            yield out[i]
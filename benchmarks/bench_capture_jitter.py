@@ -0,0 +1,216 @@
+"""
+文件名称: bench_capture_jitter.py
+功能描述:
+    不需要相机的采集抖动基准测试：对比线程模式和进程模式 (process_capture.py) 下，
+    主进程忙于保存前处理、CSV 格式化和显示转换时，各个源的取帧循环被推迟了多少。
+    1. 合成帧源按固定帧率"到达" (与 RetrieveNextBuffer 一样在等待时释放 GIL)，
+       到达时刻写入 device_ts，采集循环返回后记录 host_rx_ns，两者之差即取帧延迟。
+    2. 两种模式运行完全相同的采集循环 (process_capture._capture_main) 和共享内存槽位，
+       区别只在于循环运行在主进程的线程中还是独立子进程中。
+    3. 主进程为每个源运行一个接收线程，模拟 play_record.py 的负载：每帧格式化 --csv-rows 行文本，
+       每 --display-interval 帧做一次 BayerRG8 去马赛克和缩放；另可启动 --busy-threads 个纯 Python 忙循环线程。
+    4. 每种模式输出取帧延迟的 p50/p99/max、到达间隔的标准差 (抖动) 和因无空闲槽位丢弃的帧数，
+       结果以 JSON Lines 追加到输出文件，每行包含 git 提交号和完整配置，便于跨提交对比。
+
+使用方法:
+    python benchmarks/bench_capture_jitter.py
+    python benchmarks/bench_capture_jitter.py --sources 3 --fps 60 --csv-rows 500 --busy-threads 2 --output jitter.jsonl
+
+特别注意事项:
+    1. 合成帧源用 time.sleep 等待到达时刻，延迟中包含操作系统的唤醒误差 (两种模式相同)；
+       比较两种模式的差值，而不是绝对值。
+    2. 进程模式的子进程以 spawn 方式启动，启动时间不计入测量 (第一帧的到达时刻在子进程打开帧源之后)。
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+
+import numpy as np
+import cv2
+
+# 将仓库根目录添加到系统路径
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(REPO_ROOT)
+import process_capture
+from bench_save import git_revision
+
+PIXEL_TYPE_BAYERRG8 = 0x01080009
+
+
+class SyntheticSource:
+    """
+    合成帧源，对 process_capture 的采集循环而言与 EbusSource 具有相同的接口。
+    第 k 帧在 open() 之后 k / fps 秒到达，device_ts 为到达时刻 (perf_counter_ns)。
+    """
+    def __init__(self, fps, width, height, duration):
+        self.interval_ns = int(1e9 / fps)
+        self.width = width
+        self.height = height
+        self.count = int(duration * fps)
+        self.frame = None
+        self.start_ns = 0
+        self.block_id = 0
+
+    def open(self):
+        self.frame = np.random.default_rng(0).integers(0, 256, self.width * self.height, dtype=np.uint8)
+        self.start_ns = time.perf_counter_ns() + self.interval_ns
+        return "127.0.0.1", 0
+
+    def retrieve(self, timeout_ms):
+        if self.block_id >= self.count:
+            time.sleep(timeout_ms / 1000)
+            return None
+        due = self.start_ns + self.block_id * self.interval_ns
+        wait = (due - time.perf_counter_ns()) / 1e9
+        if wait > 0:
+            time.sleep(wait)
+        self.block_id += 1
+        return self.block_id, 0, due, self.width, self.height, PIXEL_TYPE_BAYERRG8, self.frame
+
+    def release(self):
+        pass
+
+    def pipeline_dropped(self):
+        return 0
+
+    def close(self):
+        pass
+
+
+def csv_row(meta):
+    """play_record.py 改用二进制帧索引之前每帧都要做的文本格式化。"""
+    block_id, host_ts, device_ts, size, width, height, pixel_type, host_rx_ns = meta
+    return f"{block_id},{host_ts},{device_ts},{size},{width},{height},{pixel_type:#010x},{host_rx_ns}\n"
+
+
+def consume(capture, args, result):
+    """主进程的接收线程：记录延迟，做模拟负载后归还槽位，直到采集循环结束。"""
+    latencies = []
+    arrivals = []
+    frames = 0
+    while True:
+        try:
+            msg = capture.recv(timeout=0.1)
+        except EOFError:
+            break
+        if msg is None:
+            continue
+        if msg[0] == "stopped":
+            break
+        if msg[0] != "frame":
+            continue
+        _, slot, meta, _ = msg
+        block_id, host_ts, device_ts, size, width, height, pixel_type, host_rx_ns = meta
+        latencies.append(host_rx_ns - device_ts)
+        arrivals.append(host_rx_ns)
+        rows = [csv_row(meta) for _ in range(args.csv_rows)]
+        frames += 1
+        if frames % args.display_interval == 0:
+            bayer = capture.view(slot, size).reshape(height, width)
+            rgb = cv2.cvtColor(bayer, cv2.COLOR_BayerRG2RGB)
+            cv2.resize(rgb, (640, 480))
+        capture.free(slot)
+        del rows
+    result["latencies"] = np.asarray(latencies, dtype=np.int64)
+    result["arrivals"] = np.asarray(arrivals, dtype=np.int64)
+
+
+def busy_loop(stop):
+    """不释放 GIL 的纯 Python 负载 (例如索引维护、统计汇总)。"""
+    while not stop.is_set():
+        sum(i * i for i in range(2000))
+
+
+def run_mode(args, mode):
+    captures = []
+    results = []
+    stop = threading.Event()
+    busy = [threading.Thread(target=busy_loop, args=(stop,), daemon=True) for _ in range(args.busy_threads)]
+    try:
+        for i in range(args.sources):
+            source = SyntheticSource(args.fps, args.width, args.height, args.duration)
+            captures.append(process_capture.ProcessCapture(source, args.width * args.height, args.slots,
+                                                           name=f"Source{i}", threaded=(mode == "thread")))
+        for c in captures:
+            c.start()
+        for t in busy:
+            t.start()
+        consumers = []
+        for c in captures:
+            result = {}
+            results.append(result)
+            consumers.append(threading.Thread(target=consume, args=(c, args, result)))
+        for t in consumers:
+            t.start()
+        # 帧源发完全部帧后停止采集循环，接收线程收到 "stopped" 后退出
+        time.sleep(args.duration + 1.0)
+        for c in captures:
+            c.stop()
+        for t in consumers:
+            t.join()
+    finally:
+        stop.set()
+        for c in captures:
+            c.close()
+
+    latencies = np.concatenate([r["latencies"] for r in results]) / 1000.0
+    jitter = [np.std(np.diff(r["arrivals"])) / 1000.0 for r in results if len(r["arrivals"]) > 2]
+    return {
+        "config": {
+            "mode": mode, "sources": args.sources, "fps": args.fps, "width": args.width, "height": args.height,
+            "duration": args.duration, "slots": args.slots, "csv_rows": args.csv_rows,
+            "display_interval": args.display_interval, "busy_threads": args.busy_threads,
+        },
+        "frames": int(len(latencies)),
+        "expected_frames": int(args.duration * args.fps) * args.sources,
+        "no_slot_drops": sum((c.stats or {}).get("no_slot", 0) for c in captures),
+        "latency_us": {
+            "p50": float(np.percentile(latencies, 50)) if len(latencies) else None,
+            "p99": float(np.percentile(latencies, 99)) if len(latencies) else None,
+            "max": float(latencies.max()) if len(latencies) else None,
+        },
+        "interval_std_us": float(np.mean(jitter)) if jitter else None,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Hardware-free capture jitter benchmark: thread vs process mode.")
+    parser.add_argument("--modes", nargs="+", choices=["thread", "process"], default=["thread", "process"])
+    parser.add_argument("--sources", type=int, default=3)
+    parser.add_argument("--fps", type=float, default=30.0, help="frames per second per source")
+    parser.add_argument("--width", type=int, default=2048)
+    parser.add_argument("--height", type=int, default=1536)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of synthetic acquisition")
+    parser.add_argument("--slots", type=int, default=32, help="shared memory slots per source")
+    parser.add_argument("--csv-rows", type=int, default=200, help="text rows formatted per received frame")
+    parser.add_argument("--display-interval", type=int, default=5, help="demosaic every N-th frame")
+    parser.add_argument("--busy-threads", type=int, default=1, help="extra pure-Python threads holding the GIL")
+    parser.add_argument("--output", help="append JSON Lines results to this file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    revision = git_revision()
+    for mode in args.modes:
+        result = run_mode(args, mode)
+        result["revision"] = revision
+        result["timestamp"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        lat = result["latency_us"]
+        print(f"{mode}: {result['frames']}/{result['expected_frames']} frames, "
+              f"latency p50={lat['p50'] or 0:.0f} us p99={lat['p99'] or 0:.0f} us max={lat['max'] or 0:.0f} us, "
+              f"interval std={result['interval_std_us'] or 0:.0f} us, no-slot drops={result['no_slot_drops']}")
+        line = json.dumps(result)
+        if args.output:
+            with open(args.output, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        else:
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+文件名称: bench_convert.py
+功能描述:
+    回放转换的像素格式转换基准测试：对比逐帧转换 (convert_engine.to_image，每帧分配输出) 与
+    批量转换 (batch_convert.BatchConverter)：
+    - "batch": 输入零拷贝，输出缓冲区跨帧复用 (ConversionEngine 使用的方式)；
+    - "stacked": 拷入堆叠数组后整批一次 cvtColor (仅 BayerRG8)。
+    1. 默认使用 FS-3200D 的全分辨率 2048x1536，覆盖 Mono8、BayerRG8 和 RGB8。
+    2. 只测单进程的转换吞吐 (不含读盘和写图片)，输出每种配置的 fps 和 MB/s。
+       --threads 1 模拟工作进程占满所有核时的情况，默认由 OpenCV 自行决定线程数。
+    3. 结果以 JSON Lines 追加到输出文件，每行包含 git 提交号和完整配置，便于跨提交对比。
+
+使用方法:
+    python benchmarks/bench_convert.py
+    python benchmarks/bench_convert.py --pixel-format bayerrg8 --batch 1 4 8 16 --demosaic vng --output conv.jsonl
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+import cv2
+
+# 将仓库根目录添加到系统路径
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(REPO_ROOT)
+import batch_convert
+import convert_engine
+from bench_save import git_revision
+
+PIXEL_FORMATS = {
+    "mono8": batch_convert.PIXEL_TYPE_MONO8,
+    "bayerrg8": batch_convert.PIXEL_TYPE_BAYERRG8,
+    "rgb8": batch_convert.PIXEL_TYPE_RGB8,
+}
+
+
+def make_frames(args, pixel_type):
+    """生成一组随机原始帧 (bytes，与从段文件读出的数据形式相同)。"""
+    rng = np.random.default_rng(0)
+    size = args.width * args.height * batch_convert.CHANNELS_IN[pixel_type]
+    return [rng.integers(0, 256, size, dtype=np.uint8).tobytes() for _ in range(args.frames)]
+
+
+def bench_per_frame(frames, args, pixel_type, demosaic):
+    """现有的逐帧路径：每帧 frombuffer + cvtColor，输出每次新分配。"""
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for raw in frames:
+            convert_engine.to_image(raw, args.width, args.height, pixel_type, demosaic)
+    return time.perf_counter() - start
+
+
+def bench_batch(frames, args, pixel_type, demosaic, batch, stacked):
+    """批量路径：按 batch 帧分批交给同一个 BatchConverter，逐个取出转换结果。"""
+    conv = batch_convert.BatchConverter(args.width, args.height, pixel_type, batch, demosaic, stacked)
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for i in range(0, len(frames), batch):
+            for _image in conv.convert(frames[i:i + batch]):
+                pass
+    return time.perf_counter() - start
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Per-frame vs batched pixel conversion benchmark.")
+    parser.add_argument("--width", type=int, default=2048)
+    parser.add_argument("--height", type=int, default=1536)
+    parser.add_argument("--pixel-format", nargs="+", choices=sorted(PIXEL_FORMATS),
+                        default=["mono8", "bayerrg8", "rgb8"])
+    parser.add_argument("--demosaic", choices=sorted(convert_engine.DEMOSAIC_CODES), default="bilinear")
+    parser.add_argument("--frames", type=int, default=32, help="distinct synthetic frames")
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the frames")
+    parser.add_argument("--batch", type=int, nargs="+", default=[4, 8, 16], help="batch sizes to sweep")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="OpenCV threads (default: OpenCV's own choice; 1 = like a busy worker pool)")
+    parser.add_argument("--output", help="append JSON Lines results to this file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.threads is not None:
+        cv2.setNumThreads(args.threads)
+    revision = git_revision()
+    demosaic = convert_engine.DEMOSAIC_CODES[args.demosaic]
+    for fmt in args.pixel_format:
+        pixel_type = PIXEL_FORMATS[fmt]
+        frames = make_frames(args, pixel_type)
+        total = len(frames) * args.repeat
+        frame_mb = len(frames[0]) / 2**20
+        runs = [("per_frame", None, bench_per_frame(frames, args, pixel_type, demosaic))]
+        runs += [("batch", b, bench_batch(frames, args, pixel_type, demosaic, b, False)) for b in args.batch]
+        if pixel_type == batch_convert.PIXEL_TYPE_BAYERRG8:
+            runs += [("stacked", b, bench_batch(frames, args, pixel_type, demosaic, b, True)) for b in args.batch]
+        baseline = runs[0][2]
+        for path, batch, seconds in runs:
+            result = {
+                "config": {
+                    "width": args.width, "height": args.height, "pixel_format": fmt,
+                    "demosaic": args.demosaic, "path": path, "batch": batch,
+                    "frames": total, "threads": args.threads,
+                },
+                "fps": total / seconds,
+                "mb_per_s": total * frame_mb / seconds,
+                "speedup": baseline / seconds,
+                "revision": revision,
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }
+            print(f"{fmt:9s} {path:9s} batch={batch or 1:<3d} {result['fps']:8.1f} fps "
+                  f"{result['mb_per_s']:8.1f} MB/s  x{result['speedup']:.2f}")
+            if args.output:
+                with open(args.output, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""
+文件名称: bench_save.py
+功能描述:
+    不需要相机的保存链路基准测试。用合成帧源代替 PvPipeline，驱动与 play_record.py 完全相同的保存子系统
+    (SegmentWriter + WriterPool.submit_frame/save_frame + FrameIndexWriter + GapTracker)。
+    1. 可配置分辨率、像素格式、帧率、源数量、目标卷、每卷写入线程数和段放置策略。
+    2. 每种写入配置输出: 持续写入 MB/s、入队到写完 (可选刷盘) 的 p50/p99 延迟、
+       队列高水位、丢帧数和丢帧率。写入帧数和延迟只统计 save_frame() 写入成功的帧，不包括丢弃的帧。
+    3. 结果以 JSON Lines 追加到输出文件，每行包含 git 提交号和完整配置，便于跨提交对比。
+
+使用方法:
+    python benchmarks/bench_save.py --volumes D:/bench E:/bench --sources 3 --fps 30 --threads 1 2 4
+    python benchmarks/bench_save.py --pixel-format rgb8 --fps 0 --duration 20 --output bench.jsonl
+
+特别注意事项:
+    1. --fps 0 表示不限速，测量保存子系统的最大吞吐：此时缓冲池耗尽会等待空闲缓冲区，保存队列已满会等待队列空位，
+       而不是计为丢帧。
+    2. 默认只测到写入返回 (数据进入操作系统缓存)；加 --sync 后每帧刷盘，测量真正的持久化延迟。
+    3. 每次运行在各个卷下创建 bench_<时间戳> 目录，结束后删除，除非指定 --keep。
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import itertools
+import subprocess
+import threading
+from collections import deque
+
+import numpy as np
+
+# 将仓库根目录添加到系统路径
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(REPO_ROOT)
+import segment_store
+import frame_index
+import frame_gaps
+import buffer_budget
+import writer_pool
+
+# === 像素格式: (PvPixelType 值, 每像素字节数) ===
+PIXEL_FORMATS = {
+    "mono8": (0x01080001, 1),
+    "bayerrg8": (0x01080009, 1),
+    "rgb8": (0x02180014, 3),
+}
+
+
+class SyntheticSource:
+    """
+    合成帧源，对保存子系统而言与 play_record.SourceStream 具有相同的接口。
+    固定数量的预填充缓冲区模拟 PvPipeline 的缓冲池：没有空闲缓冲区时计为管道溢出。
+    """
+    def __init__(self, name, volumes, pool, args):
+        pixel_type, bpp = PIXEL_FORMATS[args.pixel_format]
+        self.name = name
+        self.pixel_type = pixel_type
+        self.width = args.width
+        self.height = args.height
+        self.payload_size = args.width * args.height * bpp
+        self.pool = pool
+        self.save_path = os.path.join(volumes[0], name)
+        self.writer = segment_store.SegmentWriter(
+            self.save_path, segment_size=args.segment_size,
+            volumes=[os.path.join(v, name) for v in volumes],
+            choose_volume=pool.chooser(name), sync=args.sync)
+        self.index = frame_index.FrameIndexWriter(self.save_path)
+        self.gaps = frame_gaps.GapTracker(self.save_path)
+        self.planner = buffer_budget.BufferPlanner(
+            self.payload_size, args.fps, args.buffer_count * self.payload_size,
+            writer_threads=pool.thread_count, sources=args.sources)
+        # 预填充随机数据，避免生成数据的开销计入测量
+        rng = np.random.default_rng(len(name))
+        self.buffers = [rng.integers(0, 256, self.payload_size, dtype=np.uint8)
+                        for _ in range(args.buffer_count)]
+        self.free = deque(range(args.buffer_count))
+        self.enqueue_time = [0.0] * args.buffer_count
+        self.latencies = []
+        self.lock = threading.Condition()
+        self.queued = 0
+        self.produced = 0
+        self.pipeline_drops = 0
+        self.queue_drops = 0
+
+    # --- 与 SourceStream 相同的保存子系统接口 ---
+    def return_buffer(self, buffer):
+        with self.lock:
+            self.free.append(buffer)
+            self.lock.notify()
+
+    def written(self, latency):
+        """一帧写入成功，由 timed_save_frame() 在保存线程中调用。"""
+        with self.lock:
+            self.latencies.append(latency)
+
+    def enqueued(self):
+        with self.lock:
+            self.queued += 1
+            return self.queued
+
+    def dequeued(self):
+        with self.lock:
+            self.queued -= 1
+
+    # --- 合成采集线程 ---
+    def run(self, fps, deadline):
+        interval = 1.0 / fps if fps > 0 else 0.0
+        next_time = time.perf_counter()
+        block_id = 0
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            if interval:
+                if now < next_time:
+                    time.sleep(next_time - now)
+                next_time += interval
+            with self.lock:
+                if not interval:
+                    # 不限速时以保存速度为准，等待空闲缓冲区
+                    self.lock.wait_for(lambda: self.free, max(0.0, deadline - now))
+                buffer = self.free.popleft() if self.free else None
+            if buffer is None and not interval:
+                break
+            block_id += 1
+            self.produced += 1
+            if buffer is None:
+                self.pipeline_drops += 1
+                continue
+            lease = writer_pool.BufferLease(self, buffer)
+            self.enqueue_time[buffer] = time.perf_counter()
+            volume, segment, offset = self.writer.reserve(self.payload_size)
+            record = (block_id, int(time.time() * 1000), 0, offset, self.payload_size,
+                      self.width, self.height, self.pixel_type, segment, volume)
+            # 不限速时等待保存队列空位，测量的是保存吞吐而不是丢帧速度
+            if not self.pool.submit_frame(self, volume, segment, offset, self.buffers[buffer], record, lease,
+                                          block=not interval):
+                self.writer.cancel(segment)
+                self.queue_drops += 1
+            # 采集线程释放自己的引用；保存线程写完后缓冲区才真正归还
+            lease.release()
+
+    def close(self):
+        self.index.close()
+        self.gaps.close()
+        self.writer.close()
+
+
+def timed_save_frame(item):
+    """
+    在 writer_pool.save_frame() 外记录入队到写完的延迟，只统计写入成功的帧。
+    入队时刻须在 save_frame() 之前读出：租约释放后缓冲区可能已被采集线程重新使用。
+    """
+    source, lease = item[0], item[5]
+    enqueue_time = source.enqueue_time[lease.buffer]
+    if writer_pool.save_frame(item):
+        source.written(time.perf_counter() - enqueue_time)
+
+
+def percentile_ms(values, q):
+    return float(np.percentile(values, q) * 1000) if len(values) else None
+
+
+def git_revision():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                             capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_config(args, threads, placement):
+    """按一种写入配置跑一次基准，返回结果字典。"""
+    run_name = f"bench_{int(time.time() * 1000)}"
+    volumes = [os.path.join(v, run_name) for v in args.volumes]
+    pool = writer_pool.WriterPool(volumes, timed_save_frame, threads_per_volume=threads,
+                                  queue_size=args.queue_size, placement=placement)
+    sources = [SyntheticSource(f"Source{i}", volumes, pool, args) for i in range(args.sources)]
+    try:
+        start = time.perf_counter()
+        deadline = start + args.duration
+        threads_ = [threading.Thread(target=s.run, args=(args.fps, deadline)) for s in sources]
+        for t in threads_:
+            t.start()
+        for t in threads_:
+            t.join()
+        pool.join()
+        elapsed = time.perf_counter() - start
+        volume_stats = pool.stats()
+        pool.stop()
+    finally:
+        for s in sources:
+            s.close()
+        if not args.keep:
+            for v in volumes:
+                shutil.rmtree(v, ignore_errors=True)
+
+    latencies = np.concatenate([np.asarray(s.latencies) for s in sources])
+    written = sum(v["written_mb"] for v in volume_stats)
+    produced = sum(s.produced for s in sources)
+    dropped = sum(s.pipeline_drops + s.queue_drops for s in sources)
+    return {
+        "config": {
+            "width": args.width, "height": args.height, "pixel_format": args.pixel_format,
+            "fps": args.fps, "sources": args.sources, "duration": args.duration,
+            "volumes": args.volumes, "threads_per_volume": threads, "placement": placement,
+            "queue_size": args.queue_size, "buffer_count": args.buffer_count,
+            "segment_size": args.segment_size, "sync": args.sync,
+        },
+        "frames_produced": produced,
+        "frames_written": len(latencies),
+        "drop_rate": dropped / produced if produced else 0.0,
+        "seconds": elapsed,
+        "mb_per_s": written / elapsed if elapsed > 0 else 0.0,
+        "latency_ms": {
+            "p50": percentile_ms(latencies, 50),
+            "p99": percentile_ms(latencies, 99),
+            "max": percentile_ms(latencies, 100),
+        },
+        "backlog_high_water": {s.name: s.planner.high_water for s in sources},
+        "drops": {
+            "pipeline": sum(s.pipeline_drops for s in sources),
+            "save_queue": sum(s.queue_drops for s in sources),
+        },
+        "volumes": volume_stats,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Hardware-free benchmark of the recorder save path.")
+    parser.add_argument("--volumes", nargs="+", default=["."], help="target volume directories")
+    parser.add_argument("--sources", type=int, default=3)
+    parser.add_argument("--width", type=int, default=2048)
+    parser.add_argument("--height", type=int, default=1536)
+    parser.add_argument("--pixel-format", choices=sorted(PIXEL_FORMATS), default="bayerrg8")
+    parser.add_argument("--fps", type=float, default=30.0, help="frames per second per source, 0 = unpaced")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of synthetic acquisition")
+    parser.add_argument("--threads", type=int, nargs="+", default=[4], help="writer threads per volume to sweep")
+    parser.add_argument("--placement", nargs="+", choices=["segment", "source"], default=["segment"])
+    parser.add_argument("--queue-size", type=int, default=500)
+    parser.add_argument("--buffer-count", type=int, default=64, help="synthetic pipeline buffers per source")
+    parser.add_argument("--segment-size", type=int, default=segment_store.SEGMENT_SIZE)
+    parser.add_argument("--sync", action="store_true", help="flush every frame to disk before it counts as written")
+    parser.add_argument("--keep", action="store_true", help="keep the recorded benchmark data")
+    parser.add_argument("--output", help="append JSON Lines results to this file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    revision = git_revision()
+    for threads, placement in itertools.product(args.threads, args.placement):
+        result = run_config(args, threads, placement)
+        result["revision"] = revision
+        result["timestamp"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        lat = result["latency_ms"]
+        print(f"threads={threads} placement={placement}: {result['mb_per_s']:.1f} MB/s, "
+              f"{result['frames_written']}/{result['frames_produced']} frames written, "
+              f"p50={lat['p50'] or 0:.2f} ms p99={lat['p99'] or 0:.2f} ms, "
+              f"drops={result['drops']} ({result['drop_rate']:.1%})")
+        line = json.dumps(result)
+        if args.output:
+            with open(args.output, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        else:
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+文件名称: buffer_budget.py
+功能描述:
+    根据内存预算为每个源计算 PvPipeline 缓冲区数量，替代固定的 BUFFER_COUNT。
+    1. 初次打开：按 payload 大小、帧率和需要吸收的磁盘停顿时长估算缓冲区数量，并受内存预算约束。
+    2. 运行期间：BufferPlanner 记录保存积压的高水位和保存线程的实测消化速率。
+    3. 两次采集之间：根据上一轮的高水位和消化速率扩大或缩小缓冲池。
+
+特别注意事项:
+    1. 内存预算是 "单个源" 的预算，多个源时请先用总预算除以源数量。
+    2. 如果实测消化速率低于帧率，任何缓冲池都只能推迟丢帧，此时直接用满预算。
+    3. 缓冲区数量至少为 headroom + MIN_BUFFER_COUNT：headroom 个缓冲区始终留给管道，
+       其余才能租给保存线程。预算放不下这么多缓冲区时仍按下限分配 (超出预算)，调用方应给出警告。
+"""
+
+import os
+import sys
+import threading
+
+# === 配置 ===
+MIN_BUFFER_COUNT = 16
+STALL_SECONDS = 2.0  # 需要吸收的磁盘停顿时长
+HIGH_WATER_MARGIN = 1.25  # 按高水位调整时保留的余量
+DEFAULT_BUDGET_FRACTION = 0.25  # 未指定预算时使用物理内存的比例
+
+
+def physical_memory():
+    """返回物理内存字节数，无法获取时返回 None。"""
+    if sys.platform == "win32":
+        import ctypes
+
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [
+                ("dwLength", ctypes.c_ulong),
+                ("dwMemoryLoad", ctypes.c_ulong),
+                ("ullTotalPhys", ctypes.c_ulonglong),
+                ("ullAvailPhys", ctypes.c_ulonglong),
+                ("ullTotalPageFile", ctypes.c_ulonglong),
+                ("ullAvailPageFile", ctypes.c_ulonglong),
+                ("ullTotalVirtual", ctypes.c_ulonglong),
+                ("ullAvailVirtual", ctypes.c_ulonglong),
+                ("ullAvailExtendedVirtual", ctypes.c_ulonglong),
+            ]
+
+        status = MEMORYSTATUSEX()
+        status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullTotalPhys
+        return None
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def default_memory_budget(source_count=1):
+    """总预算取物理内存的 DEFAULT_BUDGET_FRACTION，平均分给每个源。"""
+    total = physical_memory() or (4 << 30)
+    return int(total * DEFAULT_BUDGET_FRACTION) // max(1, source_count)
+
+
+def plan_buffer_count(payload_size, frame_rate, memory_budget, drain_rate=None, high_water=None, headroom=0):
+    """
+    计算一个源的缓冲区数量。
+
+    payload_size: 单帧字节数
+    frame_rate: 采集帧率 (帧/秒)，未知时传 0
+    memory_budget: 该源可用的内存字节数
+    drain_rate: 保存线程实测消化速率 (帧/秒)，未知时传 None
+    high_water: 上一轮保存积压的高水位 (帧)，未知时传 None
+    headroom: 始终留给管道接收的额外缓冲区数
+    """
+    # 下限包含 headroom，否则可租给保存线程的缓冲区数为 0，租借模式下每一帧都会被丢弃
+    floor = MIN_BUFFER_COUNT + headroom
+    limit = max(floor, memory_budget // max(1, payload_size))
+    if drain_rate is not None and frame_rate > 0 and drain_rate < frame_rate:
+        # 消化不过来：缓冲池越大越能推迟丢帧
+        return limit
+    if high_water is not None:
+        backlog = high_water * HIGH_WATER_MARGIN
+    elif frame_rate > 0:
+        backlog = frame_rate * STALL_SECONDS
+    else:
+        backlog = MIN_BUFFER_COUNT
+    return int(min(limit, max(floor, backlog + headroom)))
+
+
+def within_budget(count, payload_size, memory_budget):
+    """count 个缓冲区是否在内存预算之内 (plan_buffer_count 按下限分配时可能超出)。"""
+    return count * payload_size <= memory_budget
+
+
+class BufferPlanner:
+    """
+    记录单个源一轮采集的保存积压高水位和消化速率，供下一轮调整缓冲池。
+    on_enqueue() 在采集线程调用，on_written() 在保存线程调用。
+    writer_threads 为保存线程池的总线程数，sources 为共用这些线程的源数量。
+    """
+    def __init__(self, payload_size, frame_rate, memory_budget, writer_threads=1, sources=1, headroom=0):
+        self.payload_size = payload_size
+        self.frame_rate = frame_rate
+        self.memory_budget = memory_budget
+        self.writer_threads = writer_threads
+        self.sources = max(1, sources)
+        self.headroom = headroom
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.high_water = 0
+            self.frames_written = 0
+            self.write_seconds = 0.0
+
+    def on_enqueue(self, backlog):
+        if backlog > self.high_water:
+            self.high_water = backlog
+
+    def on_written(self, seconds):
+        with self._lock:
+            self.frames_written += 1
+            self.write_seconds += seconds
+
+    def drain_rate(self):
+        """
+        本源可用的消化能力 (帧/秒)：单线程写入速率乘以本源分到的线程数 (总线程数 / 源数量)。
+        所有源共用同一个保存线程池，按总线程数计算会把多源时的消化能力高估 sources 倍。
+        """
+        with self._lock:
+            if self.frames_written == 0 or self.write_seconds <= 0:
+                return None
+            return self.frames_written / self.write_seconds * self.writer_threads / self.sources
+
+    def initial_count(self):
+        return plan_buffer_count(self.payload_size, self.frame_rate, self.memory_budget, headroom=self.headroom)
+
+    def next_count(self):
+        """根据上一轮的统计计算下一轮的缓冲区数量，并清空统计。"""
+        high_water = self.high_water if self.frames_written else None
+        count = plan_buffer_count(self.payload_size, self.frame_rate, self.memory_budget,
+                                  drain_rate=self.drain_rate(), high_water=high_water,
+                                  headroom=self.headroom)
+        self.reset()
+        return count
+
@@ -0,0 +1,140 @@
+"""
+文件名称: clock_sync.py
+功能描述:
+    设备时钟与主机时钟的映射。
+    1. PvBuffer.GetTimestamp() 是设备在曝光时打上的时间戳 (单位为设备 tick，频率见 GevTimestampTickFrequency)，
+       不受主机排队抖动影响；主机接收时间使用单调时钟 time.perf_counter_ns()。
+    2. ClockSync 对每台设备持续拟合 host_ns ≈ offset + slope * device_ns：
+       传输和排队延迟只会让主机时间变晚，因此按主机时间分箱，每箱只保留 (主机时间 - 设备时间) 最小的样本，
+       对滑动窗口内的箱最小值做最小二乘得到漂移 (slope)，再把截距下移到所有样本之下 (下包络)。
+    3. to_host() 把设备时间戳换算为主机单调时钟下的对齐时间 (aligned_ts)，多源配对和端到端延迟测量都基于它。
+
+特别注意事项:
+    1. 同一台设备的多个源共用一个设备时钟，应通过 clock_for(device) 共用同一个 ClockSync，
+       所有源的样本一起参与拟合；observe() 须传入源名称，各源的采集线程以任意顺序登记样本，
+       不同源的时间戳相互交错不算倒退。
+    2. 同一个源的设备时间戳倒退超过一个箱 (例如设备重启或 GevTimestampControlReset) 时清空历史样本重新拟合，
+       所有源从新的时间线重新开始；一个箱以内的倒退视为抖动，不重置。
+    3. Windows 上 time.monotonic_ns() 的分辨率约 15 ms，因此使用基于 QueryPerformanceCounter 的 perf_counter_ns()。
+"""
+
+import threading
+from collections import deque
+
+# === 配置 ===
+DEFAULT_TICK_FREQUENCY = 1000000000  # 读不到 GevTimestampTickFrequency 时假定设备时间戳以纳秒计
+BIN_SECONDS = 1.0  # 每个箱的主机时间长度
+WINDOW_SECONDS = 120.0  # 参与拟合的滑动窗口长度
+
+
+def read_tick_frequency(params):
+    """从设备参数中读取时间戳 tick 频率 (Hz)，读不到时返回默认值。"""
+    for name in ("GevTimestampTickFrequency", "TimestampTickFrequency"):
+        result, value = params.GetIntegerValue(name)
+        if result.IsOK() and value > 0:
+            return value
+    return DEFAULT_TICK_FREQUENCY
+
+
+class ClockSync:
+    """单台设备的时钟模型。observe() 和 to_host() 可在多个采集线程中并发调用。"""
+    def __init__(self, tick_frequency=DEFAULT_TICK_FREQUENCY, bin_seconds=BIN_SECONDS,
+                 window_seconds=WINDOW_SECONDS):
+        self.tick_frequency = tick_frequency
+        self._scale = 1e9 / tick_frequency
+        self._bin_ns = int(bin_seconds * 1e9)
+        self._points = deque(maxlen=max(2, int(window_seconds / bin_seconds)))
+        self._lock = threading.Lock()
+        self._bin = None
+        self._best = None  # 当前箱中 (主机时间 - 设备时间) 最小的样本: (差值, device_ns, host_ns)
+        self._last_device = {}  # 源 -> 该源最近一个设备时间 (ns)
+        # 模型: host_ns = host0 + slope * (device_ns - device0)
+        self._device0 = None
+        self._host0 = None
+        self._slope = 1.0
+        self.resets = 0
+
+    def observe(self, device_ts, host_ns, source=None):
+        """登记一个样本：设备时间戳 (tick) 与主机接收时间 (perf_counter_ns)，source 为源名称。"""
+        device_ns = device_ts * self._scale
+        delta = host_ns - device_ns
+        bin_ = host_ns // self._bin_ns
+        with self._lock:
+            last = self._last_device.get(source)
+            if last is not None and device_ns < last - self._bin_ns:
+                self._reset()
+            self._last_device[source] = device_ns
+            if bin_ != self._bin:
+                if self._best is not None:
+                    self._points.append(self._best[1:])
+                    self._fit()
+                self._bin = bin_
+                self._best = None
+            if self._best is None or delta < self._best[0]:
+                self._best = (delta, device_ns, host_ns)
+                if len(self._points) < 2:
+                    # 尚无足够的箱拟合漂移：按目前最小延迟的样本对齐，斜率取 1
+                    self._device0, self._host0, self._slope = device_ns, host_ns, 1.0
+                elif host_ns < self._predict(device_ns):
+                    # 新样本低于当前下包络：下移截距
+                    self._host0 -= self._predict(device_ns) - host_ns
+
+    def _reset(self):
+        self._points.clear()
+        # 其他源记录的是旧时间线上的时间戳，不能再用来判断倒退
+        self._last_device.clear()
+        self._bin = None
+        self._best = None
+        self._device0 = None
+        self.resets += 1
+
+    def _predict(self, device_ns):
+        return self._host0 + self._slope * (device_ns - self._device0)
+
+    def _fit(self):
+        """对箱最小值做最小二乘求斜率，再取下包络作为截距。"""
+        if len(self._points) < 2:
+            return
+        n = len(self._points)
+        d_mean = sum(p[0] for p in self._points) / n
+        h_mean = sum(p[1] for p in self._points) / n
+        sxx = sum((p[0] - d_mean) ** 2 for p in self._points)
+        if sxx <= 0:
+            return
+        sxy = sum((p[0] - d_mean) * (p[1] - h_mean) for p in self._points)
+        slope = sxy / sxx
+        lowest = min(p[1] - slope * (p[0] - d_mean) for p in self._points)
+        self._device0, self._host0, self._slope = d_mean, lowest, slope
+
+    def to_host(self, device_ts):
+        """设备时间戳 (tick) 换算为主机单调时钟 (纳秒)；尚无样本时返回 0。"""
+        with self._lock:
+            if self._device0 is None:
+                return 0
+            return int(self._predict(device_ts * self._scale))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "tick_frequency": self.tick_frequency,
+                "points": len(self._points),
+                "drift_ppm": (self._slope - 1.0) * 1e6,
+                "resets": self.resets,
+            }
+
+    def summary(self):
+        s = self.stats()
+        return f"drift={s['drift_ppm']:+.2f}ppm points={s['points']} resets={s['resets']}"
+
+
+_clocks = {}
+_clocks_lock = threading.Lock()
+
+
+def clock_for(device):
+    """返回一台设备共用的 ClockSync (按设备对象区分)，首次调用时读取 tick 频率。"""
+    with _clocks_lock:
+        clock = _clocks.get(id(device))
+        if clock is None:
+            clock = _clocks[id(device)] = ClockSync(read_tick_frequency(device.GetParameters()))
+        return clock
@@ -0,0 +1,405 @@
+"""
+文件名称: convert_engine.py
+功能描述:
+    回放转换引擎：把录制的原始帧转换为图片文件，工作进程之间只传递描述符，不传递帧数据。
+    1. "mmap" 模式 (默认)：任务只携带段号/偏移/大小，工作进程通过各自的 SegmentReader 直接映射段文件读取，
+       数据经操作系统页缓存共享，无拷贝、无重复打开文件。
+    2. "shm" 模式：父进程的读取阶段把段文件中的数据拷入 multiprocessing.shared_memory 共享内存块的空闲槽位，
+       工作进程只收到槽位号。适用于段文件所在存储不适合多进程随机映射 (例如网络盘) 的情况。
+    3. 在途任务数 (shm 模式下即槽位数) 有上限，内存占用与录制长度无关。
+    4. StageCounters 统计读取 / 解码转换 / 写图片各阶段的帧数、字节数和耗时，用于定位瓶颈。
+    工作进程只回传 (错误信息, 各阶段耗时) 这样的小元组。
+    5. iter_tasks() 按 block_id 顺序分块从帧索引生成任务，run() 边提交边产出结果；
+       Progress 输出进度/速度/预计剩余时间，ErrorSummary 按错误类型汇总，百万帧的录制也能以恒定内存转换。
+    6. 转换设置 (输出格式、去马赛克算法、文件名模板) 按像素格式计算指纹：只有影响该像素格式输出的设置
+       参与指纹，配合 convert_manifest.py 实现增量转换。工作进程同时回传存储数据的 CRC32。
+    7. 相同几何 (宽、高、像素格式) 的帧按 batch_size 帧一批交给工作进程，用 batch_convert.BatchConverter
+       转换：输入零拷贝，输出写入每个进程按几何缓存、跨批复用的缓冲区，每批只有一次进程间往返。
+
+特别注意事项:
+    1. 压缩帧在工作进程中解码 (frame_codec.decode)，shm 槽位中存放的是段文件中的原始存储数据。
+    2. shm 模式的槽位大小必须不小于最大的 stored_size，放不下的帧退回 mmap 方式读取。
+"""
+
+import os
+import json
+import time
+import zlib
+from collections import namedtuple, deque, Counter
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+import cv2
+
+import segment_store
+import frame_codec
+import batch_convert
+from batch_convert import PIXEL_TYPE_MONO8, PIXEL_TYPE_BAYERRG8, PIXEL_TYPE_RGB8
+
+# 一帧的转换任务 (全部为描述符，不含帧数据)
+Task = namedtuple("Task", "block_id host_ts volume segment offset stored_size payload_size codec "
+                          "width height pixel_type save_path")
+
+# === 转换设置 ===
+CONVERTER_VERSION = 1  # 转换逻辑本身改变 (输出不同) 时加一，使所有清单条目失效
+DEFAULT_SETTINGS = {
+    "format": "bmp",  # 输出图片格式 (cv2.imwrite 按扩展名选择编码器)
+    "demosaic": "bilinear",  # BayerRG8 去马赛克算法，见 DEMOSAIC_CODES
+    "name": "frame_{block_id}_{host_ts}",  # 输出文件名模板 (不含扩展名)
+}
+DEMOSAIC_CODES = {
+    "bilinear": cv2.COLOR_BayerRG2BGR,
+    "vng": cv2.COLOR_BayerRG2BGR_VNG,
+    "ea": cv2.COLOR_BayerRG2BGR_EA,
+}
+# 每种像素格式的输出受哪些设置影响
+SETTINGS_KEYS = {
+    PIXEL_TYPE_MONO8: ("format", "name"),
+    PIXEL_TYPE_BAYERRG8: ("format", "name", "demosaic"),
+    PIXEL_TYPE_RGB8: ("format", "name"),
+}
+
+STAGES = ("read", "convert", "write")
+PROGRESS_INTERVAL = 2.0  # 进度输出间隔 (秒)
+ERROR_EXAMPLES = 3  # 每种错误保留的示例数
+
+
+def settings_fingerprint(settings, pixel_type):
+    """转换设置中影响该像素格式输出的部分的指纹 (CRC32)。"""
+    keys = SETTINGS_KEYS.get(pixel_type, tuple(sorted(settings)))
+    relevant = {k: settings[k] for k in keys}
+    relevant["version"] = CONVERTER_VERSION
+    return zlib.crc32(json.dumps(relevant, sort_keys=True).encode("utf-8"))
+
+
+def output_path(output_dir, settings, block_id, host_ts):
+    name = settings["name"].format(block_id=block_id, host_ts=host_ts)
+    return os.path.join(output_dir, f"{name}.{settings['format']}")
+
+
+def iter_tasks(index, output_dir, settings=None, chunk_size=4096):
+    """按 block_id 顺序惰性生成转换任务，每次只从帧索引读取 chunk_size 条记录。"""
+    settings = settings or DEFAULT_SETTINGS
+    fields = ["block_id", "host_ts", "volume", "segment", "offset", "stored_size",
+              "payload_size", "codec", "width", "height", "pixel_type"]
+    for chunk in index.iter_sorted("block_id", chunk_size):
+        for rec in chunk[fields].tolist():
+            block_id, host_ts, volume, segment, offset, stored_size, payload_size, codec, width, height, pixel_type = rec
+            yield Task(block_id, host_ts, volume, segment, offset, stored_size, payload_size, codec,
+                       width, height, pixel_type, output_path(output_dir, settings, block_id, host_ts))
+
+
+def to_image(raw, width, height, pixel_type, demosaic=cv2.COLOR_BayerRG2BGR):
+    """把原始 payload 转换为可用 cv2.imwrite 保存的 BGR/灰度图像；不支持的像素格式返回 None。"""
+    if pixel_type == PIXEL_TYPE_MONO8:
+        return np.frombuffer(raw, dtype=np.uint8, count=width * height).reshape((height, width))
+    if pixel_type == PIXEL_TYPE_BAYERRG8:
+        bayer = np.frombuffer(raw, dtype=np.uint8, count=width * height).reshape((height, width))
+        # 注意：保存为图片时使用 BGR，否则颜色会反转
+        return cv2.cvtColor(bayer, demosaic)
+    if pixel_type == PIXEL_TYPE_RGB8:
+        rgb = np.frombuffer(raw, dtype=np.uint8, count=width * height * 3).reshape((height, width, 3))
+        return cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+    return None
+
+
+def read_image(reader, rec, demosaic=cv2.COLOR_BayerRG2BGR):
+    """按帧索引记录读取、解码一帧并转换为图像 (Mono8 返回段文件映射上的视图)；不支持的像素格式抛出 ValueError。"""
+    stored = reader.read(int(rec["segment"]), int(rec["offset"]), int(rec["stored_size"]), int(rec["volume"]))
+    payload = frame_codec.decode(int(rec["codec"]), stored, int(rec["payload_size"]))
+    image = to_image(payload, int(rec["width"]), int(rec["height"]), int(rec["pixel_type"]), demosaic)
+    if image is None:
+        raise ValueError(f"Unsupported pixel type: {int(rec['pixel_type'])}")
+    return image
+
+
+# === 工作进程状态：每个进程一个 SegmentReader、一个共享内存映射、转换设置和按几何缓存的批量转换器 ===
+_reader = None
+_slab = None
+_settings = DEFAULT_SETTINGS
+_converters = {}
+
+
+def _attach(name):
+    try:
+        # Python 3.13+: 不让工作进程的资源跟踪器在退出时删除父进程的共享内存
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def _init_worker(root, slab_name, settings):
+    global _reader, _slab, _settings
+    _reader = segment_store.SegmentReader(root)
+    _slab = _attach(slab_name) if slab_name else None
+    _settings = settings
+
+
+def _error(e, task):
+    # 错误信息以异常类型开头，便于 ErrorSummary 按类型汇总
+    return f"{type(e).__name__}: {e} (segment {task.segment} offset {task.offset})"
+
+
+def _converter(task, count):
+    """本进程中该几何的 BatchConverter (容量不足时重新分配)；不支持的像素格式返回 None。"""
+    if task.pixel_type not in batch_convert.CHANNELS_IN:
+        return None
+    key = (task.width, task.height, task.pixel_type)
+    conv = _converters.get(key)
+    if conv is None or conv.capacity < count:
+        conv = _converters[key] = batch_convert.BatchConverter(
+            task.width, task.height, task.pixel_type, count, DEMOSAIC_CODES[_settings["demosaic"]])
+    return conv
+
+
+def _run_batch(items):
+    """
+    转换一批相同几何的帧。items 为 [(共享内存槽位偏移或 None, task)]，槽位偏移为 None 时从段文件映射读取。
+    返回与 items 对应的 [(错误信息或 None, (读取耗时, 转换耗时, 写入耗时), 存储数据的 CRC32)]。
+    """
+    results = [None] * len(items)
+    conv = _converter(items[0][1], len(items))
+    loaded = []  # (items 下标, payload, 读取耗时, 解码耗时, CRC32)
+    views = []  # 共享内存槽位视图，整批转换完成后才释放
+    images = image = stored = payload = None
+    try:
+        for k, (slot_offset, task) in enumerate(items):
+            try:
+                start = time.perf_counter()
+                if slot_offset is None:
+                    stored = _reader.read(task.segment, task.offset, task.stored_size, task.volume)
+                else:
+                    stored = _slab.buf[slot_offset:slot_offset + task.stored_size]
+                    views.append(stored)
+                read = time.perf_counter() - start
+                crc = zlib.crc32(stored)
+                if conv is None:
+                    results[k] = f"Unsupported pixel type: {task.pixel_type}", (read, 0.0, 0.0), crc
+                    continue
+                start = time.perf_counter()
+                payload = frame_codec.decode(task.codec, stored, task.payload_size)
+                loaded.append((k, payload, read, time.perf_counter() - start, crc))
+            except Exception as e:
+                results[k] = _error(e, task), (0.0, 0.0, 0.0), 0
+        if not loaded:
+            return results
+        # 输出缓冲区在帧之间复用：每帧转换后立即写出，再转换下一帧
+        images = conv.convert([payload for _, payload, _, _, _ in loaded])
+        for k, _, read, decode, crc in loaded:
+            task = items[k][1]
+            start = time.perf_counter()
+            try:
+                image = next(images)
+            except Exception as e:
+                # 转换失败后生成器已结束，本批剩余的帧都记为同一错误
+                error = _error(e, task)
+                for k2, _, read2, _, crc2 in loaded:
+                    if results[k2] is None:
+                        results[k2] = error, (read2, 0.0, 0.0), crc2
+                break
+            convert = time.perf_counter() - start
+            start = time.perf_counter()
+            try:
+                ok = cv2.imwrite(task.save_path, image)
+                error = None if ok else f"WriteError: cannot write {task.save_path}"
+            except Exception as e:
+                error = _error(e, task)
+            results[k] = error, (read, decode + convert, time.perf_counter() - start), crc
+        return results
+    finally:
+        # 先丢弃引用槽位内存的数组，才能释放槽位视图
+        if images is not None:
+            images.close()
+        images = image = stored = payload = None
+        loaded.clear()
+        for view in views:
+            view.release()
+
+
+class StageCounters:
+    """各阶段的帧数、字节数和累计耗时 (秒)。读取阶段的字节数为存储字节数。"""
+    def __init__(self):
+        self.frames = dict.fromkeys(STAGES, 0)
+        self.bytes = dict.fromkeys(STAGES, 0)
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+
+    def add(self, stage, nbytes, seconds):
+        self.frames[stage] += 1
+        self.bytes[stage] += nbytes
+        self.seconds[stage] += seconds
+
+    def report(self):
+        """每个阶段的单进程吞吐：fps 和 MB/s (按该阶段的累计耗时计算)。"""
+        out = {}
+        for stage in STAGES:
+            s = self.seconds[stage]
+            out[stage] = {
+                "frames": self.frames[stage],
+                "fps": self.frames[stage] / s if s > 0 else None,
+                "mb_per_s": self.bytes[stage] / 2**20 / s if s > 0 else None,
+            }
+        return out
+
+
+class Progress:
+    """转换进度：每 interval 秒输出一次完成数、速度、预计剩余时间和错误数。跳过的帧计入完成数，但不计入速度。"""
+    def __init__(self, total, interval=PROGRESS_INTERVAL):
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.skipped = 0
+        self.errors = 0
+        self.start = time.perf_counter()
+        self._next = self.start + interval
+
+    def skip(self):
+        self.skipped += 1
+        self.update()
+
+    def update(self, error=None):
+        self.done += 1
+        if error is not None:
+            self.errors += 1
+        now = time.perf_counter()
+        if now >= self._next or self.done == self.total:
+            self._next = now + self.interval
+            print(self.line(now))
+
+    def line(self, now=None):
+        elapsed = (now or time.perf_counter()) - self.start
+        converted = self.done - self.skipped
+        rate = converted / elapsed if elapsed > 0 else 0.0
+        remaining = self.total - self.done
+        eta = remaining / rate if rate > 0 else (0.0 if remaining <= 0 else float("inf"))
+        return (f"[{self.done}/{self.total}] {self.done * 100 / max(self.total, 1):.1f}% "
+                f"{rate:.1f} fps, ETA {eta:.0f}s, skipped {self.skipped}, errors {self.errors}")
+
+
+class ErrorSummary:
+    """按错误类型 (错误信息中第一个冒号之前的部分) 计数，并保留少量示例。"""
+    def __init__(self, examples=ERROR_EXAMPLES):
+        self.examples = examples
+        self.counts = Counter()
+        self.samples = {}
+
+    def add(self, error):
+        kind = error.split(":", 1)[0]
+        self.counts[kind] += 1
+        samples = self.samples.setdefault(kind, [])
+        if len(samples) < self.examples:
+            samples.append(error)
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def report(self):
+        lines = []
+        for kind, count in self.counts.most_common():
+            lines.append(f"  {kind}: {count}")
+            lines.extend(f"    e.g. {e}" for e in self.samples[kind])
+        return "\n".join(lines)
+
+
+class ConversionEngine:
+    """
+    转换引擎。run(tasks) 按完成顺序产出 (task, 错误信息或 None, 存储数据的 CRC32)。
+    相同几何的帧攒满 batch_size 帧后作为一批提交；已读取或在途的帧不超过 max_inflight 个。
+    """
+    def __init__(self, root, workers=None, mode="mmap", max_inflight=None, slot_size=0, settings=None,
+                 batch_size=8):
+        if mode not in ("mmap", "shm"):
+            raise ValueError(f"Unknown mode: {mode}")
+        self.root = root
+        self.workers = workers or os.cpu_count() or 1
+        self.mode = mode
+        self.batch_size = batch_size
+        self.max_inflight = max_inflight or self.workers * batch_size * 2
+        self.slot_size = slot_size
+        self.settings = settings or DEFAULT_SETTINGS
+        if self.settings["demosaic"] not in DEMOSAIC_CODES:
+            raise ValueError(f"Unknown demosaic: {self.settings['demosaic']}")
+        self.counters = StageCounters()
+        self._slab = None
+        if mode == "shm":
+            if slot_size <= 0:
+                raise ValueError("shm mode needs slot_size >= the largest stored frame")
+            self._slab = shared_memory.SharedMemory(create=True, size=slot_size * self.max_inflight)
+        self._reader = segment_store.SegmentReader(root) if mode == "shm" else None
+
+    def _stage(self, task, free_slots):
+        """shm 模式下把一帧读入空闲槽位，返回 (槽位偏移, 槽位)；否则返回 (None, None)。"""
+        if self.mode != "shm" or task.stored_size > self.slot_size:
+            return None, None
+        slot = free_slots.popleft()
+        start = time.perf_counter()
+        stored = self._reader.read(task.segment, task.offset, task.stored_size, task.volume)
+        slot_offset = slot * self.slot_size
+        self._slab.buf[slot_offset:slot_offset + task.stored_size] = stored
+        self.counters.add("read", task.stored_size, time.perf_counter() - start)
+        return slot_offset, slot
+
+    def _collect(self, future, batch):
+        """统计一批的结果，返回 [(错误信息或 None, CRC32)]。"""
+        out = []
+        for (task, slot), (error, (read, convert, write), crc) in zip(batch, future.result()):
+            if slot is None:
+                # 工作进程自己读取的帧 (shm 模式下的帧由 _stage 计入)
+                self.counters.add("read", task.stored_size, read)
+            if error is None:
+                self.counters.add("convert", task.payload_size, convert)
+                self.counters.add("write", task.payload_size, write)
+            out.append((error, crc))
+        return out
+
+    def run(self, tasks):
+        slab_name = self._slab.name if self._slab else None
+        free_slots = deque(range(self.max_inflight))
+        batches = {}  # 几何 -> [(task, 槽位, 槽位偏移)]，尚未提交
+        pending = {}  # future -> [(task, 槽位)]
+        inflight = 0
+
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(self.root, slab_name, self.settings)) as executor:
+
+            def submit(key):
+                items = batches.pop(key)
+                future = executor.submit(_run_batch, [(offset, task) for task, _, offset in items])
+                pending[future] = [(task, slot) for task, slot, _ in items]
+
+            def complete():
+                nonlocal inflight
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = pending.pop(future)
+                    inflight -= len(batch)
+                    for (task, slot), (error, crc) in zip(batch, self._collect(future, batch)):
+                        if slot is not None:
+                            free_slots.append(slot)
+                        yield task, error, crc
+
+            for task in tasks:
+                while inflight >= self.max_inflight:
+                    if not pending:
+                        # 在途帧都还在未满的批中：先提交它们
+                        for key in list(batches):
+                            submit(key)
+                    yield from complete()
+                slot_offset, slot = self._stage(task, free_slots)
+                inflight += 1
+                key = (task.width, task.height, task.pixel_type)
+                batches.setdefault(key, []).append((task, slot, slot_offset))
+                if len(batches[key]) >= self.batch_size:
+                    submit(key)
+            for key in list(batches):
+                submit(key)
+            while pending:
+                yield from complete()
+
+    def close(self):
+        if self._reader:
+            self._reader.close()
+        if self._slab:
+            self._slab.close()
+            self._slab.unlink()
+            self._slab = None
@@ -0,0 +1,135 @@
+"""
+文件名称: convert_manifest.py
+功能描述:
+    回放转换的清单 (manifest.idx)，实现增量、可断点续转的转换。
+    1. 每成功转换一帧追加一条定长记录：block_id、主机时间戳、源数据位置 (卷/段/偏移/存储大小/编解码器)、
+       存储数据的 CRC32 和转换设置指纹。输出路径由 block_id、host_ts 和设置中的文件名模板/格式唯一确定，
+       这两项都包含在设置指纹中。
+    2. 重新运行时，源数据位置、设置指纹都与清单一致且输出文件存在的帧直接跳过：
+       中断的转换从停下的地方继续，新录制的帧只转换新增部分。
+    3. 设置指纹按像素格式计算 (convert_engine.settings_fingerprint)：例如只修改去马赛克算法时，
+       只有 BayerRG8 帧失效，Mono8 帧不受影响。
+    4. verify=True 时还会重新读取源数据计算 CRC32，与清单比对，发现源数据被修改的帧。
+
+特别注意事项:
+    1. 清单只追加不修改，同一帧重新转换后追加新记录，查找时以最后一条为准。
+    2. 记录按批写盘，异常退出时最多丢失最后一批记录 (这些帧下次会重新转换)。
+    3. 清单保存在输出目录中，与帧索引一样以 16 字节文件头开始。
+"""
+
+import os
+import struct
+import zlib
+
+import numpy as np
+
+# === 配置 ===
+MANIFEST_NAME = "manifest.idx"
+MAGIC = b"GVFMAN\0\0"
+VERSION = 1
+BATCH_SIZE = 256
+
+HEADER = struct.Struct("<8sII")  # 魔数, 版本号, 记录长度
+# block_id, host_ts, offset, segment, stored_size, crc32, 设置指纹, volume, codec
+RECORD = struct.Struct("<QqQIIIIHH")
+RECORD_DTYPE = np.dtype([
+    ("block_id", "<u8"),
+    ("host_ts", "<i8"),
+    ("offset", "<u8"),
+    ("segment", "<u4"),
+    ("stored_size", "<u4"),
+    ("crc32", "<u4"),
+    ("settings", "<u4"),
+    ("volume", "<u2"),
+    ("codec", "<u2"),
+])
+assert RECORD_DTYPE.itemsize == RECORD.size
+
+
+def manifest_path(output_dir):
+    return os.path.join(output_dir, MANIFEST_NAME)
+
+
+class ConversionManifest:
+    """
+    打开 (或新建) 输出目录下的清单。is_current() 判断一帧是否需要重新转换，
+    record() 在一帧转换成功后追加记录。
+    """
+    def __init__(self, output_dir, batch_size=BATCH_SIZE, check_outputs=True):
+        path = manifest_path(output_dir)
+        self.check_outputs = check_outputs
+        self.batch_size = batch_size
+        records = np.zeros(0, dtype=RECORD_DTYPE)
+        if os.path.exists(path) and os.path.getsize(path) >= HEADER.size:
+            with open(path, "rb") as f:
+                magic, version, size = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or version != VERSION or size != RECORD.size:
+                raise ValueError(f"Unsupported manifest {path}: version {version}, record size {size}")
+            count = (os.path.getsize(path) - HEADER.size) // RECORD.size
+            # 丢弃异常退出时残留的半条记录，保证续写对齐
+            os.truncate(path, HEADER.size + count * RECORD.size)
+            if count:
+                records = np.memmap(path, dtype=RECORD_DTYPE, mode="r", offset=HEADER.size, shape=(count,))
+            self._file = open(path, "ab")
+        else:
+            self._file = open(path, "wb")
+            self._file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+        # 按 (block_id, host_ts, 追加顺序) 排序，同一帧的最后一条记录排在最后
+        self._order = np.lexsort((np.arange(len(records)), records["host_ts"], records["block_id"]))
+        self._records = records
+        self._block_ids = np.asarray(records["block_id"])[self._order]
+        self._batch = bytearray()
+        self._count = 0
+        self.previous = len(records)
+
+    def __len__(self):
+        return self.previous
+
+    def lookup(self, block_id, host_ts):
+        """返回一帧最后一条清单记录；不存在时返回 None。"""
+        lo = np.searchsorted(self._block_ids, block_id, side="left")
+        hi = np.searchsorted(self._block_ids, block_id, side="right")
+        for i in range(hi - 1, lo - 1, -1):
+            rec = self._records[self._order[i]]
+            if rec["host_ts"] == host_ts:
+                return rec
+        return None
+
+    def is_current(self, task, fingerprint, reader=None):
+        """
+        task 的输出是否已是最新：源数据位置和设置指纹与清单一致、输出文件存在；
+        传入 reader (SegmentReader) 时还会比对存储数据的 CRC32。
+        """
+        rec = self.lookup(task.block_id, task.host_ts)
+        if rec is None:
+            return False
+        if (rec["settings"] != fingerprint or rec["segment"] != task.segment or rec["offset"] != task.offset
+                or rec["volume"] != task.volume or rec["stored_size"] != task.stored_size
+                or rec["codec"] != task.codec):
+            return False
+        if self.check_outputs and not os.path.exists(task.save_path):
+            return False
+        if reader is not None:
+            stored = reader.read(task.segment, task.offset, task.stored_size, task.volume)
+            if zlib.crc32(stored) != rec["crc32"]:
+                return False
+        return True
+
+    def record(self, task, fingerprint, crc):
+        """登记一帧已成功转换。"""
+        self._batch += RECORD.pack(task.block_id, task.host_ts, task.offset, task.segment,
+                                   task.stored_size, crc, fingerprint, task.volume, task.codec)
+        self._count += 1
+        if self._count >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._batch:
+            self._file.write(self._batch)
+            self._file.flush()
+            self._batch = bytearray()
+            self._count = 0
+
+    def close(self):
+        self.flush()
+        self._file.close()
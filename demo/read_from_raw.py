@@ -1,22 +1,32 @@
 """
 文件名称: read_from_raw.py
 功能描述: 
-    该脚本用于从指定的输入目录读取原始图像数据（.bin文件）及其对应的元数据（.json文件）。
+    该脚本用于从指定的输入目录读取原始图像数据，支持两种录制格式：
+    - 新格式：帧索引 (frames.idx 或 metadata.csv) + 分段容器 (segment_*.dat)，通过 frame_store.FrameStore 随机访问。
+    - 旧格式：每帧一个 .bin 文件及其对应的元数据（.json文件）。
     它将原始数据解析为图像，支持 Mono8 和 BayerRG8 格式，并将处理后的图像保存为 BMP 文件。
     同时，它会弹出一个窗口播放处理后的图像序列。
 
 特别注意事项:
-    1. 请确保 `input_dir` 路径下包含成对的 .bin 和 .json 文件。
+    1. 旧格式下请确保 `input_dir` 路径下包含成对的 .bin 和 .json 文件。
     2. `output_dir` 将用于保存生成的 BMP 图像，如果不存在会自动创建。
     3. 目前仅支持 PIXEL_TYPE_MONO8 和 PIXEL_TYPE_BAYERRG8 两种像素格式，其他格式会被跳过。
     4. 文件名格式预期包含下划线分隔的部分，以便提取 block_id 进行排序（例如 frame_123_timestamp.bin）。
+    5. 旧格式目录可先用仓库根目录的 migrate_legacy.py 迁移 (生成 frames.idx)，之后按新格式读取，
+       不再需要遍历目录和逐个解析 .json。
 """
 
 import os
+import sys
 import json
 import numpy as np
 import cv2
 
+# 将仓库根目录添加到系统路径，以便导入 frame_index / frame_store
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import frame_index
+import frame_store
+
 # === 配置路径 ===
 # 输入目录：存放 .bin 和 .json 文件的文件夹路径
 input_dir = "C:/Yuyuan/Camera/Test/TTT/Source1"
@@ -44,44 +54,62 @@ def extract_blockid(filename):
         # 如果提取失败（例如文件名格式不符），返回 -1，使其排在最前面
         return -1  # 出错时默认排序在最前
 
-# === 获取所有 .bin 文件，并按 block_id 排序 ===
-# 遍历输入目录，筛选出所有以 .bin 结尾的文件
-# 并使用 extract_blockid 函数作为 key 进行排序，确保按帧顺序处理
-bin_files = sorted(
-    [f for f in os.listdir(input_dir) if f.endswith(".bin")],
-    key=extract_blockid
-)
+# === 新格式：从分段容器读取 ===
+def iter_segment_frames():
+    """
+    按时间顺序产出 (block_id, width, height, pixel_type, raw)。
+    raw 是 frame_store.FrameStore 返回的段文件映射上的零拷贝视图，不再逐帧 open().read()；压缩帧自动解码。
+    """
+    store = frame_store.FrameStore(input_dir)
+    print(f"Found {len(store)} frames")
+    for rec, raw in store.iter():
+        yield int(rec["block_id"]), int(rec["width"]), int(rec["height"]), int(rec["pixel_type"]), raw
 
-# 打印找到的文件数量
-print(f"Found {len(bin_files)} frames")
+# === 旧格式：每帧一个 .bin + .json ===
+def iter_legacy_frames():
+    """
+    遍历 .bin 文件（按 block_id 排序）并读取对应的 .json 元数据。
+    """
+    # 遍历输入目录，筛选出所有以 .bin 结尾的文件
+    # 并使用 extract_blockid 函数作为 key 进行排序，确保按帧顺序处理
+    bin_files = sorted(
+        [f for f in os.listdir(input_dir) if f.endswith(".bin")],
+        key=extract_blockid
+    )
+
+    # 打印找到的文件数量
+    print(f"Found {len(bin_files)} frames")
+
+    for bin_file in bin_files:
+        # 构造 bin 文件的完整路径
+        bin_path = os.path.join(input_dir, bin_file)
+        # 构造对应的 json 元数据文件的路径（将 .bin 替换为 .json）
+        meta_path = bin_path.replace(".bin", ".json")
+
+        # 检查元数据文件是否存在
+        if not os.path.exists(meta_path):
+            print(f"[Missing meta] {meta_path}")
+            continue  # 如果不存在，跳过此文件
+
+        # 读取 json 元数据文件
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+
+        # 读取 bin 文件中的原始图像数据
+        with open(bin_path, 'rb') as f:
+            raw = f.read()
+
+        # 从元数据中提取 block_id、图像的宽、高和像素类型
+        yield meta.get("block_id", "unknown"), meta["width"], meta["height"], meta["pixel_type"], raw
+
+# 存在帧索引时按新格式读取，否则退回旧格式
+if frame_index.has_index(input_dir):
+    frames = iter_segment_frames()
+else:
+    frames = iter_legacy_frames()
 
 # === 播放并保存图像循环 ===
-# 遍历每一个排序后的 bin 文件
-for bin_file in bin_files:
-    # 构造 bin 文件的完整路径
-    bin_path = os.path.join(input_dir, bin_file)
-    # 构造对应的 json 元数据文件的路径（将 .bin 替换为 .json）
-    meta_path = bin_path.replace(".bin", ".json")
-
-    # 检查元数据文件是否存在
-    if not os.path.exists(meta_path):
-        print(f"[Missing meta] {meta_path}")
-        continue  # 如果不存在，跳过此文件
-
-    # 读取 json 元数据文件
-    with open(meta_path, 'r') as f:
-        meta = json.load(f)
-
-    # 从元数据中提取图像的宽、高、像素类型和 block_id
-    width = meta["width"]
-    height = meta["height"]
-    pixel_type = meta["pixel_type"]
-    block_id = meta.get("block_id", "unknown")
-
-    # 读取 bin 文件中的原始图像数据
-    with open(bin_path, 'rb') as f:
-        raw = f.read()
-
+for block_id, width, height, pixel_type, raw in frames:
     image = None
     # 根据像素类型进行处理
     if pixel_type == PIXEL_TYPE_MONO8:
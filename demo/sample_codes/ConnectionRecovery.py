@@ -14,6 +14,8 @@
     1. 建议设备使用静态 IP 或通过 MAC 地址（GUID）进行连接，以便在设备重启或网络恢复后能重新找到设备。
     2. 在 `OnLinkDisconnected` 回调中，不要直接断开设备连接，应设置标志位由主线程处理，以避免死锁或线程安全问题。
     3. 脚本依赖 `lib.PvSampleUtils`。
+    4. 流统计 (BlockCount、帧率、带宽) 由 `StatsSampler` (lib/StatsSampler.py) 在后台定时采样，
+       每次关闭流之前停止采样并追加导出本次连接的统计。
 """
 #!/usr/bin/env python3
 
@@ -32,10 +34,14 @@ import sys
 import os
 import eBUS as eb
 import lib.PvSampleUtils as psu
+from lib.StatsSampler import StatsSampler
 
 # 初始化键盘监听
 kb = psu.PvKb()
 
+# 每次关闭流时追加导出流统计时间序列的 CSV 文件，None 表示只打印摘要
+STATS_FILE = None
+
 #
 # 应用程序类
 #
@@ -49,6 +55,7 @@ class connection_recovery_app(eb.PvDeviceEventSink):
         self.__device = None
         self.__stream = None
         self.__pipeline = None
+        self.__stats = None
         # 初始化父类
         eb.PvDeviceEventSink.__init__(self)
 
@@ -147,6 +154,12 @@ class connection_recovery_app(eb.PvDeviceEventSink):
                     # 禁用请求丢失的数据包功能，以减少网络负载
                     request_missing_packets_node.SetValue( False ) 
 
+        # 流统计计数器由采样线程定时读取，采集循环只读缓存值
+        self.__stats = StatsSampler()
+        for name in ("BlockCount", "AcquisitionRate", "Bandwidth"):
+            self.__stats.Add(name, self.__stream.GetParameters())
+        self.__stats.Start()
+
         print(f"Connected to {self.__connectionID}")
         parameters = self.__device.GetParameters()
         
@@ -159,6 +172,14 @@ class connection_recovery_app(eb.PvDeviceEventSink):
  
         print(f"--> CloseStream");
 
+        # 流关闭前停止采样线程
+        if not self.__stats == None:
+            self.__stats.Stop()
+            print(self.__stats.Summary())
+            if STATS_FILE:
+                self.__stats.Dump(STATS_FILE, append=True)
+            self.__stats = None
+
         if not self.__pipeline == None :
             if (  self.__pipeline.IsStarted() ):
                 if not self.__pipeline.Stop().IsOK():
@@ -281,9 +302,9 @@ class connection_recovery_app(eb.PvDeviceEventSink):
                         # 我们现在有一个有效的缓冲区。这是您通常处理缓冲区的地方。
                         #---------------------------------------------------------------------------------
                         #
-                        result, image_count_val = self.__stream.GetParameters().GetIntegerValue("BlockCount")
-                        result, frame_rate_val = self.__stream.GetParameters().GetFloatValue("AcquisitionRate")
-                        result, bandwidth_val = self.__stream.GetParameters().GetFloatValue("Bandwidth")
+                        image_count_val = self.__stats.Get("BlockCount")
+                        frame_rate_val = self.__stats.Get("AcquisitionRate")
+                        bandwidth_val = self.__stats.Get("Bandwidth")
                
                         # 如果缓冲区包含图像，显示宽度和高度
                         width = 0
@@ -9,6 +9,7 @@
     1. 脚本依赖 `opencv-python` (cv2) 进行图像处理和显示。如果未安装，将无法显示图像。
     2. 仅支持 Mono8 和 RGB8 格式的图像进行 OpenCV 处理和显示。
     3. 演示了手动管理 `PvBuffer` 队列的过程（分配、入队、检索、释放）。
+    4. 帧率和带宽由 `StatsSampler` (lib/StatsSampler.py) 在后台定时采样，取帧循环只读缓存值。
 """
 #!/usr/bin/env python3
 '''
@@ -26,8 +27,11 @@ actions upon the buffer.
 import numpy as np
 import eBUS as eb
 import lib.PvSampleUtils as psu
+from lib.StatsSampler import StatsSampler
 
 BUFFER_COUNT = 16
+# 会话结束时导出流统计时间序列的 CSV 文件，None 表示只打印摘要
+STATS_FILE = None
 
 kb = psu.PvKb()
 opencv_is_available=True
@@ -129,14 +133,16 @@ def acquire_images(device, stream):
     # 获取流参数
     stream_params = stream.GetParameters()
 
-    # 映射一些 GenICam 流统计计数器
-    frame_rate = stream_params.Get("AcquisitionRate")
-    bandwidth = stream_params[ "Bandwidth" ]
+    # 流统计计数器由采样线程定时读取，取帧循环只读缓存值
+    stats = StatsSampler()
+    stats.Add("AcquisitionRate", stream_params)
+    stats.Add("Bandwidth", stream_params)
 
     # 启用流并发送 AcquisitionStart 命令
     print("Enabling streaming and sending AcquisitionStart command.")
     device.StreamEnable()
     start.Execute()
+    stats.Start()
 
     doodle = "|\\-|-/"
     doodle_index = 0
@@ -158,8 +164,8 @@ def acquire_images(device, stream):
                     process_pv_buffer(pvbuffer)
                 # ...
 
-                result, frame_rate_val = frame_rate.GetValue()
-                result, bandwidth_val = bandwidth.GetValue()
+                frame_rate_val = stats.Get("AcquisitionRate")
+                bandwidth_val = stats.Get("Bandwidth")
 
                 print(f"{doodle[doodle_index]} BlockID: {pvbuffer.GetBlockID():016d}", end='')
 
@@ -219,6 +225,10 @@ def acquire_images(device, stream):
             break;
 
     kb.stop()
+    stats.Stop()
+    print("\n" + stats.Summary())
+    if STATS_FILE:
+        stats.Dump(STATS_FILE)
     if opencv_is_available:
         cv2.destroyAllWindows()
 
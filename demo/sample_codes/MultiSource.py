@@ -9,6 +9,9 @@
     1. 脚本依赖 `opencv-python` (cv2) 进行图像显示（如果可用）。
     2. 演示了如何遍历 `SourceSelector` 枚举来发现所有源。
     3. 展示了多线程/多流管理的结构。
+    4. 所有源由 RetrievalScheduler (lib/RetrievalScheduler.py) 同时等待，缓冲区按到达顺序分发，
+       空闲的源不会因为轮询超时而推迟其他源；结束时打印每个源的分发延迟和公平性统计。
+    5. 帧率和带宽由 StatsSampler (lib/StatsSampler.py) 在后台定时采样，状态行只读缓存值。
 """
 #!/usr/bin/env python3
 
@@ -23,7 +26,10 @@
 '''
 
 import eBUS as eb
+import time
 import lib.PvSampleUtils as psu
+from lib.RetrievalScheduler import RetrievalScheduler
+from lib.StatsSampler import StatsSampler
 
 kb = psu.PvKb()
 
@@ -36,6 +42,7 @@ class Source:
     _device = None
     _stream = None
     _pipeline = None
+    _stats = None
     _connection_id = None
     _source = None
     _doodle_index = 0
@@ -86,11 +93,22 @@ class Source:
         self._pipeline.SetBufferCount(self._BUFFER_COUNT)
         print("Starting pipeline thread")
         self._pipeline.Start()
+
+        # 流统计由采样线程定时读取，GetStatistics() 只读缓存值
+        self._stats = StatsSampler()
+        self._stats.Add("AcquisitionRate", self._stream.GetParameters())
+        self._stats.Add("Bandwidth", self._stream.GetParameters())
+        self._stats.Start()
         return True
 
     def Close(self):
         print("Closing source", self._source)
 
+        if self._stats is not None:
+            self._stats.Stop()
+            print(self._stats.Summary())
+            self._stats = None
+
         print("Stopping pipeline thread")
         self._pipeline.Stop()
 
@@ -117,40 +135,26 @@ class Source:
 
         self._device.StreamDisable()
 
-    def RetrieveImages(self, timeout):
-        while True:
-            result, buffer, operational_result = self._pipeline.RetrieveNextBuffer(timeout)
-            if result.IsFailure():
-                return False
-            
-            self._doodle_index = self._doodle_index + 1
-            self._doodle_index %= self._DOODLE_LENGTH
-            
-            self._pipeline.ReleaseBuffer(buffer)
+    def GetPipeline(self):
+        return self._pipeline
 
-    def GetStatistics(self, statistics):
-        result, fps = self._stream.GetParameters().GetFloatValue("AcquisitionRate")
+    def GetName(self):
+        return self._source if self._source else "Source 0"
+
+    def OnBuffer(self, buffer, operational_result):
+        # 调度器分发的缓冲区，在这里处理图像；缓冲区由调度器归还管道
+        self._doodle_index = self._doodle_index + 1
+        self._doodle_index %= self._DOODLE_LENGTH
 
-        result, bandwidth = self._stream.GetParameters().GetFloatValue("Bandwidth")
-        bandwidth /= 1000000
+    def GetStatistics(self, statistics):
+        fps = self._stats.Get("AcquisitionRate")
+        bandwidth = self._stats.Get("Bandwidth") / 1000000
 
         if self._source:
             return statistics + "{0} : {1} {2:.1f} FPS {3:.1f} Mb/s ".format(self._source, self._DOODLE[self._doodle_index], fps, bandwidth)
         else:
             return statistics + "{0} : {1} {2:.1f} FPS {3:.1f} Mb/s ".format("Source 0: ", self._DOODLE[self._doodle_index], fps, bandwidth)
 
-    def GetRecommendedTimeout(self):
-        result, fps = self._stream.GetParameters().GetFloatValue("AcquisitionRate")
-        if fps == 0:
-            return 1
-
-        timeout = (1 / fps) * 1000
-        timeout /= 2
-        if timeout < 1:
-            timeout = 1
-
-        return timeout
-
     def SelectSource(self, stack):
         if self._source:
             stack.SetEnumValue("SourceSelector", self._source)
@@ -198,33 +202,41 @@ def AcquireImages():
     for source in sources:
         source.StartAcquisition()
 
-    # 检索图像
-    timeout = 1
-    new_timeout = 1000
+    # 所有源的管道由调度器同时等待，按到达顺序分发
+    scheduler = RetrievalScheduler()
+    for source in sources:
+        scheduler.Add(source, source.GetPipeline())
+    scheduler.Start()
+
     print("<press a key to stop streaming>")
     kb = psu.PvKb()
     kb.start()
-    statistics = ""
+    next_statistics = 0
     while not kb.is_stopping():
-        for source in sources:
-            source.RetrieveImages(timeout)
-            statistics = source.GetStatistics(statistics)
-
-            recommended_timeout = source.GetRecommendedTimeout()
-            if recommended_timeout < new_timeout:
-                new_timeout = recommended_timeout
-
-        # 清除上一行，打印并重置统计信息
-        print('\033[K', end='')
-        print(statistics, end='\r')
-        statistics = ""
+        ready = scheduler.Next(0.1)
+        if ready:
+            ready.key.OnBuffer(ready.buffer, ready.operational_result)
+            scheduler.Release(ready)
+
+        # 统计信息每 0.5 秒刷新一次，不再每个缓冲区都查询流参数
+        now = time.monotonic()
+        if now >= next_statistics:
+            next_statistics = now + 0.5
+            statistics = ""
+            for source in sources:
+                statistics = source.GetStatistics(statistics)
+            # 清除上一行，打印统计信息
+            print('\033[K', end='')
+            print(statistics, end='\r')
 
         if kb.kbhit():
             kb.getch()
             break
 
-    # 更新下一次执行的超时时间
-    timeout = new_timeout / (len(sources) + 0.5)
+    # 停止管道之前先停止调度器的等待线程
+    scheduler.Stop()
+    print()
+    print(scheduler.Summary(Source.GetName))
 
     for source in sources:
         source.StopAcquisition()
@@ -10,6 +10,7 @@
     1. 脚本依赖 `opencv-python` (cv2) 进行图像显示。
     2. 演示了 `PvPipelineEventSink` 的使用（通过 `my_pipeline_event_sink` 类）。
     3. 处理了多种 Payload 类型，是理解 eBUS SDK 数据接收的良好示例。
+    4. 帧率和带宽由 `StatsSampler` (lib/StatsSampler.py) 在后台定时采样，取帧循环只读缓存值。
 """
 #!/usr/bin/env python3
 
@@ -27,8 +28,11 @@ USB3 Vision device.
 import numpy as np
 import eBUS as eb
 import lib.PvSampleUtils as psu
+from lib.StatsSampler import StatsSampler
 
 BUFFER_COUNT=16
+# 会话结束时导出流统计时间序列的 CSV 文件，None 表示只打印摘要
+STATS_FILE = None
 
 kb = psu.PvKb()
 
@@ -103,21 +107,21 @@ def acquire_images(device, stream, pipeline):
     # 获取流参数
     stream_params = stream.GetParameters()
 
-    # 映射一些 GenICam 流统计计数器
-    frame_rate = stream_params.Get("AcquisitionRate")
-    bandwidth = stream_params[ "Bandwidth" ]
+    # 流统计计数器由采样线程定时读取，取帧循环只读缓存值
+    stats = StatsSampler()
+    stats.Add("AcquisitionRate", stream_params)
+    stats.Add("Bandwidth", stream_params)
 
     # 启用流并发送 AcquisitionStart 命令
     print("Enabling streaming and sending AcquisitionStart command.")
     device.StreamEnable()
     start.Execute()
+    stats.Start()
 
     doodle = "|\\-|-/"
     doodle_index = 0
     display_image = False
     warning_issued = False
-    frame_rate_val = frame_rate.GetValue()
-    bandwidth_val = bandwidth.GetValue()
     errors = 0
     decompression_filter = eb.PvDecompressionFilter()
 
@@ -134,8 +138,8 @@ def acquire_images(device, stream, pipeline):
                 # -----------------------------------------------------------------------------------------
                 # ...
 
-                result, frame_rate_val = frame_rate.GetValue()
-                result, bandwidth_val = bandwidth.GetValue()
+                frame_rate_val = stats.Get("AcquisitionRate")
+                bandwidth_val = stats.Get("Bandwidth")
 
                 print(f"{doodle[doodle_index]} BlockID: {pvbuffer.GetBlockID():016d}", end='')
 
@@ -220,6 +224,10 @@ def acquire_images(device, stream, pipeline):
             break;
 
     kb.stop()
+    stats.Stop()
+    print("\n" + stats.Summary())
+    if STATS_FILE:
+        stats.Dump(STATS_FILE)
     if opencv_is_available:
         cv2.destroyAllWindows()
 
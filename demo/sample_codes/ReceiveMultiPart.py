@@ -9,6 +9,8 @@
     1. 脚本依赖 `opencv-python` (cv2) 进行图像显示。
     2. 演示了 `PvMultiPartContainer` 的使用。
     3. 支持 Large Leader Trailer 模式（通过命令行参数 `-l` 或 `--large_leader_trailer` 启用）。
+    4. 所有源由 RetrievalScheduler (lib/RetrievalScheduler.py) 同时等待，缓冲区按到达顺序分发；
+       显示按 _DEFAULT_FPS 限速，未到显示时间的缓冲区直接归还，不再在分发线程中忙等。
 """
 #!/usr/bin/env python3
 
@@ -24,6 +26,7 @@
 
 import eBUS as eb
 import lib.PvSampleUtils as psu
+from lib.RetrievalScheduler import RetrievalScheduler
 import time
 import sys, getopt
 
@@ -141,28 +144,29 @@ class Source:
 
         self._device.StreamDisable()
 
-    def RetrieveImages(self, timeout):
+    def GetPipeline(self):
+        return self._pipeline
+
+    def GetName(self):
+        return self._source if self._source else "Source 0"
+
+    def OnBuffer(self, buffer, operational_result):
+        # 调度器分发的缓冲区，缓冲区由调度器归还管道
         number_of_parts = 0
         is_multi_part = False
-        result, buffer, operational_result = self._pipeline.RetrieveNextBuffer(timeout)
-        if not result.IsOK():
-            return False, result.GetCodeString()
         if buffer.GetPayloadType() == eb.PvPayloadTypeMultiPart:
             is_multi_part = True
             number_of_parts = buffer.GetMultiPartContainer().GetPartCount()
         if operational_result == eb.PV_OK and buffer.GetPayloadType() == eb.PvPayloadTypeMultiPart:
-
-            while not self._stabilizer.IsTimeToDisplay(self._DEFAULT_FPS):
-                time.sleep(0.0001)
-            self.DisplayMultiPart(buffer)
+            # 未到显示时间时跳过显示，不阻塞其他源的分发
+            if self._stabilizer.IsTimeToDisplay(self._DEFAULT_FPS):
+                self.DisplayMultiPart(buffer)
 
             # 在这里，您通常会处理或操作图像
 
             self._doodle_index = self._doodle_index + 1
             self._doodle_index %= self._DOODLE_LENGTH
 
-        self._pipeline.ReleaseBuffer(buffer)
-        timeout = 0
         return is_multi_part, number_of_parts
 
     def GetStatistics(self, statistics, ismultipart, parts):
@@ -180,18 +184,6 @@ class Source:
         else:
             return ""
 
-    def GetRecommendedTimeout(self):
-        result, fps = self._stream.GetParameters().GetFloatValue("AcquisitionRate")
-        if result.IsFailure() or fps == 0:
-            return 1
-
-        timeout = (1 / fps) * 1000
-        timeout /= 2
-        if timeout < 1:
-            timeout = 1
-
-        return timeout
-
     def SelectSource(self, stack):
         if self._source:
             stack.SetEnumValue("SourceSelector", self._source)
@@ -262,38 +254,48 @@ def AcquireImages(argv):
     for source in sources:
         source.StartAcquisition()
 
-    # 检索图像
-    timeout = 1
-    new_timeout = 1000
+    # 所有源的管道由调度器同时等待，按到达顺序分发
+    scheduler = RetrievalScheduler()
+    for source in sources:
+        scheduler.Add(source, source.GetPipeline())
+    scheduler.Start()
+
     print("<press a key to stop streaming>")
     kb = psu.PvKb()
     kb.start()
-    statistics = ""
+    parts = {source: (False, 0) for source in sources}
+    next_statistics = 0
     while not kb.is_stopping():
-        for source in sources:
-            is_multipart, parts_number = source.RetrieveImages(timeout)
-            statistics = source.GetStatistics(statistics, is_multipart, parts_number)
-
-            recommended_timeout = source.GetRecommendedTimeout()
-            if recommended_timeout < new_timeout:
-                new_timeout = recommended_timeout
-
-        # 清除上一行，打印并重置统计信息
-        sys.stdout.write("\033[K")
-        print('\033[K', end='')
-        print(statistics, end='\r')
-        statistics = ""
+        ready = scheduler.Next(0.1)
+        if ready:
+            parts[ready.key] = ready.key.OnBuffer(ready.buffer, ready.operational_result)
+            scheduler.Release(ready)
+
+        # 统计信息每 0.5 秒刷新一次，不再每个缓冲区都查询流参数
+        now = time.monotonic()
+        if now >= next_statistics:
+            next_statistics = now + 0.5
+            statistics = ""
+            for source in sources:
+                is_multipart, parts_number = parts[source]
+                statistics = source.GetStatistics(statistics, is_multipart, parts_number)
+            # 清除上一行，打印统计信息
+            sys.stdout.write("\033[K")
+            print('\033[K', end='')
+            print(statistics, end='\r')
 
         if kb.kbhit():
             kb.getch()
             break
 
+    # 停止管道之前先停止调度器的等待线程
+    scheduler.Stop()
+    print()
+    print(scheduler.Summary(Source.GetName))
+
     if opencv_is_available:
         cv2.destroyAllWindows()
 
-    # 更新下一次执行的超时时间
-    timeout = new_timeout / (len(sources) + 0.5)
-
     for source in sources:
         source.StopAcquisition()
 
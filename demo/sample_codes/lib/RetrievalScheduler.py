@@ -0,0 +1,166 @@
+"""
+文件名称: RetrievalScheduler.py
+功能描述:
+    多源取帧调度器：同时等待所有 PvPipeline，哪个源的缓冲区先到就先分发哪个。
+    替代 MultiSource.py / ReceiveMultiPart.py 中按顺序轮询每个源的 RetrieveImages(timeout)：
+    轮询时一个没有数据的源会把整个超时时间加到其他源的延迟上，而且每轮都要查询流参数重新计算超时。
+    1. 每个管道一个轻量等待线程，只做 RetrieveNextBuffer 和入队，所有源共用一个就绪队列。
+    2. 分发线程 (通常是主线程) 调用 Next() 按到达顺序取出缓冲区，处理完后 Release() 归还管道。
+    3. 统计每个源的分发数、帧率、从到达到分发的延迟 (p50/p99/max) 和就绪队列中的最长等待，
+       以及各源平均延迟的 Jain 公平性指数 (1.0 表示所有源等待时间相同)。
+
+使用方法:
+    scheduler = RetrievalScheduler()
+    for source in sources:
+        scheduler.Add(source, source.GetPipeline())
+    scheduler.Start()
+    ready = scheduler.Next(0.1)          # None 表示 0.1 秒内没有任何源到达
+    if ready:
+        ready.key.OnBuffer(ready.buffer, ready.operational_result)
+        scheduler.Release(ready)
+    scheduler.Stop()                     # 必须在 PvPipeline.Stop() 之前调用
+
+特别注意事项:
+    1. 等待线程依赖 RetrieveNextBuffer 在阻塞期间释放 GIL (与其他阻塞的 eBUS 调用相同)。
+    2. 缓冲区在 Release() 之前一直属于调用方；处理过慢时管道会因没有空闲缓冲区而丢帧，
+       而不是让就绪队列无限增长。
+    3. 等待线程每 timeout_ms 毫秒检查一次停止标志，Stop() 最多等待这么久。
+"""
+
+import time
+import queue
+import threading
+from collections import deque
+
+DEFAULT_TIMEOUT_MS = 1000
+LATENCY_SAMPLES = 1000  # 每个源保留最近多少个延迟样本用于计算分位数
+
+
+class ReadyBuffer:
+    """就绪队列中的一项：源、管道、缓冲区和到达时刻。"""
+    __slots__ = ("key", "pipeline", "buffer", "operational_result", "arrival_ns")
+
+    def __init__(self, key, pipeline, buffer, operational_result, arrival_ns):
+        self.key = key
+        self.pipeline = pipeline
+        self.buffer = buffer
+        self.operational_result = operational_result
+        self.arrival_ns = arrival_ns
+
+
+class SourceStatistics:
+    """单个源的分发统计 (只在分发线程中更新)。"""
+    def __init__(self):
+        self.dispatched = 0
+        self.first_ns = None
+        self.last_ns = None
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.max_latency_ns = 0
+        self.latency_total_ns = 0
+
+    def Record(self, arrival_ns, dispatch_ns):
+        latency = dispatch_ns - arrival_ns
+        self.dispatched += 1
+        if self.first_ns is None:
+            self.first_ns = arrival_ns
+        self.last_ns = arrival_ns
+        self.latencies.append(latency)
+        self.latency_total_ns += latency
+        if latency > self.max_latency_ns:
+            self.max_latency_ns = latency
+
+    def Fps(self):
+        if self.dispatched < 2 or self.last_ns == self.first_ns:
+            return 0.0
+        return (self.dispatched - 1) * 1e9 / (self.last_ns - self.first_ns)
+
+    def MeanLatencyMs(self):
+        return self.latency_total_ns / self.dispatched / 1e6 if self.dispatched else 0.0
+
+    def PercentileMs(self, q):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))] / 1e6
+
+
+class RetrievalScheduler:
+
+    def __init__(self, timeout_ms=DEFAULT_TIMEOUT_MS):
+        self._timeout_ms = timeout_ms
+        self._ready = queue.Queue()
+        self._pipelines = []  # (key, pipeline)
+        self._threads = []
+        self._stopping = threading.Event()
+        self._statistics = {}
+        self._timeouts = {}
+
+    def Add(self, key, pipeline):
+        """注册一个源。key 原样出现在 ReadyBuffer.key 中，通常就是调用方的 Source 对象。"""
+        self._pipelines.append((key, pipeline))
+        self._statistics[key] = SourceStatistics()
+        self._timeouts[key] = 0
+
+    def Start(self):
+        self._stopping.clear()
+        for key, pipeline in self._pipelines:
+            thread = threading.Thread(target=self._Wait, args=(key, pipeline), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _Wait(self, key, pipeline):
+        while not self._stopping.is_set():
+            result, buffer, operational_result = pipeline.RetrieveNextBuffer(self._timeout_ms)
+            if result.IsFailure():
+                self._timeouts[key] += 1
+                continue
+            self._ready.put(ReadyBuffer(key, pipeline, buffer, operational_result, time.perf_counter_ns()))
+
+    def Next(self, timeout=None):
+        """按到达顺序取出下一个就绪的缓冲区，timeout 秒内没有时返回 None。"""
+        try:
+            ready = self._ready.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        self._statistics[ready.key].Record(ready.arrival_ns, time.perf_counter_ns())
+        return ready
+
+    def Release(self, ready):
+        ready.pipeline.ReleaseBuffer(ready.buffer)
+
+    def Stop(self):
+        """停止等待线程，并把就绪队列中尚未分发的缓冲区归还管道。"""
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        while True:
+            try:
+                self.Release(self._ready.get_nowait())
+            except queue.Empty:
+                break
+
+    def Fairness(self):
+        """各源平均分发延迟的 Jain 公平性指数，范围 (0, 1]，没有数据时为 1.0。"""
+        means = [s.MeanLatencyMs() for s in self._statistics.values() if s.dispatched]
+        if not means or sum(means) == 0:
+            return 1.0
+        return sum(means) ** 2 / (len(means) * sum(m * m for m in means))
+
+    def GetStatistics(self, key):
+        s = self._statistics[key]
+        return {"dispatched": s.dispatched, "fps": s.Fps(), "timeouts": self._timeouts[key],
+                "latency_p50_ms": s.PercentileMs(50), "latency_p99_ms": s.PercentileMs(99),
+                "latency_max_ms": s.max_latency_ns / 1e6}
+
+    def Summary(self, name=str):
+        """每个源一行的统计摘要，name(key) 给出源的显示名称。"""
+        lines = []
+        for key, _ in self._pipelines:
+            st = self.GetStatistics(key)
+            lines.append("{0}: {1} buffers {2:.1f} FPS, dispatch latency p50 {3:.2f} ms p99 {4:.2f} ms "
+                         "max {5:.2f} ms, {6} timeouts".format(
+                             name(key), st["dispatched"], st["fps"], st["latency_p50_ms"],
+                             st["latency_p99_ms"], st["latency_max_ms"], st["timeouts"]))
+        lines.append("Fairness (Jain, mean latency): {0:.3f}".format(self.Fairness()))
+        return "\n".join(lines)
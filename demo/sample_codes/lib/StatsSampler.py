@@ -0,0 +1,119 @@
+"""
+文件名称: StatsSampler.py
+功能描述:
+    流/设备统计计数器采样器：在独立线程中按固定间隔读取一组 GenICam 计数器 (例如流的 AcquisitionRate、
+    Bandwidth、BlockCount，或设备的温度等)，取帧循环只读缓存值，不再每个缓冲区都访问 GenICam 节点。
+    1. Add() 时按名称映射一次节点，之后每次采样直接 GetValue()，读取失败的计数器保留上一次的值。
+    2. 最新值以字典整体替换的方式发布，Get() 只是一次字典查找，不加锁。
+    3. 每次采样的 (时间, 各计数器值) 存入定长环形缓冲区 (history 个样本)，
+       Series() 取单个计数器的时间序列，Dump() 在会话结束时导出 CSV，Summary() 给出最小/平均/最大值。
+
+使用方法:
+    sampler = StatsSampler(interval=0.5)
+    sampler.Add("AcquisitionRate", stream.GetParameters())
+    sampler.Add("Bandwidth", stream.GetParameters())
+    sampler.Start()
+    fps = sampler.Get("AcquisitionRate")      # 取帧循环中
+    sampler.Stop(); print(sampler.Summary()); sampler.Dump("stream_stats.csv")
+
+特别注意事项:
+    1. 必须在关闭流或断开设备之前调用 Stop()，否则采样线程可能访问已释放的参数。
+    2. 缓存值最多滞后 interval 秒；AcquisitionRate、Bandwidth 本身就是 SDK 平滑后的统计值，显示用足够。
+"""
+
+import os
+import csv
+import time
+import threading
+from collections import deque
+
+DEFAULT_INTERVAL = 0.5  # 秒
+DEFAULT_HISTORY = 7200  # 样本数 (0.5 秒间隔约 1 小时)
+
+
+class StatsSampler:
+
+    def __init__(self, interval=DEFAULT_INTERVAL, history=DEFAULT_HISTORY):
+        self._interval = interval
+        self._names = []
+        self._nodes = []
+        self._latest = {}
+        self._history = deque(maxlen=history)
+        self._start_time = None
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def Add(self, name, parameters, node_name=None):
+        """添加一个计数器：parameters 为 stream.GetParameters() 或 device.GetParameters()，节点不存在时返回 False。"""
+        node = parameters.Get(node_name if node_name else name)
+        if node is None:
+            print(f"Statistics counter {node_name if node_name else name} not available")
+            return False
+        self._names.append(name)
+        self._nodes.append(node)
+        self._latest = dict(self._latest, **{name: 0})
+        return True
+
+    def _Sample(self):
+        values = []
+        latest = self._latest
+        for name, node in zip(self._names, self._nodes):
+            result, value = node.GetValue()
+            values.append(value if result.IsOK() else latest.get(name, 0))
+        now = time.monotonic()
+        self._history.append((now - self._start_time, values))
+        # 整体替换，读取方无需加锁
+        self._latest = dict(zip(self._names, values))
+
+    def _Run(self):
+        next_time = time.monotonic()
+        while True:
+            next_time += self._interval
+            if self._stopping.wait(max(0.0, next_time - time.monotonic())):
+                break
+            self._Sample()
+
+    def Start(self):
+        """先同步采样一次 (Get() 立即有值)，再启动采样线程。"""
+        if self._start_time is None:
+            self._start_time = time.monotonic()
+        self._stopping.clear()
+        self._Sample()
+        self._thread = threading.Thread(target=self._Run, daemon=True)
+        self._thread.start()
+
+    def Stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def Get(self, name, default=0):
+        """计数器的最新缓存值。"""
+        return self._latest.get(name, default)
+
+    def Series(self, name):
+        """计数器在环形缓冲区中的时间序列 [(秒, 值), ...]，时间从 Start() 起算。"""
+        column = self._names.index(name)
+        return [(t, values[column]) for t, values in list(self._history)]
+
+    def Summary(self):
+        lines = []
+        samples = list(self._history)
+        for column, name in enumerate(self._names):
+            values = [v[column] for _, v in samples]
+            if values:
+                lines.append(f"{name}: min {min(values):.6g} mean {sum(values) / len(values):.6g} "
+                             f"max {max(values):.6g} ({len(values)} samples)")
+        return "\n".join(lines)
+
+    def Dump(self, path, append=False):
+        """把环形缓冲区导出为 CSV (time_s + 每个计数器一列)；append=True 时追加到已有文件 (文件为空时才写表头)。"""
+        write_header = not (append and os.path.exists(path) and os.path.getsize(path) > 0)
+        with open(path, "a" if append else "w", newline="") as f:
+            writer = csv.writer(f)
+            if write_header:
+                writer.writerow(["time_s"] + self._names)
+            for t, values in list(self._history):
+                writer.writerow([f"{t:.3f}"] + values)
+        print(f"Statistics written to {path} ({len(self._history)} samples)")
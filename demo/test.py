@@ -6,14 +6,18 @@
     1. 连接设备并配置全局参数（如采集模式、帧率等）。
     2. 枚举设备支持的所有源（Source），并为每个源创建一个采集流（SourceStream）。
     3. 使用多线程分别从每个源获取图像数据。
-    4. 将采集到的原始数据（.bin）和元数据（.json）异步保存到磁盘。
+    4. 将采集到的原始数据异步追加写入分段容器（segment_*.dat），元数据写入二进制帧索引 frames.idx，
+       包括设备时间戳、主机单调接收时间和换算到主机时钟的对齐时间戳 (clock_sync.py)。
     5. 实时显示采集到的图像（每隔一定帧数刷新一次）。
+    6. 设备参数由声明式配置 PARAMETER_PROFILE 一次写入 (genicam_params.py)：节点句柄按设备缓存，
+       按依赖顺序写入，已经是目标值的参数跳过；结束准备后打印连接、配置、打开和启动各阶段的耗时。
 
 特别注意事项:
     1. 需要安装 eBUS SDK 的 Python 绑定，并确保 `eBUS` 模块可用。
     2. 脚本依赖 `../sample/lib` 目录下的 `PvSampleUtils` 库，请确保路径正确。
     3. `SAVE_DIR` 变量定义了数据保存的根目录，请根据实际情况修改。
-    4. 脚本默认配置了 "Source0", "Source1", "Source2" 的参数，请确保相机支持这些源。
+    4. PARAMETER_PROFILE 默认配置了 "Source0", "Source1", "Source2" 的参数，请确保相机支持这些源
+       (不支持的参数在配置报告中列为失败，不影响其他参数)。
     5. 按 ESC 键可以停止采集并退出程序。
 """
 
@@ -22,7 +26,6 @@ import eBUS as eb
 import sys
 import os
 import time
-import json
 import numpy as np
 import cv2
 import threading
@@ -31,11 +34,27 @@ import queue
 # 将 sample/lib 目录添加到系统路径，以便导入 PvSampleUtils
 sys.path.append("../sample/lib")
 import PvSampleUtils as psu
-
-# 定义缓冲区数量
-BUFFER_COUNT = 512
+# 将仓库根目录添加到系统路径，以便导入 segment_store / frame_index
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import segment_store
+import frame_index
+import buffer_budget
+import clock_sync
+import genicam_params
+
+# 所有源的缓冲池总内存预算 (字节)，None 表示取物理内存的 1/4；缓冲区数量按预算和帧率计算
+MEMORY_BUDGET = None
 # 定义数据保存目录
 SAVE_DIR = "D:/Yuyuan/Sweetpotato/G8/G8_S3/"
+# 设备参数配置：global 为全局参数，sources 为每个源的参数 (写入前切换 SourceSelector)
+PARAMETER_PROFILE = {
+    "global": {
+        "AcquisitionMode": "Continuous",  # 连续采集
+        "TriggerMode": "Off",  # 关闭触发模式
+        "AcquisitionFrameRate": 30,  # 采集帧率
+    },
+    "sources": {name: {"ExposureTime": 5000} for name in ["Source0", "Source1", "Source2"]},
+}
 # 初始化键盘监听工具
 kb = psu.PvKb()
 
@@ -53,15 +72,12 @@ def save_worker():
         # 如果获取到 None，表示接收到停止信号，退出循环
         if item is None:
             break
-        # 解包数据：bin文件路径，meta文件路径，二进制数据，元数据字典
-        bin_path, meta_path, buffer_data, meta = item
+        # 解包数据：段写入器，段号，段内偏移，二进制数据，block_id，时间戳
+        source, segment, offset, buffer_data, record = item
         try:
-            # 将二进制数据写入 .bin 文件
-            with open(bin_path, "wb") as f:
-                f.write(buffer_data)
-            # 将元数据写入 .json 文件
-            with open(meta_path, "w") as f:
-                json.dump(meta, f, indent=4)
+            # 将二进制数据写入采集线程预留好的段内位置，写完后追加帧索引记录
+            source.writer.write(segment, offset, buffer_data, record[0], record[1])
+            source.index.append(*record)
         except Exception as e:
             # 捕获并打印保存过程中的错误
             print(f"[Save Error] {e}")
@@ -91,49 +107,62 @@ class SourceStream:
 
         self.frame_count = 0
         self.display_interval = 5  # 每 5 帧更新一次显示
-
-    def open(self):
+        # 设备时钟模型和节点缓存 (同一设备的所有源共用)
+        self.clock = clock_sync.clock_for(device)
+        self.params = genicam_params.cache_for(device)
+        # 帧索引写入器和分段容器写入器
+        self.index = None
+        self.writer = None
+
+    def open(self, memory_budget):
         """
-        打开流并配置管道。
+        打开流并配置管道。memory_budget 为该源缓冲池可用的内存字节数。
         """
-        # 使用 PvGenStateStack 临时切换参数上下文
-        stack = eb.PvGenStateStack(self.device.GetParameters())
-        # 设置 SourceSelector 为当前源名称，以便获取该源的参数
-        stack.SetEnumValue("SourceSelector", self.source_name)
-
-        # 尝试获取 SourceIDValue
-        result, channel = self.device.GetParameters().GetIntegerValue("SourceIDValue")
-        if result.IsFailure():
-            # 如果失败，尝试获取 SourceStreamChannel
-            result, channel = self.device.GetParameters().GetIntegerValue("SourceStreamChannel")
-            if result.IsFailure():
-                print(f"[{self.source_name}] Cannot determine stream channel.")
+        # 切换参数上下文到当前源，通道号、PayloadSize 和帧率都按源读取
+        with self.params.selected(self.source_name):
+            # 尝试获取 SourceIDValue
+            ok, channel = self.params.get("SourceIDValue")
+            if not ok:
+                # 如果失败，尝试获取 SourceStreamChannel
+                ok, channel = self.params.get("SourceStreamChannel")
+                if not ok:
+                    print(f"[{self.source_name}] Cannot determine stream channel.")
+                    return False
+
+            # 创建 PvStreamGEV 对象
+            self.stream = eb.PvStreamGEV()
+            # 打开流：使用连接ID和通道号
+            if self.stream.Open(self.connection_id, 0, channel).IsFailure():
+                print(f"[{self.source_name}] Failed to open stream.")
                 return False
 
-        # 创建 PvStreamGEV 对象
-        self.stream = eb.PvStreamGEV()
-        # 打开流：使用连接ID和通道号
-        if self.stream.Open(self.connection_id, 0, channel).IsFailure():
-            print(f"[{self.source_name}] Failed to open stream.")
-            return False
-
-        # 获取本地 IP 和端口
-        ip = self.stream.GetLocalIPAddress()
-        port = self.stream.GetLocalPort()
-        # 配置设备将流发送到此 IP 和端口
-        self.device.SetStreamDestination(ip, port, channel)
-
-        # 获取 PayloadSize（图像数据大小）
-        payload_size = self.device.GetPayloadSize()
+            # 获取本地 IP 和端口
+            ip = self.stream.GetLocalIPAddress()
+            port = self.stream.GetLocalPort()
+            # 配置设备将流发送到此 IP 和端口
+            self.device.SetStreamDestination(ip, port, channel)
+
+            # 获取 PayloadSize（图像数据大小）
+            payload_size = self.device.GetPayloadSize()
+            ok, frame_rate = self.params.get("AcquisitionFrameRate")
+            if not ok:
+                frame_rate = 0
+
         # 创建 PvPipeline 用于管理缓冲区
         self.pipeline = eb.PvPipeline(self.stream)
         # 设置缓冲区大小
         self.pipeline.SetBufferSize(payload_size)
-        # 设置缓冲区数量
-        self.pipeline.SetBufferCount(BUFFER_COUNT)
+        # 按 payload 大小、帧率和内存预算设置缓冲区数量
+        buffer_count = buffer_budget.plan_buffer_count(payload_size, frame_rate, memory_budget)
+        print(f"[{self.source_name}] Buffer count: {buffer_count}")
+        self.pipeline.SetBufferCount(buffer_count)
         # 启动管道（开始预分配缓冲区）
         self.pipeline.Start()
 
+        # 打开帧索引和分段容器
+        self.index = frame_index.FrameIndexWriter(self.save_path)
+        self.writer = segment_store.SegmentWriter(self.save_path)
+
         return True
 
     def start_acquisition(self):
@@ -141,24 +170,22 @@ class SourceStream:
         开始采集。
         """
         # 切换参数上下文到当前源
-        stack = eb.PvGenStateStack(self.device.GetParameters())
-        stack.SetEnumValue("SourceSelector", self.source_name)
-        # 启用流
-        self.device.StreamEnable()
-        # 执行 AcquisitionStart 命令
-        self.device.GetParameters().Get("AcquisitionStart").Execute()
+        with self.params.selected(self.source_name):
+            # 启用流
+            self.device.StreamEnable()
+            # 执行 AcquisitionStart 命令 (节点句柄已缓存)
+            self.params.execute("AcquisitionStart")
 
     def stop_acquisition(self):
         """
         停止采集。
         """
         # 切换参数上下文到当前源
-        stack = eb.PvGenStateStack(self.device.GetParameters())
-        stack.SetEnumValue("SourceSelector", self.source_name)
-        # 执行 AcquisitionStop 命令
-        self.device.GetParameters().Get("AcquisitionStop").Execute()
-        # 禁用流
-        self.device.StreamDisable()
+        with self.params.selected(self.source_name):
+            # 执行 AcquisitionStop 命令
+            self.params.execute("AcquisitionStop")
+            # 禁用流
+            self.device.StreamDisable()
 
     def close(self):
         """
@@ -168,6 +195,11 @@ class SourceStream:
             self.pipeline.Stop()
         if self.stream:
             self.stream.Close()
+        if self.index:
+            self.index.close()
+        if self.writer:
+            # 队列中剩余的帧写完后，段文件会自动截断并关闭
+            self.writer.close()
 
     def run(self):
         """
@@ -177,6 +209,8 @@ class SourceStream:
         while self.running and not kb.is_stopping():
             # 从管道中获取下一个缓冲区，超时时间 1000ms
             result, buffer, op_result = self.pipeline.RetrieveNextBuffer(1000)
+            # 主机单调时钟下的接收时间
+            host_rx_ns = time.perf_counter_ns()
             if result.IsOK() and op_result.IsOK():
                 # 获取图像接口
                 image = buffer.GetImage()
@@ -186,23 +220,20 @@ class SourceStream:
                     ptr = image.GetDataPointer()
                     block_id = buffer.GetBlockID()
                     timestamp = int(time.time() * 1000)
+                    # 设备曝光时间戳，并更新设备/主机时钟模型
+                    device_ts = buffer.GetTimestamp()
+                    self.clock.observe(device_ts, host_rx_ns, self.source_name)
 
-                    # 构造保存路径
-                    bin_path = os.path.join(self.save_path, f"frame_{block_id}_{timestamp}.bin")
-                    meta_path = bin_path.replace(".bin", ".json")
                     # 获取缓冲区数据（切片）
-                    buffer_data = ptr[:buffer.GetSize()]
-                    # 构造元数据
-                    meta = {
-                        "block_id": int(block_id),
-                        "timestamp": timestamp,
-                        "width": width,
-                        "height": height,
-                        "pixel_type": int(pixel_type),
-                        "payload_size": int(buffer.GetSize())
-                    }
+                    buffer_size = buffer.GetSize()
+                    buffer_data = ptr[:buffer_size]
+                    # 在段文件中预留位置，并记录元数据
+                    volume, segment, offset = self.writer.reserve(buffer_size)
+                    record = (block_id, timestamp, device_ts, offset, buffer_size,
+                              width, height, int(pixel_type), segment, volume,
+                              0, buffer_size, 0, 0, host_rx_ns, self.clock.to_host(device_ts))
                     # 将数据放入保存队列
-                    save_queue.put((bin_path, meta_path, buffer_data, meta))
+                    save_queue.put((self, segment, offset, buffer_data, record))
 
                     # 处理图像用于显示
                     np_image = None
@@ -268,31 +299,31 @@ def main():
     if not connection_id:
         return
 
-    # 连接设备
+    # 连接设备 (记录从连接到开始采集各阶段的耗时)
+    setup_start = time.perf_counter()
     result, device = eb.PvDevice.CreateAndConnect(connection_id)
     if result.IsFailure():
         print("❌ Failed to connect to device.")
         return
+    setup_times = {"connect": time.perf_counter() - setup_start}
 
-    # === 全局参数设置 ===
-    params = device.GetParameters()
-    # 设置采集模式为连续
-    params.Get("AcquisitionMode").SetValue("Continuous")
-    # 关闭触发模式
-    params.Get("TriggerMode").SetValue("Off")
-    # 设置采集帧率
-    params.Get("AcquisitionFrameRate").SetValue(30)
-
-    # 为每个源设置曝光时间
-    for name in ["Source0", "Source1", "Source2"]:
-        params.Get("SourceSelector").SetValue(name)
-        params.Get("ExposureTime").SetValue(5000)
+    # === 参数配置 (全局参数 + 每个源的参数) ===
+    params = genicam_params.cache_for(device)
+    report = genicam_params.apply_profile(params, PARAMETER_PROFILE)
+    print(genicam_params.format_report(report))
+    setup_times["profile"] = report["seconds"]
 
     # === 枚举并打开源 ===
+    t = time.perf_counter()
     sources = []
     # 获取 SourceSelector 枚举参数
     selector = device.GetParameters().GetEnum("SourceSelector")
     result, count = selector.GetEntriesCount()
+    # 总预算按源数量平分
+    if MEMORY_BUDGET is None:
+        memory_budget = buffer_budget.default_memory_budget(count)
+    else:
+        memory_budget = MEMORY_BUDGET // max(1, count)
     # 遍历所有源
     for i in range(count):
         result, entry = selector.GetEntryByIndex(i)
@@ -302,17 +333,23 @@ def main():
                 # 为每个源创建 SourceStream 对象
                 stream = SourceStream(device, connection_id, name)
                 # 尝试打开流
-                if stream.open():
+                if stream.open(memory_budget):
                     sources.append(stream)
 
     if not sources:
         print("❌ No source streams opened.")
         return
+    setup_times["open"] = time.perf_counter() - t
     print("\n⏹ Starting all streams...")
     # 启动所有流的采集和线程
+    t = time.perf_counter()
     for s in sources:
         s.start_acquisition()
         s.start_thread()
+    setup_times["start"] = time.perf_counter() - t
+    print("Setup: " + ", ".join(f"{k} {v * 1000:.1f} ms" for k, v in setup_times.items()) +
+          f", total {(time.perf_counter() - setup_start) * 1000:.1f} ms "
+          f"({params.resolved} nodes resolved, {params.selector_writes} selector writes)")
 
     # 启动键盘监听
     kb.start()
@@ -327,6 +364,9 @@ def main():
     for s in sources:
         s.stop_thread()
         s.stop_acquisition()
+    # 等待保存队列写完，再关闭帧索引和段文件
+    save_queue.join()
+    for s in sources:
         s.close()
 
     # 发送停止信号给保存线程
@@ -338,6 +378,7 @@ def main():
     print("✅ Done.")
     # 断开设备连接
     device.Disconnect()
+    genicam_params.forget(device)
     eb.PvDevice.Free(device)
 
 if __name__ == "__main__":
@@ -0,0 +1,186 @@
+"""
+文件名称: frame_codec.py
+功能描述:
+    录制链路中可选的无损压缩阶段。
+    1. 编解码器注册表：内置 raw / zlib / lzma (标准库)，安装了 lz4 或 zstandard 时自动注册更快的编解码器，
+       也可以用 register_codec() 注册自定义编解码器。编解码器 ID 会写入帧索引，回放时自动解码。
+    2. CompressionStage 位于 SourceStream.run 与保存线程池之间：采集线程只提交引用，
+       压缩在线程池 (默认，zlib/lzma 压缩时会释放 GIL) 或进程池中完成，线程数默认等于 CPU 核数。
+    3. 每帧的压缩后大小和压缩 CPU 时间写入帧索引，压缩比 = payload_size / stored_size。
+
+特别注意事项:
+    1. 压缩完成后原始 PvBuffer 立即归还管道，不必等待写盘。
+    2. 压缩后反而变大的帧按 raw 保存，避免不可压缩数据浪费空间。
+    3. 进程池模式需要把帧数据拷贝到子进程，只在压缩非常耗 CPU (例如 lzma) 时才划算。
+"""
+
+import os
+import time
+import zlib
+import lzma
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import frame_gaps
+
+Codec = namedtuple("Codec", "name id compress decompress")
+
+_CODECS_BY_NAME = {}
+_CODECS_BY_ID = {}
+
+CODEC_RAW = 0
+
+
+def register_codec(name, codec_id, compress, decompress):
+    """注册一个编解码器。codec_id 会写入帧索引，已录制的数据依赖它解码，注册后不要再修改。"""
+    if codec_id in _CODECS_BY_ID and _CODECS_BY_ID[codec_id].name != name:
+        raise ValueError(f"Codec id {codec_id} already registered as {_CODECS_BY_ID[codec_id].name}")
+    codec = Codec(name, codec_id, compress, decompress)
+    _CODECS_BY_NAME[name] = codec
+    _CODECS_BY_ID[codec_id] = codec
+    return codec
+
+
+def get_codec(name_or_id):
+    table = _CODECS_BY_ID if isinstance(name_or_id, int) else _CODECS_BY_NAME
+    try:
+        return table[name_or_id]
+    except KeyError:
+        raise ValueError(f"Unknown codec: {name_or_id}") from None
+
+
+def available_codecs():
+    return sorted(_CODECS_BY_NAME)
+
+
+def decode(codec_id, data, payload_size):
+    """把段文件中存储的数据还原为原始 payload；raw 数据原样返回 (零拷贝)。"""
+    if codec_id == CODEC_RAW:
+        return data
+    raw = get_codec(codec_id).decompress(data)
+    if len(raw) != payload_size:
+        raise ValueError(f"Decoded size {len(raw)} != payload size {payload_size}")
+    return raw
+
+
+# === 内置编解码器 ===
+register_codec("raw", CODEC_RAW, bytes, bytes)
+register_codec("zlib", 1, lambda d: zlib.compress(d, 1), zlib.decompress)
+register_codec("lzma", 2, lambda d: lzma.compress(d, preset=0), lzma.decompress)
+
+# === 可选的第三方编解码器 ===
+try:
+    import lz4.frame
+    register_codec("lz4", 3, lz4.frame.compress, lz4.frame.decompress)
+except ImportError:
+    pass
+
+try:
+    import zstandard
+    _zstd_local = threading.local()
+
+    def _zstd_compress(data):
+        # ZstdCompressor 不是线程安全的，每个线程各用一个
+        if not hasattr(_zstd_local, "c"):
+            _zstd_local.c = zstandard.ZstdCompressor(level=1)
+            _zstd_local.d = zstandard.ZstdDecompressor()
+        return _zstd_local.c.compress(data)
+
+    def _zstd_decompress(data):
+        if not hasattr(_zstd_local, "d"):
+            _zstd_local.c = zstandard.ZstdCompressor(level=1)
+            _zstd_local.d = zstandard.ZstdDecompressor()
+        return _zstd_local.d.decompress(data)
+
+    register_codec("zstd", 4, _zstd_compress, _zstd_decompress)
+except ImportError:
+    pass
+
+
+def compress_frame(codec_name, data):
+    """压缩一帧，返回 (编解码器 ID, 压缩后数据, CPU 秒数)。压缩后更大时退回 raw。"""
+    codec = get_codec(codec_name)
+    start = time.thread_time()
+    out = codec.compress(data)
+    cpu = time.thread_time() - start
+    if len(out) >= memoryview(data).nbytes:
+        return CODEC_RAW, None, cpu
+    return codec.id, out, cpu
+
+
+class CompressionStage:
+    """
+    压缩线程/进程池。submit() 在采集线程调用，压缩完成后通过 pool.store_frame() 交给保存线程池。
+    同时在压缩中的帧数受 max_pending 限制，超过时 submit() 返回 False (由调用方计为保存丢弃)。
+    """
+    def __init__(self, pool, workers=None, max_pending=256, use_processes=False):
+        self.pool = pool
+        self.workers = workers or os.cpu_count() or 1
+        self.use_processes = use_processes
+        if use_processes:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="compress")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self.frames = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self.cpu_seconds = 0.0
+
+    def submit(self, source, data, meta, lease, codec_name):
+        """
+        提交一帧压缩。meta 的格式见 WriterPool.store_frame()。
+        lease 不为 None 时压缩阶段额外持有一份引用，压缩完成后立即释放。
+        压缩中的帧也计入源的保存积压 (enqueued/dequeued)，关闭源时 wait_saved() 会等待它们。
+        """
+        if not self._slots.acquire(blocking=False):
+            return False
+        source.enqueued()
+        if self.use_processes:
+            # 子进程无法访问 PvBuffer 内存，只能拷贝一份
+            data = bytes(data)
+            lease = None
+        elif lease is not None:
+            lease.retain()
+        future = self.executor.submit(compress_frame, codec_name, data)
+        future.add_done_callback(lambda f: self._store(f, source, data, meta, lease))
+        return True
+
+    def _store(self, future, source, data, meta, lease):
+        try:
+            try:
+                codec_id, out, cpu = future.result()
+            except Exception as e:
+                print(f"[Compress Error] {e}")
+                codec_id, out, cpu = CODEC_RAW, None, 0.0
+            store_lease = None
+            if out is None:
+                # 不可压缩：原样写入，零拷贝模式下保存线程需要继续持有缓冲区
+                out, store_lease = data, lease
+            with self._lock:
+                self.frames += 1
+                self.raw_bytes += meta[3]
+                self.stored_bytes += memoryview(out).nbytes
+                self.cpu_seconds += cpu
+            if not self.pool.store_frame(source, out, meta, store_lease, codec_id, int(cpu * 1e6)):
+                source.gaps.record(frame_gaps.GAP_SAVE_DROP, meta[0], meta[1], frame_gaps.SAVE_DROP_QUEUE_FULL)
+        finally:
+            # 先交给保存线程池再释放压缩阶段的引用，缓冲区写完前不会归还
+            if lease is not None:
+                lease.release()
+            source.dequeued()
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "frames": self.frames,
+                "ratio": self.raw_bytes / self.stored_bytes if self.stored_bytes else None,
+                "cpu_ms_per_frame": self.cpu_seconds * 1000 / self.frames if self.frames else None,
+            }
+
+    def shutdown(self):
+        """等待所有在途帧压缩完成并交给保存线程池。"""
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,189 @@
+"""
+文件名称: frame_gaps.py
+功能描述:
+    按源跟踪 BlockID 的连续性，统计并记录丢帧原因。
+    1. 网络丢失 (network)：BlockID 跳号，且管道的丢块计数没有增加。
+    2. 管道溢出 (pipeline)：BlockID 跳号，且管道因无空闲缓冲区而丢块 (PipelineBlocksDropped 增加)。
+    3. 保存丢弃 (save_drop)：帧已收到，但因保存队列满/缓冲区租约用尽/写入失败而未落盘。
+    4. 不完整缓冲区 (incomplete)：收到了缓冲区，但 operational result 不是 OK (例如缺包)。
+    每条缺口记录写入源目录下的 gaps.idx (与 frames.idx 并列)，GapTracker.stats() 提供实时计数，
+    session_summary() 只读两个索引文件即可判断一次录制是否完整，无需扫描段文件。
+
+特别注意事项:
+    1. GigE Vision 1.x 的 BlockID 为 16 位 (1..65535，0 保留)，回绕后从 1 开始；
+       GEV 2.0 的扩展 BlockID 为 64 位，不会回绕。通过 wrap 参数指定。
+    2. BlockID 倒退且不像回绕时 (例如设备重新开始采集)，视为序列重置，不计为丢帧。
+"""
+
+import os
+import struct
+import threading
+
+import numpy as np
+
+import frame_index
+
+# === 配置 ===
+GAPS_NAME = "gaps.idx"
+MAGIC = b"GVFGAP\0\0"
+VERSION = 1
+BLOCK_ID_WRAP_16 = 0xFFFF  # GEV 1.x BlockID 上限
+
+# 保存丢弃的附加信息 (detail 字段)
+SAVE_DROP_QUEUE_FULL = 1
+SAVE_DROP_LEASES = 2
+SAVE_DROP_WRITE_ERROR = 3
+
+# 缺口类型
+GAP_NETWORK = 1
+GAP_PIPELINE = 2
+GAP_SAVE_DROP = 3
+GAP_INCOMPLETE = 4
+GAP_NAMES = {
+    GAP_NETWORK: "network",
+    GAP_PIPELINE: "pipeline",
+    GAP_SAVE_DROP: "save_drop",
+    GAP_INCOMPLETE: "incomplete",
+}
+
+HEADER = struct.Struct("<8sII")  # 魔数, 版本号, 记录长度
+# 缺口记录: 第一个缺失的 block_id, 缺失帧数, 发现时的主机时间戳, 类型, 附加信息 (例如 op_result 代码)
+RECORD = struct.Struct("<QQqII")
+RECORD_DTYPE = np.dtype([
+    ("block_id", "<u8"),
+    ("count", "<u8"),
+    ("host_ts", "<i8"),
+    ("kind", "<u4"),
+    ("detail", "<u4"),
+])
+assert RECORD_DTYPE.itemsize == RECORD.size
+
+
+def gaps_path(root):
+    return os.path.join(root, GAPS_NAME)
+
+
+class GapTracker:
+    """
+    单个源的 BlockID 连续性跟踪器。
+
+    observe() 必须对每个取回的缓冲区调用一次 (包括不完整的缓冲区)，
+    record() 用于登记已收到但未保存的帧。两者可在不同线程中调用。
+    read_pipeline_dropped 是可选回调，返回管道累计丢块数，只在发现跳号时调用。
+    """
+    def __init__(self, root, read_pipeline_dropped=None, wrap=None):
+        path = gaps_path(root)
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, "ab")
+        if new_file:
+            self._file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+            self._file.flush()
+        self.read_pipeline_dropped = read_pipeline_dropped
+        self.wrap = wrap
+        self._lock = threading.Lock()
+        self._last = None
+        self._dropped_base = self._pipeline_dropped()
+        self.counters = {name: 0 for name in GAP_NAMES.values()}
+        self.counters["received"] = 0
+        self.counters["resets"] = 0
+
+    def _pipeline_dropped(self):
+        if self.read_pipeline_dropped is None:
+            return None
+        try:
+            return self.read_pipeline_dropped()
+        except Exception:
+            return None
+
+    def _distance(self, last, block_id):
+        """从 last 到 block_id 的前进步数；序列倒退 (非回绕) 时返回 None。"""
+        if block_id > last:
+            return block_id - last
+        if self.wrap and last - block_id > self.wrap // 2:
+            # 回绕：last .. wrap 之后从 1 重新开始
+            return self.wrap - last + block_id
+        return None
+
+    def observe(self, block_id, host_ts):
+        """登记一个收到的缓冲区，发现跳号时按管道丢块计数区分网络丢失和管道溢出。"""
+        with self._lock:
+            self.counters["received"] += 1
+            last, self._last = self._last, block_id
+            if last is None:
+                return
+            step = self._distance(last, block_id)
+            if step is None:
+                self.counters["resets"] += 1
+                return
+            missing = step - 1
+            if missing <= 0:
+                return
+            overrun = 0
+            dropped = self._pipeline_dropped()
+            if dropped is not None and self._dropped_base is not None:
+                overrun = min(missing, max(0, dropped - self._dropped_base))
+            if dropped is not None:
+                self._dropped_base = dropped
+            first = last + 1
+            if self.wrap and first > self.wrap:
+                first = 1
+            if overrun:
+                self._write(GAP_PIPELINE, first, overrun, host_ts)
+            if missing > overrun:
+                self._write(GAP_NETWORK, first, missing - overrun, host_ts)
+
+    def record(self, kind, block_id, host_ts, detail=0):
+        """登记一个已收到但没有进入帧索引的帧 (保存丢弃或不完整缓冲区)。"""
+        with self._lock:
+            self._write(kind, block_id, 1, host_ts, detail)
+
+    def _write(self, kind, block_id, count, host_ts, detail=0):
+        self.counters[GAP_NAMES[kind]] += count
+        # 缺口很少出现，逐条写入并刷新，异常退出时也不会丢失
+        self._file.write(RECORD.pack(block_id, count, host_ts, kind, detail))
+        self._file.flush()
+
+    def lost(self):
+        """累计丢失的帧数 (所有类型之和)。"""
+        with self._lock:
+            return sum(self.counters[name] for name in GAP_NAMES.values())
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+    def summary(self):
+        s = self.stats()
+        return " ".join(f"{k}={v}" for k, v in s.items())
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_gaps(root):
+    """读取 gaps.idx，返回 RECORD_DTYPE 结构化数组；没有缺口文件时返回空数组。"""
+    path = gaps_path(root)
+    if not os.path.exists(path):
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    with open(path, "rb") as f:
+        magic, version, size = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION or size != RECORD.size:
+            raise ValueError(f"Unsupported gap index {path}: version {version}, record size {size}")
+        data = f.read()
+    data = data[:len(data) - len(data) % RECORD.size]
+    return np.frombuffer(data, dtype=RECORD_DTYPE)
+
+
+def session_summary(root):
+    """
+    只读 frames.idx 和 gaps.idx，汇总一个源的录制完整性：
+    返回 {"frames": 落盘帧数, "lost": 丢失总数, 各类型计数..., "complete": 是否无丢失}。
+    """
+    gaps = read_gaps(root)
+    summary = {"frames": len(frame_index.load_index(root)) if frame_index.has_index(root) else 0}
+    for kind, name in GAP_NAMES.items():
+        summary[name] = int(gaps["count"][gaps["kind"] == kind].sum())
+    summary["lost"] = int(gaps["count"].sum())
+    summary["complete"] = summary["lost"] == 0
+    return summary
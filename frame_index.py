@@ -0,0 +1,253 @@
+"""
+文件名称: frame_index.py
+功能描述:
+    定长二进制帧索引 (frames.idx)，替代逐帧格式化/解析的 metadata.csv。
+    1. 每帧一条 struct 打包的定长记录：block_id、主机/设备时间戳、宽高、像素类型、payload 大小、
+       卷、段号和段内偏移。
+    2. FrameIndexWriter 由保存线程在帧写入完成后追加记录，按批写盘，采集线程不再做任何字符串格式化。
+    3. FrameIndex 以 NumPy 结构化数组的形式 memmap 整个索引，按 block_id 或时间戳查找帧
+       只需一次二分查找，不必解析整个文件。
+
+特别注意事项:
+    1. 文件以 16 字节文件头开始 (魔数、版本号、记录长度)，其后为连续的定长记录。
+    2. 多个保存线程并发完成写入，记录按完成顺序追加，不保证按 block_id 有序；
+       FrameIndex 在需要时计算一次排序并缓存。
+    3. 没有 frames.idx 的旧录制 (只有 metadata.csv) 由 load_index() 自动转换为内存中的索引。
+    4. 版本 2 增加 stored_size (段内实际占用字节数)、codec (编解码器 ID，见 frame_codec.py) 和
+       codec_us (压缩 CPU 微秒数)。版本 1 的索引仍可读取，按未压缩处理，但不能续写。
+    5. 版本 3 增加 host_rx_ns (主机单调时钟下的接收时间) 和 aligned_ts (设备时间戳换算到同一主机时钟，
+       见 clock_sync.py)，两者单位均为纳秒。旧索引读取时用 host_ts 填充这两个字段。
+"""
+
+import os
+import struct
+import threading
+
+import numpy as np
+
+import segment_store
+
+# === 配置 ===
+INDEX_NAME = "frames.idx"
+MAGIC = b"GVFIDX\0\0"
+VERSION = 3
+BATCH_SIZE = 256  # 每累计多少条记录写一次盘
+
+HEADER = struct.Struct("<8sII")  # 魔数, 版本号, 记录长度
+RECORD = struct.Struct("<QqQQIIIIIHHIHIqq")
+# 与 RECORD 逐字节一致的 NumPy 结构化类型 (无对齐填充)
+RECORD_DTYPE = np.dtype([
+    ("block_id", "<u8"),
+    ("host_ts", "<i8"),
+    ("device_ts", "<u8"),
+    ("offset", "<u8"),
+    ("payload_size", "<u4"),
+    ("width", "<u4"),
+    ("height", "<u4"),
+    ("pixel_type", "<u4"),
+    ("segment", "<u4"),
+    ("volume", "<u2"),
+    ("flags", "<u2"),
+    ("stored_size", "<u4"),
+    ("codec", "<u2"),
+    ("codec_us", "<u4"),
+    ("host_rx_ns", "<i8"),
+    ("aligned_ts", "<i8"),
+])
+assert RECORD_DTYPE.itemsize == RECORD.size
+
+# 旧版本的记录格式: 版本 1 没有压缩相关字段，版本 2 没有主机单调时钟和对齐时间戳
+RECORD_V1_DTYPE = np.dtype(RECORD_DTYPE.descr[:11])
+RECORD_V2_DTYPE = np.dtype(RECORD_DTYPE.descr[:14])
+
+
+def index_path(root):
+    return os.path.join(root, INDEX_NAME)
+
+
+class FrameIndexWriter:
+    """
+    追加写 frames.idx。append() 可在多个保存线程中并发调用，记录先缓存在内存中，
+    每 batch_size 条写一次盘；close() 时写出剩余记录。
+    """
+    def __init__(self, root, batch_size=BATCH_SIZE):
+        path = index_path(root)
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not new_file:
+            if _check_header(path) != VERSION:
+                raise ValueError(f"Cannot append to frame index {path} written by an older version")
+            # 续写前丢弃异常退出时残留的半条记录，保证记录对齐
+            size = os.path.getsize(path)
+            os.truncate(path, size - (size - HEADER.size) % RECORD.size)
+        self._file = open(path, "ab")
+        if new_file:
+            self._file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._batch = bytearray()
+        self._count = 0
+
+    def append(self, block_id, host_ts, device_ts, offset, payload_size,
+               width, height, pixel_type, segment, volume=0, flags=0,
+               stored_size=None, codec=0, codec_us=0, host_rx_ns=0, aligned_ts=0):
+        if stored_size is None:
+            stored_size = payload_size
+        data = RECORD.pack(block_id, host_ts, device_ts, offset, payload_size,
+                           width, height, pixel_type, segment, volume, flags,
+                           stored_size, codec, codec_us, host_rx_ns, aligned_ts)
+        with self._lock:
+            self._batch += data
+            self._count += 1
+            if self._count >= self.batch_size:
+                self._write_batch()
+
+    def flush(self):
+        with self._lock:
+            self._write_batch()
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._write_batch()
+            self._file.close()
+
+    def _write_batch(self):
+        if self._batch:
+            self._file.write(self._batch)
+            self._batch = bytearray()
+            self._count = 0
+
+
+_DTYPES = {1: RECORD_V1_DTYPE, 2: RECORD_V2_DTYPE, VERSION: RECORD_DTYPE}
+
+
+def _check_header(path):
+    """校验文件头，返回索引版本号。"""
+    with open(path, "rb") as f:
+        magic, version, size = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or version not in _DTYPES or size != _DTYPES[version].itemsize:
+        raise ValueError(f"Unsupported frame index {path}: version {version}, record size {size}")
+    return version
+
+
+def _upgrade(records):
+    """把旧版本的记录转换为当前格式 (内存副本)，补齐的字段按未压缩、以 host_ts 计时处理。"""
+    out = np.zeros(len(records), dtype=RECORD_DTYPE)
+    for name in records.dtype.names:
+        out[name] = records[name]
+    if "stored_size" not in records.dtype.names:
+        out["stored_size"] = out["payload_size"]
+    out["host_rx_ns"] = out["host_ts"] * 1000000
+    out["aligned_ts"] = out["host_rx_ns"]
+    return out
+
+
+class FrameIndex:
+    """
+    只读帧索引。records 是 RECORD_DTYPE 的结构化数组 (通常直接 memmap 自 frames.idx)。
+    """
+    def __init__(self, records):
+        self.records = records
+        self._orders = {}
+
+    @classmethod
+    def open(cls, root):
+        path = index_path(root)
+        dtype = _DTYPES[_check_header(path)]
+        count = (os.path.getsize(path) - HEADER.size) // dtype.itemsize
+        if count == 0:
+            return cls(np.zeros(0, dtype=RECORD_DTYPE))
+        # 只映射完整的记录，忽略异常退出时残留的半条记录
+        records = np.memmap(path, dtype=dtype, mode="r", offset=HEADER.size, shape=(count,))
+        if dtype is not RECORD_DTYPE:
+            records = _upgrade(records)
+        return cls(records)
+
+    @classmethod
+    def from_csv(cls, root):
+        """把旧录制的 metadata.csv 转换为内存中的索引。"""
+        rows = [(r.block_id, r.timestamp, 0, r.offset, r.payload_size,
+                 r.width, r.height, r.pixel_type, r.segment, r.volume, 0, r.payload_size, 0, 0,
+                 r.timestamp * 1000000, r.timestamp * 1000000)
+                for r in segment_store.iter_frames(root)]
+        return cls(np.array(rows, dtype=RECORD_DTYPE))
+
+    def __len__(self):
+        return len(self.records)
+
+    def _sorted_keys(self, field):
+        """返回 (排序下标, 排序后的键)，按字段缓存。索引已有序时不做排序。"""
+        cached = self._orders.get(field)
+        if cached is None:
+            values = np.asarray(self.records[field])
+            if len(values) < 2 or np.all(values[1:] >= values[:-1]):
+                order = np.arange(len(values))
+                keys = values
+            else:
+                order = np.argsort(values, kind="stable")
+                keys = values[order]
+            cached = self._orders[field] = (order, keys)
+        return cached
+
+    def order(self, field="block_id"):
+        """按某个字段排序的下标数组。"""
+        return self._sorted_keys(field)[0]
+
+    def sorted(self, field="block_id"):
+        """按某个字段排序后的记录数组。"""
+        return self.records[self.order(field)]
+
+    def iter_sorted(self, field="block_id", chunk_size=4096):
+        """
+        按某个字段的顺序分块产出记录数组，每块最多 chunk_size 条。
+        索引本身有序时直接按块切片 memmap，不会把整个索引读入内存。
+        """
+        values = self.records[field]
+
+        def chunk_ordered(i):
+            # 与下一块的第一条重叠一条，保证跨块边界也有序
+            v = np.asarray(values[i:i + chunk_size + 1])
+            return np.all(v[1:] >= v[:-1])
+
+        ordered = all(chunk_ordered(i) for i in range(0, len(values), chunk_size))
+        if ordered:
+            for i in range(0, len(values), chunk_size):
+                yield self.records[i:i + chunk_size]
+        else:
+            order = self.order(field)
+            for i in range(0, len(order), chunk_size):
+                yield self.records[order[i:i + chunk_size]]
+
+    def block_rows(self, block_id):
+        """
+        按 block_id 二分查找，返回所有匹配记录在索引中的下标 (升序)。
+        16 位 BlockID 回绕 (见 frame_gaps.py) 后同一个 block_id 会出现多次。
+        """
+        order, keys = self._sorted_keys("block_id")
+        lo = np.searchsorted(keys, block_id, side="left")
+        hi = np.searchsorted(keys, block_id, side="right")
+        return np.sort(order[lo:hi])
+
+    def find_block(self, block_id):
+        """按 block_id 二分查找，返回记录 (回绕后出现多次时为最早写入的一条)；不存在时返回 None。"""
+        rows = self.block_rows(block_id)
+        return self.records[rows[0]] if len(rows) else None
+
+    def time_range(self, start, stop, field="host_ts"):
+        """返回时间戳位于 [start, stop) 的记录，按时间排序。"""
+        order, keys = self._sorted_keys(field)
+        lo, hi = np.searchsorted(keys, [start, stop])
+        return self.records[order[lo:hi]]
+
+
+def has_index(root):
+    """源目录下是否有可读取的帧索引 (frames.idx 或旧版 metadata.csv)。"""
+    return (os.path.exists(index_path(root)) or
+            os.path.exists(os.path.join(root, segment_store.METADATA_NAME)))
+
+
+def load_index(root):
+    """打开一个源目录的帧索引：优先使用 frames.idx，否则退回 metadata.csv。"""
+    if os.path.exists(index_path(root)):
+        return FrameIndex.open(root)
+    return FrameIndex.from_csv(root)
@@ -0,0 +1,174 @@
+"""
+文件名称: frame_store.py
+功能描述:
+    录制的随机访问接口：一次打开一个源目录，之后按位置、切片或时间范围直接得到帧数据的 NumPy 视图，
+    取代各处重复的 "读元数据 -> 打开文件 -> np.frombuffer -> reshape"。
+    1. 帧索引 (frames.idx) 和段文件都只映射一次 (segment_store.SegmentReader)，
+       随机访问一帧只是一次数组切片，不产生任何系统调用。
+    2. 未压缩的帧返回段文件映射上的零拷贝只读视图，形状按 width、height 和 pixel_type 确定：
+       8 位单通道 (Mono8、Bayer8) 为 (H, W) uint8，16 位为 (H, W) uint16，RGB8 为 (H, W, 3)；
+       打包格式 (如 12 位 packed) 返回一维 uint8 数组。压缩帧会解码 (frame_codec)，返回独立的数组。
+    3. 位置按时间线 (video_export.timeline) 排序，与 playback.Player 和预览缓存一致：
+       store[i]、store[a:b:c]、store.time[t0:t1] (纳秒，返回时间范围内的帧)、store.time[t] (t 之前最近的一帧)。
+    4. iter() 按顺序产出 (记录, 视图)；open_session() 打开一次录制下的所有源，iter_merged() 按时间合并多个源。
+
+使用方法:
+    store = FrameStore("D:/Record/Source1")
+    first = store[0]; rec = store.record(0)
+    for rec, frame in store.iter(): ...
+    sources = open_session("D:/Record"); for name, rec, frame in iter_merged(sources): ...
+
+特别注意事项:
+    1. 视图引用段文件映射，只读；需要修改时先 .copy()。
+    2. 松散文件模式 (migrate_legacy.py 未重新打包的旧录制) 每帧仍需打开一次文件。
+"""
+
+import os
+import heapq
+
+import numpy as np
+
+import frame_index
+import segment_store
+import frame_codec
+import video_export
+
+
+def frame_view(buf, width, height, pixel_type):
+    """
+    按 GigE Vision PFNC 像素格式把原始数据解释为数组 (零拷贝)：
+    pixel_type 的 16-23 位为每像素位数，8/16 位为单通道，24/48 位为三通道，其他 (打包格式) 返回一维数组。
+    """
+    bits = (pixel_type >> 16) & 0xFF
+    layouts = {8: (np.uint8, ()), 16: (np.uint16, ()), 24: (np.uint8, (3,)), 48: (np.uint16, (3,))}
+    if bits not in layouts:
+        return np.frombuffer(buf, dtype=np.uint8)
+    dtype, channels = layouts[bits]
+    count = width * height * (channels[0] if channels else 1)
+    return np.frombuffer(buf, dtype=dtype, count=count).reshape((height, width) + channels)
+
+
+class _TimeIndexer:
+    """store.time[t0:t1] 返回时间范围 [t0, t1) 内的帧列表，store.time[t] 返回 t 之前 (含) 最近的一帧。"""
+    def __init__(self, store):
+        self._store = store
+
+    def __getitem__(self, key):
+        store = self._store
+        if isinstance(key, slice):
+            if key.step is not None:
+                raise ValueError("Time slices do not support a step")
+            lo = 0 if key.start is None else int(np.searchsorted(store.ts, key.start, side="left"))
+            hi = len(store) if key.stop is None else int(np.searchsorted(store.ts, key.stop, side="left"))
+            return store[lo:hi]
+        pos = int(np.searchsorted(store.ts, key, side="right")) - 1
+        if pos < 0:
+            raise KeyError(f"No frame at or before {key}")
+        return store[pos]
+
+
+class FrameStore:
+    """一个源目录的只读随机访问视图。"""
+    def __init__(self, root, index=None):
+        self.root = root
+        self.name = os.path.basename(os.path.normpath(root))
+        self.index = index or frame_index.load_index(root)
+        self.field, ts = video_export.timeline(self.index.records)
+        if len(ts) < 2 or np.all(ts[1:] >= ts[:-1]):
+            # 索引已按时间有序 (通常如此)：直接使用 memmap，不复制记录
+            self.order = np.arange(len(ts))
+            self.ts = ts
+            self.records = self.index.records
+        else:
+            self.order = np.argsort(ts, kind="stable")
+            self.ts = ts[self.order]
+            self.records = self.index.records[self.order]
+        self.time = _TimeIndexer(self)
+        self._inverse = None
+        self._reader = segment_store.SegmentReader(root)
+
+    def __len__(self):
+        return len(self.records)
+
+    def record(self, pos):
+        return self.records[pos]
+
+    def _load(self, rec):
+        stored = self._reader.read(int(rec["segment"]), int(rec["offset"]), int(rec["stored_size"]),
+                                   int(rec["volume"]))
+        payload = frame_codec.decode(int(rec["codec"]), stored, int(rec["payload_size"]))
+        return frame_view(payload, int(rec["width"]), int(rec["height"]), int(rec["pixel_type"]))
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self._load(rec) for rec in self.records[key]]
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key += len(self)
+            if not 0 <= key < len(self):
+                raise IndexError(f"Frame {key} out of range ({len(self)} frames)")
+            return self._load(self.records[key])
+        raise TypeError(f"FrameStore indices must be integers or slices, not {type(key).__name__}")
+
+    def __iter__(self):
+        for rec, frame in self.iter():
+            yield frame
+
+    def find_block(self, block_id, near=None):
+        """
+        block_id 对应的位置，由帧索引二分查找 (FrameIndex.block_rows)；不存在时返回 None。
+        16 位 BlockID 回绕后同一个 block_id 出现多次，返回离位置 near 最近的一帧，near 为 None 时返回时间上最早的一帧。
+        """
+        rows = self.index.block_rows(block_id)
+        if not len(rows):
+            return None
+        positions = self._positions()[rows]
+        if near is None:
+            return int(positions.min())
+        return int(positions[np.argmin(np.abs(positions - near))])
+
+    def _positions(self):
+        """索引下标 -> 时间线位置 (self.order 的逆排列)，首次使用时计算。"""
+        if self._inverse is None:
+            self._inverse = np.empty(len(self.order), dtype=np.int64)
+            self._inverse[self.order] = np.arange(len(self.order))
+        return self._inverse
+
+    def iter(self, start=0, stop=None, step=1):
+        """按位置顺序产出 (记录, 帧视图)。"""
+        for rec in self.records[start:stop:step]:
+            yield rec, self._load(rec)
+
+    def close(self):
+        self._reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_session(session_dir):
+    """打开一次录制目录下所有带帧索引的源子目录 (Source1、Source2 ...)，返回 {源名: FrameStore}。"""
+    stores = {}
+    for name in sorted(os.listdir(session_dir)):
+        path = os.path.join(session_dir, name)
+        if os.path.isdir(path) and frame_index.has_index(path):
+            stores[name] = FrameStore(path)
+    return stores
+
+
+def iter_merged(stores):
+    """按时间线合并多个源，产出 (源名, 记录, 帧视图)。stores 为 {源名: FrameStore} 或 FrameStore 列表。"""
+    if not isinstance(stores, dict):
+        stores = {s.name: s for s in stores}
+
+    def keyed(name, store):
+        for pos in range(len(store)):
+            yield int(store.ts[pos]), name, pos
+
+    for _, name, pos in heapq.merge(*(keyed(n, s) for n, s in stores.items())):
+        store = stores[name]
+        rec = store.records[pos]
+        yield name, rec, store._load(rec)
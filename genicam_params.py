@@ -0,0 +1,226 @@
+"""
+文件名称: genicam_params.py
+功能描述:
+    GenICam 参数层：按设备缓存节点句柄，并按声明式配置 (全局参数 + 每个源的参数) 批量写入。
+    1. NodeCache 按名称解析节点和节点类型各一次 (不存在的节点也记住)，之后直接使用缓存的句柄，
+       不再每次调用都 GetParameters().Get("AcquisitionStart") 按字符串查找。
+    2. selected(source) 替代 PvGenStateStack 切换 SourceSelector：选择器已经是目标源时不写，
+       退出时只在确实切换过时恢复原值；同一设备的所有源共用一个选择器，切换期间持有锁。
+    3. apply_profile() 按依赖顺序写入配置 (选择器和模式/使能开关先于它们控制的值，像素格式和尺寸先于偏移)，
+       写入前读出当前值，相同则跳过，返回写入/跳过/失败的统计和耗时，便于比较连接到开始采集的准备时间。
+
+使用方法:
+    params = genicam_params.cache_for(device)
+    report = genicam_params.apply_profile(params, {
+        "global": {"AcquisitionMode": "Continuous", "AcquisitionFrameRate": 30},
+        "sources": {"Source0": {"ExposureTime": 5000}},
+    })
+    print(genicam_params.format_report(report))
+    with params.selected("Source0"):
+        params.execute("AcquisitionStart")
+
+特别注意事项:
+    1. 选择器的当前值只在首次切换时读取一次，之后以本模块的写入为准；
+       不要再用 PvGenStateStack 或 Get("SourceSelector").SetValue() 绕过 selected() 修改选择器。
+    2. 节点句柄随设备连接有效，断开重连 (或释放设备) 后调用 forget(device)，下次 cache_for() 重新解析。
+    3. 浮点参数按相对误差 FLOAT_TOLERANCE 比较：设备会把写入值量化到步长，读回值与配置值不完全相同。
+"""
+
+import time
+import threading
+
+import eBUS as eb
+
+# === 配置 ===
+SOURCE_SELECTOR = "SourceSelector"
+FLOAT_TOLERANCE = 1e-6  # 浮点参数 "值相同" 的相对误差
+# 写入顺序：列表中的节点按列表顺序先写 (选择器 -> 模式/使能开关 -> 像素格式和尺寸 -> 偏移)，
+# 其余节点 (曝光、增益、帧率等具体数值) 排在后面并保持配置中的顺序
+WRITE_ORDER = [
+    "TriggerSelector", "GainSelector", "BalanceRatioSelector",
+    "AcquisitionMode", "TriggerMode", "TriggerSource", "TriggerActivation",
+    "ExposureMode", "ExposureAuto", "GainAuto", "BalanceWhiteAuto", "AcquisitionFrameRateEnable",
+    "PixelFormat", "BinningHorizontal", "BinningVertical", "DecimationHorizontal", "DecimationVertical",
+    "Width", "Height", "OffsetX", "OffsetY",
+]
+_WRITE_RANK = {name: rank for rank, name in enumerate(WRITE_ORDER)}
+
+
+class _Selection:
+    """selected() 返回的上下文：进入时切换选择器，退出时恢复。"""
+    def __init__(self, cache, value):
+        self.cache = cache
+        self.value = value
+        self.previous = None
+
+    def __enter__(self):
+        self.cache._lock.acquire()
+        try:
+            self.previous = self.cache._switch(self.value)
+        except Exception:
+            self.cache._lock.release()
+            raise
+        return self.cache
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if self.previous is not None:
+                self.cache._switch(self.previous)
+        finally:
+            self.cache._lock.release()
+        return False
+
+
+class NodeCache:
+    """一台设备的节点句柄缓存。"""
+    def __init__(self, parameters, selector=SOURCE_SELECTOR):
+        self.parameters = parameters
+        self.selector = selector
+        self._nodes = {}  # 名称 -> (节点或 None, 类型)
+        self._selected = None  # 选择器的当前值，首次切换时读取
+        self._lock = threading.RLock()
+        self.resolved = 0
+        self.selector_writes = 0
+
+    def node(self, name):
+        """名称对应的节点，设备没有该节点时返回 None (结果同样缓存)。"""
+        entry = self._nodes.get(name)
+        if entry is None:
+            node = self.parameters.Get(name)
+            gen_type = None
+            if node is not None:
+                result, gen_type = node.GetType()
+                if result.IsFailure():
+                    gen_type = None
+            entry = self._nodes[name] = (node, gen_type)
+            self.resolved += 1
+        return entry[0]
+
+    def type_of(self, name):
+        self.node(name)
+        return self._nodes[name][1]
+
+    def get(self, name):
+        """读取参数值，返回 (是否成功, 值)；枚举返回当前项的名称。"""
+        node = self.node(name)
+        if node is None:
+            return False, None
+        if self.type_of(name) == eb.PvGenTypeEnum:
+            result, value = node.GetValueString()
+        else:
+            result, value = node.GetValue()
+        return result.IsOK(), value
+
+    def set(self, name, value):
+        """
+        写入参数，当前值已经相同时跳过。返回 "written"、"skipped" 或失败原因。
+        """
+        node = self.node(name)
+        if node is None:
+            return "not available"
+        gen_type = self.type_of(name)
+        if gen_type == eb.PvGenTypeCommand:
+            return "is a command"
+        ok, current = self.get(name)
+        if ok and _same_value(gen_type, current, value):
+            return "skipped"
+        result = node.SetValue(value)
+        if result.IsFailure():
+            return result.GetCodeString()
+        return "written"
+
+    def execute(self, name):
+        """执行命令节点，失败或节点不存在时返回 False。"""
+        node = self.node(name)
+        if node is None:
+            print(f"Command {name} not available")
+            return False
+        return node.Execute().IsOK()
+
+    def _switch(self, value):
+        """把选择器切换到 value，返回切换前的值；已经是 value 时不写并返回 None。"""
+        if self._selected is None:
+            ok, current = self.get(self.selector)
+            self._selected = current if ok else None
+        if self._selected == value:
+            return None
+        result = self.node(self.selector).SetValue(value)
+        if result.IsFailure():
+            raise RuntimeError(f"Failed to set {self.selector} to {value}: {result.GetCodeString()}")
+        self.selector_writes += 1
+        previous, self._selected = self._selected, value
+        return previous
+
+    def selected(self, value):
+        """在 with 块内把选择器切换为 value (通常是源名称)，块结束后恢复。可以嵌套。"""
+        return _Selection(self, value)
+
+
+def _same_value(gen_type, current, value):
+    if gen_type == eb.PvGenTypeFloat:
+        return abs(current - value) <= FLOAT_TOLERANCE * max(1.0, abs(value))
+    if gen_type == eb.PvGenTypeEnum and not isinstance(value, str):
+        # 按整数值配置的枚举无法与当前项名称比较，总是写入
+        return False
+    return current == value
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def cache_for(device):
+    """返回一台设备共用的 NodeCache (按设备对象区分)。"""
+    with _caches_lock:
+        cache = _caches.get(id(device))
+        if cache is None:
+            cache = _caches[id(device)] = NodeCache(device.GetParameters())
+        return cache
+
+
+def forget(device):
+    """丢弃设备的节点缓存 (断开连接或释放设备之后调用)。"""
+    with _caches_lock:
+        _caches.pop(id(device), None)
+
+
+def write_order(values):
+    """按依赖顺序排列 {名称: 值} 中的项。"""
+    names = list(values)
+    return sorted(names, key=lambda name: _WRITE_RANK.get(name, len(WRITE_ORDER)))
+
+
+def apply_profile(cache, profile):
+    """
+    写入配置 {"global": {名称: 值}, "sources": {源名称: {名称: 值}}}。
+    全局参数先写，然后逐个源切换选择器写入该源的参数。返回统计字典:
+        written / skipped: 计数，failed: [(源名称或 None, 参数名, 原因)]，seconds: 耗时
+    """
+    start = time.perf_counter()
+    report = {"written": 0, "skipped": 0, "failed": [], "seconds": 0.0}
+
+    def write(scope, values):
+        for name in write_order(values):
+            outcome = cache.set(name, values[name])
+            if outcome in ("written", "skipped"):
+                report[outcome] += 1
+            else:
+                report["failed"].append((scope, name, outcome))
+
+    write(None, profile.get("global", {}))
+    for source, values in profile.get("sources", {}).items():
+        try:
+            with cache.selected(source):
+                write(source, values)
+        except RuntimeError as e:
+            report["failed"].append((source, cache.selector, str(e)))
+    report["seconds"] = time.perf_counter() - start
+    return report
+
+
+def format_report(report):
+    lines = [f"Parameter profile: {report['written']} written, {report['skipped']} unchanged, "
+             f"{len(report['failed'])} failed in {report['seconds'] * 1000:.1f} ms"]
+    for scope, name, reason in report["failed"]:
+        lines.append(f"  {scope + ':' if scope else ''}{name}: {reason}")
+    return "\n".join(lines)
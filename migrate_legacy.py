@@ -0,0 +1,221 @@
+"""
+文件名称: migrate_legacy.py
+功能描述:
+    把 demo/test.py 旧版录制 (每帧一个 frame_<block_id>_<timestamp>.bin + 同名 .json) 迁移为帧索引格式，
+    迁移后 read_from_raw.py、replay.py 等所有工具都直接 memmap frames.idx，不再逐个 listdir / json.load。
+    1. 扫描：一次 os.scandir 列出目录，线程池并行解析所有 .json 元数据 (小文件读取以 I/O 等待为主)，
+       缺少 .json 或 .bin、元数据损坏的帧单独报告。
+    2. 生成 frames.idx (按 block_id 排序)，两种方式：
+       - 松散文件 (默认)：帧数据仍留在各自的 .bin 文件中，loose_files.txt 记录文件列表，
+         segment_store.SegmentReader 按索引中的段号读取对应文件；迁移只写两个小文件，速度极快。
+       - 重新打包 (--repack)：线程池并行读取 .bin，按 block_id 顺序写入段文件 (segment_store.SegmentWriter)，
+         之后读取与新录制完全相同 (零拷贝映射)。可选 --remove-legacy 在校验通过后删除旧文件。
+    3. 校验：重新打开帧索引，逐帧通过 SegmentReader 读取并与原 .bin 文件比对 (CRC32)，报告不一致的帧。
+
+使用方法:
+    python migrate_legacy.py <旧录制目录> [--repack] [--output <目录>] [--workers 16] [--no-verify]
+
+特别注意事项:
+    1. 旧录制没有设备时间戳，device_ts 为 0，host_rx_ns / aligned_ts 由毫秒时间戳换算。
+    2. 目标目录已有帧索引时拒绝迁移 (除非 --overwrite)，避免覆盖新格式的录制。
+    3. 松散文件模式要求帧索引与 .bin 文件在同一目录 (不能使用 --output)。
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import argparse
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import segment_store
+import frame_index
+
+# === 配置 ===
+WORKERS = 16  # 扫描/读取线程数 (I/O 密集)
+CHUNK_SIZE = 256  # 重新打包和校验时每批并行读取的帧数
+
+LegacyFrame = namedtuple("LegacyFrame", "block_id timestamp width height pixel_type payload_size file_size bin_name")
+
+
+def extract_blockid(filename):
+    """从 frame_<block_id>_<timestamp>.bin 中提取 block_id，格式不符时返回 -1 (与 read_from_raw.py 相同)。"""
+    try:
+        return int(filename.split("_")[1])
+    except (IndexError, ValueError):
+        return -1
+
+
+def _load_meta(root, bin_name, file_size):
+    """解析一帧的 .json 元数据，返回 (LegacyFrame 或 None, 错误信息或 None)。"""
+    meta_name = bin_name[:-4] + ".json"
+    try:
+        with open(os.path.join(root, meta_name), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        block_id = meta.get("block_id", extract_blockid(bin_name))
+        payload_size = int(meta.get("payload_size", file_size))
+        frame = LegacyFrame(int(block_id), int(meta["timestamp"]), int(meta["width"]), int(meta["height"]),
+                            int(meta["pixel_type"]), payload_size, file_size, bin_name)
+    except FileNotFoundError:
+        return None, f"MissingMeta: {meta_name}"
+    except (ValueError, KeyError, TypeError) as e:
+        return None, f"BadMeta: {meta_name}: {e}"
+    if file_size < payload_size:
+        return None, f"TruncatedFrame: {bin_name} has {file_size} bytes, expected {payload_size}"
+    return frame, None
+
+
+def scan(root, workers=WORKERS):
+    """扫描旧录制目录，返回 (按 block_id 排序的 LegacyFrame 列表, [错误信息])。"""
+    bins = {}
+    metas = set()
+    with os.scandir(root) as it:
+        for entry in it:
+            if entry.name.endswith(".bin"):
+                bins[entry.name] = entry.stat().st_size
+            elif entry.name.endswith(".json"):
+                metas.add(entry.name[:-5])
+    errors = [f"MissingBin: {name}.json" for name in sorted(metas - {b[:-4] for b in bins})]
+    frames = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for frame, error in executor.map(lambda item: _load_meta(root, *item), bins.items()):
+            if frame is not None:
+                frames.append(frame)
+            else:
+                errors.append(error)
+    frames.sort(key=lambda f: (f.block_id, f.timestamp))
+    return frames, errors
+
+
+def _read_bin(root, frame):
+    with open(os.path.join(root, frame.bin_name), "rb") as f:
+        return f.read(frame.payload_size)
+
+
+def _append(index, frame, segment, offset, volume=0):
+    ns = frame.timestamp * 1000000
+    index.append(frame.block_id, frame.timestamp, 0, offset, frame.payload_size,
+                 frame.width, frame.height, frame.pixel_type, segment, volume,
+                 host_rx_ns=ns, aligned_ts=ns)
+
+
+def write_loose(root, frames):
+    """松散文件模式：写 loose_files.txt 和指向各 .bin 文件的帧索引。"""
+    with open(os.path.join(root, segment_store.LOOSE_FILES_NAME), "w", encoding="utf-8") as f:
+        f.writelines(frame.bin_name + "\n" for frame in frames)
+    index = frame_index.FrameIndexWriter(root)
+    try:
+        for number, frame in enumerate(frames):
+            _append(index, frame, number, 0)
+    finally:
+        index.close()
+
+
+def repack(root, output, frames, workers=WORKERS):
+    """把 .bin 文件按 block_id 顺序打包进 output 下的段文件，并写帧索引。"""
+    writer = segment_store.SegmentWriter(output)
+    index = frame_index.FrameIndexWriter(output)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for lo in range(0, len(frames), CHUNK_SIZE):
+                chunk = frames[lo:lo + CHUNK_SIZE]
+                # 并行读取一批，按顺序写入，段内偏移与 block_id 顺序一致
+                for frame, data in zip(chunk, executor.map(lambda f: _read_bin(root, f), chunk)):
+                    volume, segment, offset = writer.reserve(len(data))
+                    writer.write(segment, offset, data, frame.block_id, frame.timestamp)
+                    _append(index, frame, segment, offset, volume)
+    finally:
+        index.close()
+        writer.close()
+
+
+def verify(root, output, frames, workers=WORKERS):
+    """逐帧比对迁移结果与原 .bin 文件，返回 [错误信息]。"""
+    records = frame_index.load_index(output).sorted("block_id")
+    if len(records) != len(frames):
+        return [f"CountMismatch: index has {len(records)} frames, scanned {len(frames)}"]
+    reader = segment_store.SegmentReader(output)
+
+    def check(k):
+        rec, frame = records[k], frames[k]
+        if int(rec["block_id"]) != frame.block_id:
+            return f"OrderMismatch: position {k} has block {int(rec['block_id'])}, expected {frame.block_id}"
+        stored = reader.read(int(rec["segment"]), int(rec["offset"]), int(rec["stored_size"]), int(rec["volume"]))
+        if zlib.crc32(stored) != zlib.crc32(_read_bin(root, frame)):
+            return f"DataMismatch: block {frame.block_id} ({frame.bin_name})"
+        return None
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return [e for e in executor.map(check, range(len(frames))) if e is not None]
+    finally:
+        reader.close()
+
+
+def migrate(root, output=None, pack=False, workers=WORKERS, check=True, overwrite=False, remove_legacy=False):
+    """迁移一个旧录制目录，返回统计字典。"""
+    output = output or root
+    if not pack and os.path.abspath(output) != os.path.abspath(root):
+        raise ValueError("Loose-file mode keeps frames in place; use --repack to write to another directory")
+    if frame_index.has_index(output):
+        if not overwrite:
+            raise ValueError(f"{output} already has a frame index (use --overwrite to replace it)")
+        for name in (frame_index.INDEX_NAME, segment_store.LOOSE_FILES_NAME):
+            if os.path.exists(os.path.join(output, name)):
+                os.remove(os.path.join(output, name))
+    os.makedirs(output, exist_ok=True)
+
+    start = time.perf_counter()
+    frames, errors = scan(root, workers)
+    scanned = time.perf_counter()
+    print(f"[Migrate] Scanned {len(frames)} frames in {scanned - start:.2f}s, {len(errors)} problems")
+    if pack:
+        repack(root, output, frames, workers)
+    else:
+        write_loose(root, frames)
+    written = time.perf_counter()
+    print(f"[Migrate] {'Repacked' if pack else 'Indexed'} {len(frames)} frames in {written - scanned:.2f}s")
+
+    mismatches = verify(root, output, frames, workers) if check else []
+    if check:
+        print(f"[Migrate] Verified in {time.perf_counter() - written:.2f}s, {len(mismatches)} mismatches")
+    if pack and remove_legacy and check and not mismatches:
+        for frame in frames:
+            os.remove(os.path.join(root, frame.bin_name))
+            os.remove(os.path.join(root, frame.bin_name[:-4] + ".json"))
+    return {"frames": len(frames), "problems": errors, "mismatches": mismatches,
+            "seconds": time.perf_counter() - start}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Migrate legacy .bin/.json sessions to the frame index format.")
+    parser.add_argument("root", nargs="+", help="legacy session directories")
+    parser.add_argument("--repack", action="store_true", help="copy frames into segment files")
+    parser.add_argument("--output", help="output directory for --repack (default: in place)")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--no-verify", action="store_true")
+    parser.add_argument("--overwrite", action="store_true", help="replace an existing frame index")
+    parser.add_argument("--remove-legacy", action="store_true",
+                        help="delete the .bin/.json files after a verified repack")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.output and len(args.root) > 1:
+        print("--output can only be used with a single session directory")
+        sys.exit(1)
+    failed = False
+    for root in args.root:
+        stats = migrate(root, args.output, args.repack, args.workers, not args.no_verify,
+                        args.overwrite, args.remove_legacy)
+        for problem in stats["problems"] + stats["mismatches"]:
+            print(f"  {problem}")
+        failed = failed or bool(stats["mismatches"])
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
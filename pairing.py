@@ -0,0 +1,284 @@
+"""
+文件名称: pairing.py
+功能描述:
+    多光谱配对：把同一台相机 (例如 FS-3200D) 的可见光彩色源和近红外 (NIR) 源按帧对齐，输出 4 通道堆叠图像。
+    1. 只读取两个源的帧索引 (frames.idx)，不扫描任何帧文件。按时间戳匹配：
+       每一帧取另一源中时间最近的帧，两者互为最近且时间差不超过容差时配对 (一对一)。
+       同一台设备的两个源共用设备时钟，直接比较设备时间戳 device_ts (按录制中 host_rx_ns 的跨度换算为纳秒)；
+       device_ts 缺失 (为 0) 或两个源来自不同设备 (same_device=False) 时，
+       退回主机时间线 (aligned_ts / host_rx_ns / host_ts，见 video_export.timeline)。
+    2. 用 BlockID 校验：两个源的 BlockID 在配对帧之间应保持固定差值，取出现最多的差值为基准，
+       差值不同的配对记为 block_mismatch (strict_block=True 时直接拒绝)。
+    3. 报告两侧未配对的帧 (丢帧或只有一个源在采集的时段) 和配对时间差统计，可写出 CSV。
+    4. 堆叠图像为 (H, W, 4) 的 uint8：B、G、R 为可见光，第 4 通道为 NIR (按 OpenCV 的 BGRA 顺序，
+       保存为 TIFF/PNG 后在其他软件中表现为 RGBA，A 即 NIR)。NIR 与可见光尺寸不同时缩放到可见光尺寸。
+    5. iter_stacks() 以流式迭代器产出堆叠 (线程池预解码)；write_stacks() 用多进程并行写盘。
+
+使用方法:
+    python pairing.py <可见光源目录> <NIR 源目录> <输出目录>
+
+特别注意事项:
+    1. 容差为 None 时取可见光源帧间隔中位数的一半。
+    2. 两个源来自不同设备时须把 SAME_DEVICE 设为 False (或 match(..., same_device=False))，
+       否则会比较两个互不相关的设备时钟。
+"""
+
+import os
+import csv
+import sys
+import time
+from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+import numpy as np
+import cv2
+
+import frame_index
+import segment_store
+import convert_engine
+import video_export
+
+# === 配置 ===
+TOLERANCE_NS = None  # 配对时间容差 (纳秒)，None 表示帧间隔中位数的一半
+SAME_DEVICE = True  # 两个源是否来自同一台设备 (共用设备时钟)
+STACK_FORMAT = "tiff"
+STACK_NAME = "stack_{block_id}_{host_ts}"  # 以可见光帧命名
+CHUNK_SIZE = 32  # 每个写盘任务的帧对数
+PREFETCH = 8  # iter_stacks 预解码的帧对数
+UNMATCHED_NAME = "unmatched.csv"
+
+# visible / nir 为两个帧索引中的记录下标，dt 为 nir - visible 的时间差 (纳秒)
+# timeline 为配对所用的时间线字段 (device_ts 或 video_export.timeline 的字段)
+Pairing = namedtuple("Pairing", "visible nir dt block_offset block_ok unmatched_visible unmatched_nir tolerance "
+                                "timeline")
+
+
+def _nearest(sorted_ts, values):
+    """values 中每个时间戳在 sorted_ts 中最近元素的下标。"""
+    i = np.searchsorted(sorted_ts, values)
+    lo = np.clip(i - 1, 0, len(sorted_ts) - 1)
+    hi = np.clip(i, 0, len(sorted_ts) - 1)
+    return np.where(np.abs(sorted_ts[hi] - values) < np.abs(values - sorted_ts[lo]), hi, lo)
+
+
+def _tick_ns(records):
+    """设备时间戳一个 tick 的纳秒数：用同一批帧的 host_rx_ns 跨度与 device_ts 跨度之比估计，无法估计时取 1。"""
+    ok = (records["device_ts"] > 0) & (records["host_rx_ns"] > 0)
+    device = np.asarray(records["device_ts"][ok], dtype=np.int64)
+    host = np.asarray(records["host_rx_ns"][ok], dtype=np.int64)
+    if len(device) < 2:
+        return 1.0
+    order = np.argsort(device, kind="stable")
+    span = int(device[order[-1]] - device[order[0]])
+    if span <= 0:
+        return 1.0
+    return (int(host[order[-1]]) - int(host[order[0]])) / span
+
+
+def timelines(visible_index, nir_index, same_device=SAME_DEVICE):
+    """
+    两个源用于配对的时间线，返回 (字段名, 可见光纳秒时间戳, NIR 纳秒时间戳)。
+    同一设备且两侧所有帧都有 device_ts 时使用设备时间戳 (两侧相同的原点和换算比例)，否则使用主机时间线。
+    """
+    vr, nr = visible_index.records, nir_index.records
+    if (same_device and len(vr) and len(nr) and np.all(vr["device_ts"] > 0) and np.all(nr["device_ts"] > 0)):
+        scale = _tick_ns(vr)
+        origin = int(min(int(vr["device_ts"].min()), int(nr["device_ts"].min())))
+        vt = ((np.asarray(vr["device_ts"], dtype=np.int64) - origin) * scale).astype(np.int64)
+        nt = ((np.asarray(nr["device_ts"], dtype=np.int64) - origin) * scale).astype(np.int64)
+        return "device_ts", vt, nt
+    field, vt = video_export.timeline(vr)
+    nir_field, nt = video_export.timeline(nr)
+    if nir_field != field:
+        # 两侧可用的字段不同时只能退回都有的 host_ts
+        vt = np.asarray(vr["host_ts"], dtype=np.int64) * 1000000
+        nt = np.asarray(nr["host_ts"], dtype=np.int64) * 1000000
+        field = "host_ts"
+    return field, vt, nt
+
+
+def match(visible_index, nir_index, tolerance=TOLERANCE_NS, strict_block=False, same_device=SAME_DEVICE):
+    """按时间戳互为最近 + 容差配对两个源，用 BlockID 差值校验。返回 Pairing。"""
+    field, vt, nt = timelines(visible_index, nir_index, same_device)
+    if len(vt) == 0 or len(nt) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return Pairing(empty, empty, empty, 0, np.zeros(0, dtype=bool),
+                       np.arange(len(vt)), np.arange(len(nt)), tolerance or 0, field)
+    v_order = np.argsort(vt, kind="stable")
+    n_order = np.argsort(nt, kind="stable")
+    vs, ns = vt[v_order], nt[n_order]
+    if tolerance is None:
+        intervals = np.diff(vs)
+        intervals = intervals[intervals > 0]
+        tolerance = int(np.median(intervals) // 2) if len(intervals) else 0
+
+    # 排序后的位置上做互为最近匹配
+    v_to_n = _nearest(ns, vs)
+    n_to_v = _nearest(vs, ns)
+    mutual = n_to_v[v_to_n] == np.arange(len(vs))
+    dt = ns[v_to_n] - vs
+    ok = mutual & (np.abs(dt) <= tolerance)
+    v_sorted = np.nonzero(ok)[0]
+    n_sorted = v_to_n[v_sorted]
+    visible = v_order[v_sorted]
+    nir = n_order[n_sorted]
+    dt = dt[v_sorted]
+
+    # BlockID 差值校验 (两个源的 BlockID 各自计数，但配对帧之间的差值应固定)
+    offsets = (np.asarray(nir_index.records["block_id"], dtype=np.int64)[nir] -
+               np.asarray(visible_index.records["block_id"], dtype=np.int64)[visible])
+    block_offset = 0
+    if len(offsets):
+        values, counts = np.unique(offsets, return_counts=True)
+        block_offset = int(values[np.argmax(counts)])
+    block_ok = offsets == block_offset
+    if strict_block:
+        visible, nir, dt, block_ok = visible[block_ok], nir[block_ok], dt[block_ok], block_ok[block_ok]
+
+    unmatched_visible = np.setdiff1d(np.arange(len(vt)), visible)
+    unmatched_nir = np.setdiff1d(np.arange(len(nt)), nir)
+    # 配对结果按可见光时间排序
+    order = np.argsort(vt[visible], kind="stable")
+    return Pairing(visible[order], nir[order], dt[order], block_offset, block_ok[order],
+                   unmatched_visible, unmatched_nir, tolerance, field)
+
+
+def report(pairing, visible_index, nir_index):
+    """配对统计的文本报告。"""
+    lines = [f"Paired {len(pairing.visible)} frames "
+             f"(visible {len(visible_index)}, NIR {len(nir_index)}, timeline {pairing.timeline}, "
+             f"tolerance {pairing.tolerance / 1e6:.3f} ms)"]
+    if len(pairing.dt):
+        adt = np.abs(pairing.dt)
+        lines.append(f"  |dt| mean {adt.mean() / 1e6:.3f} ms, p99 {np.percentile(adt, 99) / 1e6:.3f} ms, "
+                     f"max {adt.max() / 1e6:.3f} ms")
+        lines.append(f"  BlockID offset {pairing.block_offset:+d}, mismatched {int((~pairing.block_ok).sum())}")
+    lines.append(f"  Unmatched: visible {len(pairing.unmatched_visible)}, NIR {len(pairing.unmatched_nir)}")
+    return "\n".join(lines)
+
+
+def write_unmatched(path, pairing, visible_index, nir_index, same_device=SAME_DEVICE):
+    """把两侧未配对的帧写成 CSV (source, block_id, host_ts, 配对所用的时间线)。"""
+    _, vt, nt = timelines(visible_index, nir_index, same_device)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["source", "block_id", "host_ts", "timeline_ns"])
+        for name, index, rows, ts in (("visible", visible_index, pairing.unmatched_visible, vt),
+                                      ("nir", nir_index, pairing.unmatched_nir, nt)):
+            recs = index.records[rows]
+            for block_id, host_ts, t in zip(recs["block_id"].tolist(), recs["host_ts"].tolist(),
+                                            ts[rows].tolist()):
+                writer.writerow([name, block_id, host_ts, t])
+
+
+def make_stack(visible_reader, nir_reader, visible_rec, nir_rec, demosaic=cv2.COLOR_BayerRG2BGR):
+    """解码一对帧，返回 (H, W, 4) 的 BGR + NIR 堆叠。"""
+    bgr = convert_engine.read_image(visible_reader, visible_rec, demosaic)
+    if bgr.ndim == 2:
+        bgr = cv2.cvtColor(bgr, cv2.COLOR_GRAY2BGR)
+    nir = convert_engine.read_image(nir_reader, nir_rec, demosaic)
+    if nir.ndim == 3:
+        nir = cv2.cvtColor(nir, cv2.COLOR_BGR2GRAY)
+    h, w = bgr.shape[:2]
+    if nir.shape != (h, w):
+        nir = cv2.resize(nir, (w, h), interpolation=cv2.INTER_LINEAR)
+    return cv2.merge((bgr[:, :, 0], bgr[:, :, 1], bgr[:, :, 2], nir))
+
+
+def iter_stacks(visible_root, nir_root, pairing, visible_index, nir_index, settings=None,
+                workers=4, prefetch=PREFETCH):
+    """
+    按可见光时间顺序产出 (可见光记录, NIR 记录, 堆叠图像)。线程池领先 prefetch 对解码。
+    """
+    settings = settings or convert_engine.DEFAULT_SETTINGS
+    demosaic = convert_engine.DEMOSAIC_CODES[settings["demosaic"]]
+    vr = segment_store.SegmentReader(visible_root)
+    nr = segment_store.SegmentReader(nir_root)
+    pending = deque()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for v, n in zip(pairing.visible.tolist(), pairing.nir.tolist()):
+                vrec, nrec = visible_index.records[v], nir_index.records[n]
+                pending.append((vrec, nrec, executor.submit(make_stack, vr, nr, vrec, nrec, demosaic)))
+                if len(pending) > prefetch:
+                    vrec, nrec, future = pending.popleft()
+                    yield vrec, nrec, future.result()
+            while pending:
+                vrec, nrec, future = pending.popleft()
+                yield vrec, nrec, future.result()
+    finally:
+        vr.close()
+        nr.close()
+
+
+# === 写盘工作进程状态 ===
+_readers = None
+_demosaic = cv2.COLOR_BayerRG2BGR
+
+
+def _init_worker(visible_root, nir_root, demosaic):
+    global _readers, _demosaic
+    _readers = (segment_store.SegmentReader(visible_root), segment_store.SegmentReader(nir_root))
+    _demosaic = demosaic
+
+
+def _write_chunk(visible_recs, nir_recs, paths):
+    """写出一批堆叠，返回 [错误信息或 None]。"""
+    errors = []
+    for vrec, nrec, path in zip(visible_recs, nir_recs, paths):
+        try:
+            stack = make_stack(_readers[0], _readers[1], vrec, nrec, _demosaic)
+            errors.append(None if cv2.imwrite(path, stack) else f"WriteError: cannot write {path}")
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e} (block {int(vrec['block_id'])})")
+    return errors
+
+
+def write_stacks(visible_root, nir_root, pairing, visible_index, nir_index, output_dir, settings=None,
+                 workers=None, fmt=STACK_FORMAT, chunk_size=CHUNK_SIZE):
+    """多进程并行把所有配对写成 4 通道图像，返回 convert_engine.ErrorSummary。"""
+    settings = settings or convert_engine.DEFAULT_SETTINGS
+    os.makedirs(output_dir, exist_ok=True)
+    errors = convert_engine.ErrorSummary()
+    progress = convert_engine.Progress(len(pairing.visible))
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1, initializer=_init_worker,
+                             initargs=(visible_root, nir_root,
+                                       convert_engine.DEMOSAIC_CODES[settings["demosaic"]])) as executor:
+        futures = []
+        for lo in range(0, len(pairing.visible), chunk_size):
+            vrecs = visible_index.records[pairing.visible[lo:lo + chunk_size]]
+            nrecs = nir_index.records[pairing.nir[lo:lo + chunk_size]]
+            paths = [os.path.join(output_dir, STACK_NAME.format(block_id=b, host_ts=t) + "." + fmt)
+                     for b, t in zip(vrecs["block_id"].tolist(), vrecs["host_ts"].tolist())]
+            futures.append(executor.submit(_write_chunk, vrecs, nrecs, paths))
+        for future in as_completed(futures):
+            for error in future.result():
+                if error is not None:
+                    errors.add(error)
+                progress.update(error)
+    return errors
+
+
+def main(visible_root, nir_root, output_dir):
+    visible_index = frame_index.load_index(visible_root)
+    nir_index = frame_index.load_index(nir_root)
+    start = time.perf_counter()
+    pairing = match(visible_index, nir_index)
+    print(f"Matching took {time.perf_counter() - start:.3f}s")
+    print(report(pairing, visible_index, nir_index))
+    os.makedirs(output_dir, exist_ok=True)
+    if len(pairing.unmatched_visible) or len(pairing.unmatched_nir):
+        write_unmatched(os.path.join(output_dir, UNMATCHED_NAME), pairing, visible_index, nir_index)
+    start = time.perf_counter()
+    errors = write_stacks(visible_root, nir_root, pairing, visible_index, nir_index, output_dir)
+    print(f"Wrote {len(pairing.visible) - len(errors)} stacks in {time.perf_counter() - start:.2f}s. "
+          f"Errors: {len(errors)}")
+    if len(errors):
+        print(errors.report())
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4:
+        print("Usage: python pairing.py <visible_dir> <nir_dir> <output_dir>")
+        sys.exit(1)
+    main(*sys.argv[1:])
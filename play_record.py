@@ -1,9 +1,23 @@
 """
-文件名称: test.py (Optimized)
-优化点:
+文件名称: play_record.py
+优化点 (相对 demo/test.py):
 1. 延迟图像转换：仅在需要显示时才进行格式转换，大幅降低 CPU 占用。
 2. 队列监控：增加保存队列大小监控，防止内存溢出。
 3. 结构优化：将显示逻辑解耦。
+4. 分段容器：帧数据追加写入预分配的段文件 (segment_store.py)，不再每帧创建一个 .bin 文件。
+5. 缓冲区租借：PvBuffer 由保存线程写完后再归还管道，零拷贝且不会写入正在被管道复用的内存。
+6. 自适应缓冲池：按内存预算、帧率和实测保存速率计算每个源的缓冲区数量 (buffer_budget.py)。
+7. 多卷条带化：保存线程池可同时写多块磁盘，按源或按段放置并绕开慢卷 (writer_pool.py)。
+8. 二进制帧索引：保存线程写完帧后批量追加定长索引记录 (frame_index.py)，采集线程不再格式化 CSV。
+9. 丢帧统计：按 BlockID 连续性区分网络丢失、管道溢出、保存丢弃和不完整缓冲区，记录到 gaps.idx (frame_gaps.py)。
+10. 无损压缩：可按源选择编解码器，压缩在独立的线程池中完成，编解码器和压缩比记录在帧索引中 (frame_codec.py)。
+11. 分阶段耗时：采集循环每个阶段的耗时计入无锁直方图，周期性输出 p50/p95/p99 (stage_metrics.py)。
+12. 设备时间戳：记录 PvBuffer 设备时间戳和主机单调接收时间，按设备拟合时钟偏移与漂移，索引中保存对齐时间戳 (clock_sync.py)。
+13. 进程模式采集：ACQUISITION_MODE = "process" 时每个源的采集循环运行在独立子进程中，帧经共享内存交给本进程的保存线程池和显示，
+    避免保存、显示转换占用 GIL 推迟其他源的 RetrieveNextBuffer (process_capture.py)；线程模式保留用于对比。
+14. 预览分接：采集循环只把当前帧的引用放入单槽信箱 (后到覆盖)，预览线程先抽取再半尺寸去马赛克，
+    按 PREVIEW_FPS 限速显示，采集线程不再做任何像素转换 (preview_tap.py)。
+15. 节点缓存：GenICam 节点句柄按设备解析一次，SourceSelector 已是当前源时不再切换 (genicam_params.py)。
 """
 
 #!/usr/bin/env python3
@@ -11,46 +25,74 @@ import eBUS as eb
 import sys
 import os
 import time
-import json
-import numpy as np
-import cv2
 import threading
-import queue
 
 # 将 sample/lib 目录添加到系统路径
 sys.path.append("../sample/lib")
 import PvSampleUtils as psu
+import segment_store
+import frame_index
+import frame_gaps
+import buffer_budget
+import writer_pool
+import frame_codec
+import stage_metrics
+import clock_sync
+import process_capture
+import preview_tap
+import genicam_params
 
 # === 配置 ===
-BUFFER_COUNT = 64
-SAVE_DIR = "D:/Yuyuan/Sweetpotato/G8/G8_S3/"
-DISPLAY_INTERVAL = 5
-MAX_SAVE_QUEUE_SIZE = 500
-SAVE_THREAD_NUM = 4  # 启动 4 个写入线程，榨干 SSD 性能
-
-kb = psu.PvKb()
-
-# === 保存队列 ===
-save_queue = queue.Queue(maxsize=MAX_SAVE_QUEUE_SIZE)
-
-def save_worker():
-    """后台保存线程：只负责繁重的二进制数据写入"""
-    while True:
-        item = save_queue.get()
-        if item is None:
-            break
-        bin_path, buffer_data = item  # 不再处理 meta
-        try:
-            with open(bin_path, "wb") as f:
-                f.write(buffer_data)
-        except Exception as e:
-            print(f"[Save Error] {e}")
-        finally:
-            save_queue.task_done()
+# 采集模式: "thread" 每个源一个采集线程；"process" 每个源一个采集子进程 (ProcessSourceStream)
+ACQUISITION_MODE = "thread"
+# 租借模式：保存线程直接写 PvBuffer 内存，写完后再 ReleaseBuffer，无额外拷贝。
+# 关闭时退回拷贝模式：采集线程先 .copy() 再立即归还缓冲区（内存带宽翻倍）。
+LEASE_MODE = True
+# 始终留给管道继续接收的空闲缓冲区数；其余缓冲区用于覆盖保存线程的积压
+CAPTURE_HEADROOM = 16
+# 每个源的缓冲池内存预算 (字节)，None 表示取物理内存的 1/4 再按 SOURCE_COUNT 平分
+MEMORY_BUDGET = None
+SOURCE_COUNT = 3
+# 目标卷列表：第一个为主卷 (帧索引 frames.idx 所在位置)，其余卷只存放段文件
+SAVE_VOLUMES = ["D:/Yuyuan/Sweetpotato/G8/G8_S3/"]
+# 段放置策略: "segment" 按段轮询，"source" 每个源固定一个卷
+PLACEMENT = "segment"
+# BlockID 回绕上限：GEV 1.x 为 16 位；使用 GEV 2.0 扩展 BlockID 时设为 None
+BLOCK_ID_WRAP = frame_gaps.BLOCK_ID_WRAP_16
+# 预览窗口尺寸 (宽, 高) 和每个源的显示频率上限
+PREVIEW_SIZE = (640, 480)
+PREVIEW_FPS = 10.0
+MAX_SAVE_QUEUE_SIZE = 500  # 每个卷的保存队列长度
+SAVE_THREAD_NUM = 4  # 每个卷启动 4 个写入线程，榨干 SSD 性能
+# 每个源使用的无损编解码器 ("raw" 表示不压缩)，可选值见 frame_codec.available_codecs()
+DEFAULT_CODEC = "raw"
+SOURCE_CODECS = {}  # 例如 {"Source0": "zlib", "Source1": "zstd"}
+COMPRESS_WORKERS = None  # 压缩线程数，None 表示 CPU 核数
+MAX_COMPRESS_PENDING = 64  # 同时在压缩中的帧数上限
+# 分阶段耗时指标：滚动的 JSON Lines 文件，METRICS_PORT 不为 None 时提供 http://127.0.0.1:<port>/metrics
+METRICS_FILE = os.path.join(SAVE_VOLUMES[0], "stage_metrics.jsonl")
+METRICS_INTERVAL = 5.0  # 秒
+METRICS_PORT = None
+
+# 进程模式下 spawn 启动的采集子进程会以 __mp_main__ 重新导入本脚本，子进程只运行 process_capture 中的采集循环，
+# 不能再创建保存线程池、指标输出 (可能占用 HTTP 端口) 和键盘监听
+if __name__ != "__mp_main__":
+    kb = psu.PvKb()
 
-# 启动多个保存线程
-for _ in range(SAVE_THREAD_NUM):
-    threading.Thread(target=save_worker, daemon=True).start()
+    # === 保存线程池 (每个卷一个队列) ===
+    save_pool = writer_pool.WriterPool(SAVE_VOLUMES, writer_pool.save_frame,
+                                       threads_per_volume=SAVE_THREAD_NUM,
+                                       queue_size=MAX_SAVE_QUEUE_SIZE,
+                                       placement=PLACEMENT)
+    # === 分阶段耗时统计 ===
+    metrics = stage_metrics.StageMetrics()
+    metrics_exporter = stage_metrics.MetricsExporter(metrics, METRICS_FILE, interval=METRICS_INTERVAL,
+                                                     http_port=METRICS_PORT)
+    # === 压缩线程池 (所有源都不压缩时不创建) ===
+    compressor = None
+    if any(c != "raw" for c in [DEFAULT_CODEC, *SOURCE_CODECS.values()]):
+        compressor = frame_codec.CompressionStage(save_pool, workers=COMPRESS_WORKERS,
+                                                  max_pending=MAX_COMPRESS_PENDING)
 
 class SourceStream:
     def __init__(self, device, connection_id, source_name):
@@ -61,154 +103,418 @@ class SourceStream:
         self.pipeline = None
         self.running = False
         self.capture_thread = None
-        self.display_queue = queue.Queue(maxsize=2)
-        self.save_path = os.path.join(SAVE_DIR, source_name)
+        self.save_path = os.path.join(SAVE_VOLUMES[0], source_name)
         os.makedirs(self.save_path, exist_ok=True)
-        self.frame_count = 0
+        # 预览分接：采集循环每帧只发布引用，转换和显示在预览线程中完成
+        self.preview = preview_tap.PreviewTap(source_name, size=PREVIEW_SIZE, max_fps=PREVIEW_FPS,
+                                              on_escape=self.request_stop)
+        self.codec = SOURCE_CODECS.get(source_name, DEFAULT_CODEC)
+        frame_codec.get_codec(self.codec)  # 未知的编解码器尽早报错
         
-        # CSV 元数据文件句柄
-        self.csv_file = None
+        # 设备时钟模型和节点缓存 (同一设备的所有源共用)
+        self.clock = clock_sync.clock_for(device)
+        self.params = genicam_params.cache_for(device)
+        # 帧索引写入器和丢帧统计
+        self.index = None
+        self.gaps = None
+        # 分段容器写入器
+        self.writer = None
+        # 被保存线程持有、尚未归还管道的缓冲区数
+        self.leased = 0
+        self.lease_cond = threading.Condition()
+        # 已进入保存队列、尚未写完的帧数（保存积压）
+        self.queued = 0
+        # 缓冲池规划
+        self.planner = None
+        self.buffer_count = 0
 
-    def open(self):
-        # ... (保持原有的 open 代码不变) ...
-        stack = eb.PvGenStateStack(self.device.GetParameters())
-        stack.SetEnumValue("SourceSelector", self.source_name)
-
-        result, channel = self.device.GetParameters().GetIntegerValue("SourceIDValue")
-        if result.IsFailure():
-            result, channel = self.device.GetParameters().GetIntegerValue("SourceStreamChannel")
-            if result.IsFailure():
+    def stream_channel(self):
+        """读取当前源的流通道号，失败时返回 None。调用方需先用 self.params.selected() 切换 SourceSelector。"""
+        ok, channel = self.params.get("SourceIDValue")
+        if not ok:
+            ok, channel = self.params.get("SourceStreamChannel")
+            if not ok:
                 print(f"[{self.source_name}] Cannot determine stream channel.")
+                return None
+        return channel
+
+    def plan_buffers(self, payload_size, memory_budget):
+        """按 payload 大小、帧率和内存预算计算缓冲区数量。"""
+        ok, frame_rate = self.params.get("AcquisitionFrameRate")
+        if not ok:
+            frame_rate = 0
+        if memory_budget is None:
+            memory_budget = buffer_budget.default_memory_budget(SOURCE_COUNT)
+        self.planner = buffer_budget.BufferPlanner(payload_size, frame_rate, memory_budget,
+                                                   writer_threads=save_pool.thread_count,
+                                                   sources=SOURCE_COUNT,
+                                                   headroom=CAPTURE_HEADROOM)
+        self.buffer_count = self.planner.initial_count()
+        print(f"[{self.source_name}] Buffer count: {self.buffer_count} "
+              f"({self.buffer_count * payload_size / 2**20:.0f} MiB)")
+        if not buffer_budget.within_budget(self.buffer_count, payload_size, memory_budget):
+            print(f"[{self.source_name}] Warning: memory budget {memory_budget / 2**20:.0f} MiB holds fewer than "
+                  f"{buffer_budget.MIN_BUFFER_COUNT + CAPTURE_HEADROOM} buffers, using the minimum anyway.")
+
+    def open_storage(self):
+        """初始化帧索引、丢帧统计和分段容器。"""
+        self.index = frame_index.FrameIndexWriter(self.save_path)
+        self.gaps = frame_gaps.GapTracker(self.save_path, self.read_pipeline_dropped, wrap=BLOCK_ID_WRAP)
+        self.writer = segment_store.SegmentWriter(
+            self.save_path,
+            volumes=[os.path.join(v, self.source_name) for v in SAVE_VOLUMES],
+            choose_volume=save_pool.chooser(self.source_name))
+
+    def open(self, memory_budget=MEMORY_BUDGET):
+        """
+        打开流并配置管道。memory_budget 为该源缓冲池可用的内存字节数。
+        """
+        # 参数上下文在整个 open() 期间保持为当前源 (通道号和 PayloadSize 都按源读取)
+        with self.params.selected(self.source_name):
+            channel = self.stream_channel()
+            if channel is None:
                 return False
 
-        self.stream = eb.PvStreamGEV()
-        if self.stream.Open(self.connection_id, 0, channel).IsFailure():
-            print(f"[{self.source_name}] Failed to open stream.")
-            return False
+            self.stream = eb.PvStreamGEV()
+            if self.stream.Open(self.connection_id, 0, channel).IsFailure():
+                print(f"[{self.source_name}] Failed to open stream.")
+                return False
 
-        ip = self.stream.GetLocalIPAddress()
-        port = self.stream.GetLocalPort()
-        self.device.SetStreamDestination(ip, port, channel)
+            ip = self.stream.GetLocalIPAddress()
+            port = self.stream.GetLocalPort()
+            self.device.SetStreamDestination(ip, port, channel)
 
-        payload_size = self.device.GetPayloadSize()
+            payload_size = self.device.GetPayloadSize()
+            self.plan_buffers(payload_size, memory_budget)
+
+        # 分配缓冲区不依赖选择器，不占用参数上下文
         self.pipeline = eb.PvPipeline(self.stream)
         self.pipeline.SetBufferSize(payload_size)
-        self.pipeline.SetBufferCount(BUFFER_COUNT)
+        self.pipeline.SetBufferCount(self.buffer_count)
         self.pipeline.Start()
-        
-        # 初始化 CSV 文件
-        csv_path = os.path.join(self.save_path, "metadata.csv")
-        # 如果文件不存在，写入表头
-        write_header = not os.path.exists(csv_path)
-        # 使用 line_buffering=1 确保每行写入后刷新到 OS 缓存，防止程序崩溃丢失数据
-        self.csv_file = open(csv_path, "a", encoding="utf-8", newline="")
-        if write_header:
-            self.csv_file.write("block_id,timestamp,width,height,pixel_type,payload_size,filename\n")
-            
+
+        self.open_storage()
         return True
 
-    # ... (start_acquisition, stop_acquisition 保持不变) ...
     def start_acquisition(self):
-        stack = eb.PvGenStateStack(self.device.GetParameters())
-        stack.SetEnumValue("SourceSelector", self.source_name)
-        self.device.StreamEnable()
-        self.device.GetParameters().Get("AcquisitionStart").Execute()
+        with self.params.selected(self.source_name):
+            self.device.StreamEnable()
+            self.params.execute("AcquisitionStart")
 
     def stop_acquisition(self):
-        stack = eb.PvGenStateStack(self.device.GetParameters())
-        stack.SetEnumValue("SourceSelector", self.source_name)
-        self.device.GetParameters().Get("AcquisitionStop").Execute()
-        self.device.StreamDisable()
+        """停止采集。采集线程已停止 (stop_thread) 时，等保存积压写完后按本轮统计调整下一轮的缓冲池。"""
+        with self.params.selected(self.source_name):
+            self.params.execute("AcquisitionStop")
+            self.device.StreamDisable()
+        if self.capture_thread is None:
+            if self.wait_saved(timeout=30):
+                self.resize_pool()
+            else:
+                print(f"[{self.source_name}] Warning: save backlog not drained, keeping {self.buffer_count} buffers.")
+
+    def return_buffer(self, buffer):
+        """归还缓冲区给管道。可能在保存线程中调用。"""
+        self.pipeline.ReleaseBuffer(buffer)
+        with self.lease_cond:
+            self.leased -= 1
+            self.lease_cond.notify_all()
+
+    def read_pipeline_dropped(self):
+        """读取管道因无空闲缓冲区而丢弃的累计块数，仅在发现 BlockID 跳号时调用。"""
+        params = self.stream.GetParameters()
+        for name in ("PipelineBlocksDropped", "BlocksDropped"):
+            result, value = params.GetIntegerValue(name)
+            if result.IsOK():
+                return value
+        return None
+
+    def enqueued(self):
+        """一帧进入保存队列前由采集线程调用，返回当前保存积压。"""
+        with self.lease_cond:
+            self.queued += 1
+            return self.queued
+
+    def dequeued(self):
+        """一帧写完（或写入失败）后由保存线程调用。"""
+        with self.lease_cond:
+            self.queued -= 1
+            self.lease_cond.notify_all()
+
+    def wait_saved(self, timeout=None):
+        """等待本源已入队的帧全部写完。"""
+        with self.lease_cond:
+            return self.lease_cond.wait_for(lambda: self.queued == 0, timeout)
+
+    def resize_pool(self):
+        """
+        两次采集之间调用：按上一轮保存积压的高水位和消化速率扩大或缩小缓冲池。
+        """
+        count = self.planner.next_count()
+        if count == self.buffer_count:
+            return
+        if not self.wait_leases(timeout=10):
+            print(f"[{self.source_name}] Warning: {self.leased} buffers still leased, "
+                  f"keeping {self.buffer_count} buffers.")
+            return
+        self.pipeline.Stop()
+        self.pipeline.SetBufferCount(count)
+        self.pipeline.Start()
+        print(f"[{self.source_name}] Buffer count: {self.buffer_count} -> {count}")
+        self.buffer_count = count
+
+    def wait_leases(self, timeout=None):
+        """等待所有租出的缓冲区归还，停止管道前必须调用。"""
+        with self.lease_cond:
+            return self.lease_cond.wait_for(lambda: self.leased == 0, timeout)
 
     def close(self):
+        # 预览信箱中可能还持有一份租约
+        self.preview.stop()
         if self.pipeline:
+            if not self.wait_leases(timeout=10):
+                print(f"[{self.source_name}] Warning: {self.leased} buffers still leased at close.")
             self.pipeline.Stop()
         if self.stream:
             self.stream.Close()
-        if self.csv_file:
-            self.csv_file.close()
+        if self.index:
+            # 等待队列中剩余的帧写完，再写出最后一批索引记录
+            if not self.wait_saved(timeout=30):
+                print(f"[{self.source_name}] Warning: {self.queued} frames still queued at close.")
+            self.index.close()
+        if self.gaps:
+            self.gaps.close()
+        if self.writer:
+            # 仍在队列中的帧写完后，段文件会自动截断并关闭
+            self.writer.close()
 
     def run(self):
         self.running = True
         print(f"[{self.source_name}] Acquisition started.")
+        rec = metrics.recorder(self.source_name)
         while self.running and not kb.is_stopping():
+            t = rec.start()
             result, buffer, op_result = self.pipeline.RetrieveNextBuffer(1000)
+            if result.IsFailure():
+                rec.mark("retrieve_timeout", t)
+                continue
+            # 主机单调时钟下的接收时间 (host_ts 仍保留墙上时间毫秒数，便于人工查看)
+            host_rx_ns = time.perf_counter_ns()
+            t = rec.mark("retrieve", t)
+
+            # 采集线程自己持有一份引用，本轮循环结束时释放
+            with self.lease_cond:
+                self.leased += 1
+            lease = writer_pool.BufferLease(self, buffer)
+
+            # BlockID 连续性检查 (包括不完整的缓冲区)
+            block_id = buffer.GetBlockID()
+            timestamp = int(time.time() * 1000)
+            self.gaps.observe(block_id, timestamp)
+            t = rec.mark("observe", t)
             
-            if result.IsOK() and op_result.IsOK():
+            if not op_result.IsOK():
+                self.gaps.record(frame_gaps.GAP_INCOMPLETE, block_id, timestamp, op_result.GetCode())
+            else:
                 image = buffer.GetImage()
-                block_id = buffer.GetBlockID()
-                timestamp = int(time.time() * 1000)
+                device_ts = buffer.GetTimestamp()
+                self.clock.observe(device_ts, host_rx_ns, self.source_name)
                 
                 # 1. 准备数据
                 ptr = image.GetDataPointer()
                 buffer_size = buffer.GetSize()
-                buffer_data = ptr[:buffer_size] 
-                
-                filename = f"frame_{block_id}_{timestamp}.bin"
-                bin_path = os.path.join(self.save_path, filename)
-                
-                # 2. 写入元数据 (直接写入 CSV，极快)
-                # 格式: block_id,timestamp,width,height,pixel_type,payload_size,filename
-                csv_line = f"{block_id},{timestamp},{image.GetWidth()},{image.GetHeight()},{image.GetPixelType()},{buffer_size},{filename}\n"
-                self.csv_file.write(csv_line)
-                # self.csv_file.flush() # 可选：如果非常担心断电数据丢失可开启，但会影响性能
+                if LEASE_MODE:
+                    # 零拷贝视图：保存线程写完前缓冲区不会归还管道
+                    buffer_data = ptr[:buffer_size]
+                    save_lease = lease
+                else:
+                    buffer_data = ptr[:buffer_size].copy()
+                    save_lease = None
                 
-                # 3. 放入保存队列 (仅二进制数据)
-                try:
-                    save_queue.put((bin_path, buffer_data), block=False)
-                except queue.Full:
-                    print(f"[{self.source_name}] Warning: Save queue full! Dropping frame {block_id}")
-
-                # 4. 显示处理
-                self.frame_count += 1
-                if self.frame_count % DISPLAY_INTERVAL == 0:
-                    if not self.display_queue.full():
-                        width = image.GetWidth()
-                        height = image.GetHeight()
-                        pixel_type = image.GetPixelType()
-                        
-                        display_img = None
-                        if pixel_type == eb.PvPixelMono8:
-                            display_img = np.ctypeslib.as_array(ptr, shape=(height, width)).copy()
-                        elif pixel_type == 0x01080009: # BayerRG8
-                            raw_np = np.ctypeslib.as_array(ptr, shape=(height, width))
-                            display_img = cv2.cvtColor(raw_np, cv2.COLOR_BayerRG2RGB)
-                        elif pixel_type == eb.PvPixelRGB8:
-                            raw_np = np.ctypeslib.as_array(ptr, shape=(height, width, 3))
-                            display_img = cv2.cvtColor(raw_np, cv2.COLOR_RGB2BGR)
-                        
-                        if display_img is not None:
-                            self.display_queue.put((block_id, display_img))
-
-            self.pipeline.ReleaseBuffer(buffer)
-        print(f"[{self.source_name}] Acquisition stopped.")
-
-
-    def display_loop(self):
-        while self.running:
-            try:
-                block_id, img = self.display_queue.get(timeout=0.1)
-                # 缩小一点显示，减少渲染压力
-                display_view = cv2.resize(img, (640, 480))
-                cv2.putText(display_view, f"{self.source_name} ID:{block_id}", (10, 30),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
-                cv2.imshow(f"{self.source_name}", display_view)
-                if cv2.waitKey(1) & 0xFF == 27:
-                    self.running = False
-            except queue.Empty:
-                # 保持 UI 响应
-                cv2.waitKey(1)
-                continue
-        cv2.destroyWindow(f"{self.source_name}")
+                # 2. 交给压缩线程池或直接放入保存队列 (仅二进制数据)
+                # meta: block_id, host_ts, device_ts, payload_size, width, height, pixel_type, host_rx_ns, aligned_ts
+                meta = (block_id, timestamp, device_ts, buffer_size,
+                        image.GetWidth(), image.GetHeight(), image.GetPixelType(),
+                        host_rx_ns, self.clock.to_host(device_ts))
+                t = rec.mark("prepare", t)
+                drop_reason = None
+                if save_lease is not None and self.leased > self.buffer_count - CAPTURE_HEADROOM:
+                    # 保存线程积压过多，保留空闲缓冲区给管道，丢弃本帧
+                    drop_reason, drop_detail = "Too many leased buffers", frame_gaps.SAVE_DROP_LEASES
+                elif self.codec != "raw":
+                    # 压缩后大小未知，由压缩线程在段文件中预留位置
+                    if not compressor.submit(self, buffer_data, meta, save_lease, self.codec):
+                        drop_reason, drop_detail = "Compression queue full", frame_gaps.SAVE_DROP_QUEUE_FULL
+                elif not save_pool.store_frame(self, buffer_data, meta, save_lease):
+                    drop_reason, drop_detail = "Save queue full", frame_gaps.SAVE_DROP_QUEUE_FULL
+
+                if drop_reason:
+                    self.gaps.record(frame_gaps.GAP_SAVE_DROP, block_id, timestamp, drop_detail)
+                    print(f"[{self.source_name}] Warning: {drop_reason}! Dropping frame {block_id}")
+                t = rec.mark("submit", t)
+
+                # 3. 预览：只发布引用 (租借模式下多持有一份租约)，抽取和显示由预览线程完成
+                self.preview.publish(buffer_data, image.GetWidth(), image.GetHeight(), int(image.GetPixelType()),
+                                     block_id, save_lease)
+                t = rec.mark("preview", t)
+
+            lease.release()
+            rec.mark("release", t)
+        print(f"[{self.source_name}] Acquisition stopped. {self.gaps.summary()}")
+        print(f"[{self.source_name}] Clock: {self.clock.summary()}")
+        if compressor is not None:
+            print(f"[{self.source_name}] Compression: {compressor.stats()}")
+
+
+    def request_stop(self):
+        """结束采集循环 (预览窗口中按 Esc 时调用)。"""
+        self.running = False
 
     def start_thread(self):
         self.capture_thread = threading.Thread(target=self.run)
         self.capture_thread.start()
-        threading.Thread(target=self.display_loop, daemon=True).start()
+        self.preview.start()
 
     def stop_thread(self):
         self.running = False
         if self.capture_thread:
             self.capture_thread.join()
+            self.capture_thread = None
+        self.preview.stop()
+
+class ProcessSourceStream(SourceStream):
+    """
+    进程模式的源：RetrieveNextBuffer 循环运行在采集子进程中 (process_capture.py)，
+    本进程的 run() 只接收子进程发来的帧描述，把共享内存槽位交给保存线程池和显示。
+    槽位相当于租借模式下的 PvBuffer：BufferLease 最后一个持有者释放后才归还子进程。
+    """
+    def __init__(self, device, connection_id, source_name):
+        super().__init__(device, connection_id, source_name)
+        self.capture = None
+        # 子进程在 BlockID 跳号时附带的管道丢弃计数
+        self.pipeline_dropped = None
+
+    def open(self, memory_budget=MEMORY_BUDGET):
+        with self.params.selected(self.source_name):
+            channel = self.stream_channel()
+            if channel is None:
+                return False
+            # 缓冲池预算用于共享内存槽位 (保存积压)；子进程拷出数据后立即归还 PvBuffer，管道只需少量缓冲区
+            payload_size = self.device.GetPayloadSize()
+            self.plan_buffers(payload_size, memory_budget)
+
+        # 子进程启动较慢，不在参数上下文中等待 (SetStreamDestination 显式指定通道)
+        source = process_capture.EbusSource(self.connection_id, channel, payload_size, CAPTURE_HEADROOM)
+        self.capture = process_capture.ProcessCapture(source, payload_size, self.buffer_count, self.source_name)
+        try:
+            ip, port = self.capture.start()
+        except RuntimeError as e:
+            print(e)
+            self.capture.close()
+            self.capture = None
+            return False
+        self.device.SetStreamDestination(ip, port, channel)
+
+        self.open_storage()
+        return True
+
+    def return_buffer(self, slot):
+        """归还共享内存槽位给采集子进程。可能在保存线程中调用。"""
+        self.capture.free(slot)
+        with self.lease_cond:
+            self.leased -= 1
+            self.lease_cond.notify_all()
+
+    def read_pipeline_dropped(self):
+        return self.pipeline_dropped
+
+    def resize_pool(self):
+        """槽位数量在创建共享内存时已固定，只报告规划器对下一轮的建议并清空本轮统计。"""
+        count = self.planner.next_count()
+        if count != self.buffer_count:
+            print(f"[{self.source_name}] Slot count fixed at {self.buffer_count} (planner suggests {count}).")
+
+    def close(self):
+        self.preview.stop()
+        if self.capture:
+            if not self.wait_leases(timeout=10):
+                print(f"[{self.source_name}] Warning: {self.leased} slots still leased at close.")
+            self.capture.close()
+        super().close()
+
+    def run(self):
+        self.running = True
+        print(f"[{self.source_name}] Acquisition started (process mode).")
+        rec = metrics.recorder(self.source_name)
+        stopping = False
+        while True:
+            if not stopping and (not self.running or kb.is_stopping()):
+                # 通知子进程停止，继续接收直到 "stopped"，不丢下已拷入槽位的帧
+                self.capture.stop()
+                stopping = True
+            t = rec.start()
+            try:
+                msg = self.capture.recv(timeout=0.1)
+            except EOFError:
+                break
+            if msg is None:
+                continue
+            kind = msg[0]
+            if kind == "stopped":
+                break
+            t = rec.mark("receive", t)
+
+            if kind != "frame":
+                block_id, timestamp, dropped = msg[1:4]
+                if dropped is not None:
+                    self.pipeline_dropped = dropped
+                self.gaps.observe(block_id, timestamp)
+                if kind == "incomplete":
+                    self.gaps.record(frame_gaps.GAP_INCOMPLETE, block_id, timestamp, msg[4])
+                else:
+                    self.gaps.record(frame_gaps.GAP_SAVE_DROP, block_id, timestamp, frame_gaps.SAVE_DROP_LEASES)
+                    print(f"[{self.source_name}] Warning: No free shared memory slot! Dropping frame {block_id}")
+                rec.mark("observe", t)
+                continue
+
+            _, slot, child_meta, dropped = msg
+            block_id, timestamp, device_ts, buffer_size, width, height, pixel_type, host_rx_ns = child_meta
+            with self.lease_cond:
+                self.leased += 1
+            lease = writer_pool.BufferLease(self, slot)
+            if dropped is not None:
+                self.pipeline_dropped = dropped
+            self.gaps.observe(block_id, timestamp)
+            self.clock.observe(device_ts, host_rx_ns, self.source_name)
+            t = rec.mark("observe", t)
+
+            # 槽位视图直接交给保存线程，写完后槽位才归还子进程
+            buffer_data = self.capture.view(slot, buffer_size)
+            meta = (block_id, timestamp, device_ts, buffer_size, width, height, pixel_type,
+                    host_rx_ns, self.clock.to_host(device_ts))
+            drop_reason = None
+            if self.codec != "raw":
+                if not compressor.submit(self, buffer_data, meta, lease, self.codec):
+                    drop_reason = "Compression queue full"
+            elif not save_pool.store_frame(self, buffer_data, meta, lease):
+                drop_reason = "Save queue full"
+            if drop_reason:
+                self.gaps.record(frame_gaps.GAP_SAVE_DROP, block_id, timestamp, frame_gaps.SAVE_DROP_QUEUE_FULL)
+                print(f"[{self.source_name}] Warning: {drop_reason}! Dropping frame {block_id}")
+            t = rec.mark("submit", t)
+
+            self.preview.publish(buffer_data, width, height, pixel_type, block_id, lease)
+            t = rec.mark("preview", t)
+
+            lease.release()
+            rec.mark("release", t)
+        print(f"[{self.source_name}] Acquisition stopped. {self.gaps.summary()}")
+        print(f"[{self.source_name}] Capture process: {self.capture.stats}")
+        print(f"[{self.source_name}] Clock: {self.clock.summary()}")
+        if compressor is not None:
+            print(f"[{self.source_name}] Compression: {compressor.stats()}")
+
+
+# 按 ACQUISITION_MODE 选择源的实现，两种模式的 open/start_thread/stop_thread/close 用法相同
+SOURCE_STREAM_CLASSES = {"thread": SourceStream, "process": ProcessSourceStream}
 
-# ... main 函数保持大部分不变，只需确保调用 start_thread ...
\ No newline at end of file
+# ... main 函数保持大部分不变，只需确保调用 start_thread，并用 SOURCE_STREAM_CLASSES[ACQUISITION_MODE] 创建源 ...
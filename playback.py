@@ -0,0 +1,277 @@
+"""
+文件名称: playback.py
+功能描述:
+    直接从录制的段文件播放，不需要先把整段录制转换为图片。
+    1. 按帧索引读取原始帧，在预取线程池中解码、去马赛克，始终领先当前位置 prefetch 帧
+       (倒放或向后单步时向后预取)。
+    2. 解码后的帧进入 LRU 缓存，跳转 (seek) 和单步 (step) 命中缓存时无需重新解码。
+    3. 按录制时间戳控制显示节奏 (时间线同 video_export.timeline)，支持变速播放；
+       落后于时间线超过 late_frames 帧时丢弃过期帧，保持与真实时间同步。
+    4. 键盘控制: 空格 暂停/继续, a/d 单步后退/前进, j/l 跳转 -/+SEEK_SECONDS 秒,
+       -/+ 减速/加速, r 倒放, z 放大 (全分辨率), Esc 退出。
+    5. 传入 previews (preview_cache.PreviewCache) 时，未放大的显示和拖动直接使用预览缓存：
+       按窗口当前的显示宽度选择够用的最粗一级 (PreviewCache.level_for，允许放大 PREVIEW_UPSCALE 倍)，
+       窗口比所有预览级都宽、
+       放大时或该帧尚未进入缓存时才解码全分辨率帧。
+
+使用方法:
+    player = Player(INPUT_DIR, speed=1.0)
+    player.run()
+
+特别注意事项:
+    1. 位置 (pos) 是按时间线排序后的帧序号，与 block_id 无关。
+    2. cv2.cvtColor 和 zlib 等解码会释放 GIL，预取使用线程池即可并行。
+"""
+
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import cv2
+
+import frame_index
+import segment_store
+import convert_engine
+import video_export
+
+# === 配置 ===
+PREFETCH = 8  # 预取帧数
+PREFETCH_WORKERS = 4
+CACHE_SIZE = 64  # LRU 缓存的帧数 (2048x1536 BGR 每帧约 9 MB)
+LATE_FRAMES = 2  # 落后超过多少帧时丢帧
+SEEK_SECONDS = 5.0
+SPEEDS = (0.125, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0)
+WINDOW_NAME = "Playback"
+WINDOW_SIZE = (800, 600)  # 初始窗口尺寸 (宽, 高)
+PREVIEW_UPSCALE = 2.0  # 预览图最多放大多少倍显示，超过时换更细的一级或全分辨率
+
+
+class FrameCache:
+    """按位置缓存解码后图像的 LRU 缓存 (线程安全)。"""
+    def __init__(self, capacity=CACHE_SIZE):
+        self.capacity = capacity
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, pos):
+        with self._lock:
+            image = self._items.get(pos)
+            if image is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(pos)
+            self.hits += 1
+            return image
+
+    def put(self, pos, image):
+        with self._lock:
+            self._items[pos] = image
+            self._items.move_to_end(pos)
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+
+    def __contains__(self, pos):
+        with self._lock:
+            return pos in self._items
+
+
+class Player:
+    """
+    录制播放器。frame(pos) 返回 (图像, 记录)，并在后台预取后续帧；
+    run() 打开窗口按时间戳播放。
+    """
+    def __init__(self, root, index=None, speed=1.0, prefetch=PREFETCH, workers=PREFETCH_WORKERS,
+                 cache_size=CACHE_SIZE, settings=None, late_frames=LATE_FRAMES, previews=None):
+        self.index = index or frame_index.load_index(root)
+        if len(self.index) == 0:
+            raise ValueError(f"No frames in {root}")
+        self.field, ts = video_export.timeline(self.index.records)
+        self.order = np.argsort(ts, kind="stable")
+        self.ts = ts[self.order]
+        self.speed = speed
+        self.prefetch = prefetch
+        self.late_frames = late_frames
+        settings = settings or convert_engine.DEFAULT_SETTINGS
+        self.demosaic = convert_engine.DEMOSAIC_CODES[settings["demosaic"]]
+        # 缓存至少能同时容纳预取窗口两侧的帧，否则预取的帧在显示前就被淘汰
+        self.cache = FrameCache(max(cache_size, 2 * prefetch + 1))
+        self._reader = segment_store.SegmentReader(root)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self._pending = {}  # pos -> Future
+        self._lock = threading.Lock()
+        self.previews = previews
+        self.zoomed = previews is None
+        self.view_width = WINDOW_SIZE[0]  # 窗口显示区域的宽度，run() 中随窗口大小更新
+        self.pos = 0
+        self.direction = 1
+        self.dropped = 0
+        self.preview_frames = 0
+
+    def __len__(self):
+        return len(self.order)
+
+    def record(self, pos):
+        return self.index.records[self.order[pos]]
+
+    def _decode(self, pos):
+        image = convert_engine.read_image(self._reader, self.record(pos), self.demosaic)
+        if image.base is not None:
+            # Mono8 是段文件映射上的视图，缓存前拷贝一份
+            image = image.copy()
+        self.cache.put(pos, image)
+        return image
+
+    def _schedule(self, pos):
+        """确保 pos 已在缓存中或正在解码，返回 Future (已缓存时返回 None)。"""
+        if pos in self.cache:
+            return None
+        with self._lock:
+            future = self._pending.get(pos)
+            if future is not None:
+                return future
+            future = self._executor.submit(self._decode, pos)
+            self._pending[pos] = future
+        # 在锁外注册：已完成的 Future 会在当前线程立即执行回调
+        future.add_done_callback(lambda f, p=pos: self._done(p))
+        return future
+
+    def _done(self, pos):
+        with self._lock:
+            self._pending.pop(pos, None)
+
+    def _prefetch(self, pos):
+        for k in range(1, self.prefetch + 1):
+            p = pos + k * self.direction
+            if 0 <= p < len(self):
+                self._schedule(p)
+
+    def frame(self, pos):
+        """返回 pos 处的图像 (缓存未命中时同步解码) 并预取后续帧。"""
+        image = self.cache.get(pos)
+        if image is None:
+            future = self._schedule(pos)
+            image = future.result() if future is not None else self.cache.get(pos)
+            if image is None:
+                # 解码完成后在取出前已被淘汰
+                image = self._decode(pos)
+        self._prefetch(pos)
+        return image, self.record(pos)
+
+    def view(self, pos):
+        """
+        显示用的图像：未放大时使用能满足窗口显示宽度的最粗一级预览，
+        没有合适的预览级或缓存中还没有该帧时返回全分辨率帧。
+        """
+        if not self.zoomed:
+            rec = self.record(pos)
+            level = self.previews.level_for(int(self.view_width / PREVIEW_UPSCALE), int(rec["width"]))
+            if level is not None:
+                image = self.previews.image(pos, level, int(rec["block_id"]))
+                if image is not None:
+                    self.preview_frames += 1
+                    return image, rec
+        return self.frame(pos)
+
+    def _update_view_width(self, window):
+        """读取窗口显示区域的宽度；后端不支持时保持原值。"""
+        try:
+            width = cv2.getWindowImageRect(window)[2]
+        except (cv2.error, AttributeError):
+            return
+        if width > 0:
+            self.view_width = width
+
+    def seek(self, pos):
+        self.pos = min(max(pos, 0), len(self) - 1)
+        return self.pos
+
+    def seek_time(self, ns):
+        """跳转到时间线上 ns (纳秒) 之前的最后一帧。"""
+        return self.seek(int(np.searchsorted(self.ts, ns, side="right")) - 1)
+
+    def step(self, count=1):
+        return self.seek(self.pos + count)
+
+    def _due(self, anchor_pos, anchor_wall, pos):
+        """pos 按时间线应显示的墙钟时刻。"""
+        return anchor_wall + (self.ts[pos] - self.ts[anchor_pos]) * self.direction / 1e9 / self.speed
+
+    def run(self, window=WINDOW_NAME):
+        cv2.namedWindow(window, cv2.WINDOW_NORMAL)
+        cv2.resizeWindow(window, *WINDOW_SIZE)
+        paused = False
+        anchor_pos, anchor_wall = self.pos, time.perf_counter()
+        try:
+            while True:
+                self._update_view_width(window)
+                image, rec = self.view(self.pos)
+                cv2.imshow(window, self._overlay(image, rec, paused))
+                if paused:
+                    delay = 0
+                else:
+                    nxt = self.pos + self.direction
+                    if not 0 <= nxt < len(self):
+                        paused = True
+                        continue
+                    delay = max(1, int((self._due(anchor_pos, anchor_wall, nxt) - time.perf_counter()) * 1000))
+                key = cv2.waitKey(delay) & 0xFF
+                if key == 27:
+                    break
+                if key == 255:
+                    # 超时：前进到下一帧；落后太多时跳到当前时刻应显示的帧
+                    now = time.perf_counter()
+                    target = nxt
+                    while True:
+                        ahead = target + self.direction * self.late_frames
+                        if not 0 <= ahead < len(self) or self._due(anchor_pos, anchor_wall, ahead) > now:
+                            break
+                        target += self.direction
+                    self.dropped += abs(target - nxt)
+                    self.seek(target)
+                    continue
+                if key == ord(" "):
+                    paused = not paused
+                elif key in (ord("a"), ord("d")):
+                    paused = True
+                    self.direction = 1 if key == ord("d") else -1
+                    self.step(self.direction)
+                elif key in (ord("j"), ord("l")):
+                    sign = 1 if key == ord("l") else -1
+                    self.seek_time(self.ts[self.pos] + int(sign * SEEK_SECONDS * 1e9))
+                elif key in (ord("-"), ord("+"), ord("=")):
+                    i = SPEEDS.index(min(SPEEDS, key=lambda s: abs(s - self.speed)))
+                    i = i - 1 if key == ord("-") else i + 1
+                    self.speed = SPEEDS[min(max(i, 0), len(SPEEDS) - 1)]
+                elif key == ord("r"):
+                    self.direction = -self.direction
+                elif key == ord("z") and self.previews is not None:
+                    self.zoomed = not self.zoomed
+                # 暂停、跳转、变速后重新以当前帧为节奏基准
+                anchor_pos, anchor_wall = self.pos, time.perf_counter()
+        finally:
+            cv2.destroyWindow(window)
+
+    def _overlay(self, image, rec, paused):
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        else:
+            image = image.copy()
+        seconds = (self.ts[self.pos] - self.ts[0]) / 1e9
+        text = (f"{self.pos + 1}/{len(self)}  block {int(rec['block_id'])}  t={seconds:.3f}s  "
+                f"x{self.speed:g}{' <<' if self.direction < 0 else ''}{'  PAUSED' if paused else ''}")
+        scale = max(image.shape[1] / 1600, 0.5)
+        cv2.putText(image, text, (10, int(30 * scale) + 5), cv2.FONT_HERSHEY_SIMPLEX, scale, (0, 255, 0),
+                    max(1, int(2 * scale)))
+        return image
+
+    def stats(self):
+        return {"cache_hits": self.cache.hits, "cache_misses": self.cache.misses, "dropped": self.dropped,
+                "preview_frames": self.preview_frames}
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._reader.close()
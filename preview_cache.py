@@ -0,0 +1,308 @@
+"""
+文件名称: preview_cache.py
+功能描述:
+    录制的预览金字塔与缩略图缓存，用于快速拖动浏览长时间的录制。
+    1. PreviewBuilder 在后台线程中按时间线顺序解码每一帧，逐级缩小 (默认 1/4、1/16，INTER_AREA)，
+       每一级编码为 JPEG 追加到源目录下 previews/ 中该级的数据文件，偏移索引与段文件的 .idx 格式相同
+       (block_id, 时间戳, 偏移, 大小)。2048x1536 的帧在 1/4 级约几十 KB，1/16 级只有几 KB。
+    2. 构建是增量的：已缓存的帧与帧索引一致时只处理新增的帧，中断后可继续。
+    3. 构建完成后生成 contact_sheet.jpg：在整个录制中均匀取 CONTACT_TILES 帧的 1/16 缩略图拼成网格，
+       每格标注时间和 block_id，用于快速定位感兴趣的片段。
+    4. PreviewCache 只读访问缓存 (mmap)，构建过程中也可以打开，会随构建进度自动刷新。
+       playback.Player 拖动浏览时使用预览级别，只有放大 (zoom) 时才解码全分辨率帧。
+
+使用方法:
+    python preview_cache.py <源目录> [<源目录> ...]
+
+特别注意事项:
+    1. 缓存中的位置 (pos) 与 playback.Player 相同：按时间线 (video_export.timeline) 稳定排序后的帧序号。
+    2. 帧索引与缓存的 block_id 不一致时 (例如录制被重新生成) 整个缓存重建。
+"""
+
+import os
+import sys
+import time
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import cv2
+
+import frame_index
+import segment_store
+import convert_engine
+import video_export
+
+# === 配置 ===
+PREVIEW_DIR = "previews"
+LEVELS = (4, 16)  # 每一级相对全分辨率的缩小倍数，必须递增
+JPEG_QUALITY = 85
+CHUNK_SIZE = 64  # 每次并行处理并写盘的帧数
+BUILD_WORKERS = 4
+CONTACT_SHEET = "contact_sheet.jpg"
+CONTACT_TILES = 64
+CONTACT_COLUMNS = 8
+REFRESH_INTERVAL = 0.5  # 构建中的缓存最多每隔多少秒重新映射一次
+
+MAGIC = b"GVFPRV\0\0"
+VERSION = 1
+HEADER = struct.Struct("<8sII")  # 魔数, 版本号, 缩小倍数
+RECORD_DTYPE = np.dtype([
+    ("block_id", "<u8"),
+    ("timestamp", "<i8"),
+    ("offset", "<u8"),
+    ("size", "<u4"),
+])
+assert RECORD_DTYPE.itemsize == segment_store.INDEX_RECORD.size
+
+
+def preview_dir(root):
+    return os.path.join(root, PREVIEW_DIR)
+
+
+def level_paths(root, level):
+    base = os.path.join(preview_dir(root), f"level_{level}")
+    return base + ".dat", base + ".idx"
+
+
+def timeline_order(index):
+    """(按时间线排序的记录下标, 排序后的纳秒时间戳)，与 playback.Player 的位置一致。"""
+    _, ts = video_export.timeline(index.records)
+    order = np.argsort(ts, kind="stable")
+    return order, ts[order]
+
+
+def _read_records(idx_path, level):
+    """读取一级的偏移索引 (memmap)，文件不存在或格式不符时返回空数组。"""
+    if not os.path.exists(idx_path) or os.path.getsize(idx_path) < HEADER.size:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    with open(idx_path, "rb") as f:
+        magic, version, factor = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or version != VERSION or factor != level:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    count = (os.path.getsize(idx_path) - HEADER.size) // RECORD_DTYPE.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    return np.memmap(idx_path, dtype=RECORD_DTYPE, mode="r", offset=HEADER.size, shape=(count,))
+
+
+class PreviewBuilder:
+    """
+    构建一个源目录的预览缓存。build() 同步构建；start() 在后台线程中构建，done 为已缓存的帧数。
+    ready 在缓存文件准备好续写后置位，此后才能安全地打开 PreviewCache (重建时会截断旧文件)。
+    """
+    def __init__(self, root, index=None, levels=LEVELS, workers=BUILD_WORKERS, settings=None):
+        self.root = root
+        self.index = index or frame_index.load_index(root)
+        self.levels = tuple(levels)
+        self.workers = workers
+        settings = settings or convert_engine.DEFAULT_SETTINGS
+        self.demosaic = convert_engine.DEMOSAIC_CODES[settings["demosaic"]]
+        self.done = 0
+        self.total = len(self.index)
+        self.error = None
+        self.errors = 0
+        self._thread = None
+        self._stop = threading.Event()
+        self.ready = threading.Event()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True, name="preview-builder")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        try:
+            self.build()
+        except Exception as e:
+            self.error = e
+            print(f"[Preview Error] {e}")
+        finally:
+            self.ready.set()
+
+    def _resume(self, block_ids):
+        """已缓存且与帧索引一致的帧数 (各级取最小)；不一致的级别被截断为 0。"""
+        done = len(block_ids)
+        for level in self.levels:
+            dat_path, idx_path = level_paths(self.root, level)
+            records = _read_records(idx_path, level)
+            n = min(len(records), len(block_ids))
+            if n and not np.array_equal(np.asarray(records["block_id"][:n]), block_ids[:n]):
+                n = 0
+            done = min(done, n)
+        return done
+
+    def _open_level(self, level, done):
+        """打开一级的数据/索引文件准备续写，丢弃第 done 帧之后的内容。"""
+        dat_path, idx_path = level_paths(self.root, level)
+        if done == 0:
+            with open(idx_path, "wb") as f:
+                f.write(HEADER.pack(MAGIC, VERSION, level))
+            open(dat_path, "wb").close()
+            return open(dat_path, "ab"), open(idx_path, "ab"), 0
+        records = _read_records(idx_path, level)
+        end = int(records["offset"][done - 1]) + int(records["size"][done - 1])
+        del records
+        os.truncate(idx_path, HEADER.size + done * RECORD_DTYPE.itemsize)
+        os.truncate(dat_path, end)
+        return open(dat_path, "ab"), open(idx_path, "ab"), end
+
+    def _render(self, reader, rec):
+        """解码一帧并逐级缩小、编码为 JPEG，返回每一级的字节串；解码失败的帧每一级都为空。"""
+        try:
+            image = convert_engine.read_image(reader, rec, self.demosaic)
+        except Exception as e:
+            self.errors += 1
+            print(f"[Preview Error] block {int(rec['block_id'])}: {e}")
+            return [b""] * len(self.levels)
+        out = []
+        prev = image
+        for level in self.levels:
+            # 由上一级缩小，避免每一级都从全分辨率开始
+            size = (max(1, image.shape[1] // level), max(1, image.shape[0] // level))
+            prev = cv2.resize(prev, size, interpolation=cv2.INTER_AREA)
+            ok, data = cv2.imencode(".jpg", prev, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+            if not ok:
+                raise IOError(f"JPEG encoding failed for block {int(rec['block_id'])}")
+            out.append(data.tobytes())
+        return out
+
+    def build(self):
+        os.makedirs(preview_dir(self.root), exist_ok=True)
+        order, ts = timeline_order(self.index)
+        block_ids = np.asarray(self.index.records["block_id"])[order]
+        start = self._resume(block_ids)
+        self.done = start
+        files = [self._open_level(level, start) for level in self.levels]
+        offsets = [end for _, _, end in files]
+        self.ready.set()
+        reader = segment_store.SegmentReader(self.root)
+        begin = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for lo in range(start, len(order), CHUNK_SIZE):
+                    if self._stop.is_set():
+                        break
+                    recs = [self.index.records[i] for i in order[lo:lo + CHUNK_SIZE]]
+                    # cv2 的缩放和编码会释放 GIL，线程池即可并行
+                    rendered = list(executor.map(lambda r: self._render(reader, r), recs))
+                    for k, (dat, idx, _) in enumerate(files):
+                        batch = np.zeros(len(recs), dtype=RECORD_DTYPE)
+                        for j, levels in enumerate(rendered):
+                            dat.write(levels[k])
+                            batch[j] = (block_ids[lo + j], ts[lo + j], offsets[k], len(levels[k]))
+                            offsets[k] += len(levels[k])
+                        # 先写数据后写索引，读取方只会看到完整的帧
+                        dat.flush()
+                        idx.write(batch.tobytes())
+                        idx.flush()
+                    self.done = lo + len(recs)
+        finally:
+            for dat, idx, _ in files:
+                dat.close()
+                idx.close()
+            reader.close()
+        if self.done == len(order):
+            write_contact_sheet(self.root)
+        elapsed = time.perf_counter() - begin
+        built = self.done - start
+        print(f"[Preview] {self.root}: {built} frames in {elapsed:.1f}s"
+              f"{f' ({built / elapsed:.1f} fps)' if elapsed > 0 and built else ''}, {start} already cached")
+        return self.done
+
+
+class PreviewCache:
+    """只读访问预览缓存。image(pos, level) 返回该位置的预览图像，不存在时返回 None。"""
+    def __init__(self, root, levels=LEVELS):
+        self.root = root
+        self.levels = tuple(levels)
+        self._data = {}
+        self._records = {}
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        """重新映射缓存文件 (构建进行中时缓存会增长)。"""
+        with self._lock:
+            for level in self.levels:
+                dat_path, idx_path = level_paths(self.root, level)
+                records = _read_records(idx_path, level)
+                self._records[level] = records
+                if len(records) and os.path.getsize(dat_path) > 0:
+                    self._data[level] = np.memmap(dat_path, dtype=np.uint8, mode="r")
+                else:
+                    self._data[level] = None
+            self._checked = time.perf_counter()
+
+    def __len__(self):
+        return min((len(r) for r in self._records.values()), default=0)
+
+    def level_for(self, width, full_width):
+        """满足显示宽度 width 的最粗一级；所有预览级都不够时返回 None (需要全分辨率)。"""
+        for level in reversed(self.levels):
+            if full_width // level >= width:
+                return level
+        return None
+
+    def image(self, pos, level, block_id=None):
+        records = self._records.get(level)
+        if records is None:
+            return None
+        if pos >= len(records) and time.perf_counter() - self._checked > REFRESH_INTERVAL:
+            self.refresh()
+            records = self._records[level]
+        if pos >= len(records):
+            return None
+        rec = records[pos]
+        if block_id is not None and int(rec["block_id"]) != block_id:
+            return None
+        offset, size = int(rec["offset"]), int(rec["size"])
+        if size == 0:
+            return None  # 构建时解码失败的帧
+        return cv2.imdecode(self._data[level][offset:offset + size], cv2.IMREAD_COLOR)
+
+
+def write_contact_sheet(root, tiles=CONTACT_TILES, columns=CONTACT_COLUMNS):
+    """用最粗一级的缩略图生成联系表 (均匀采样整个录制)。返回输出路径；缓存为空时返回 None。"""
+    cache = PreviewCache(root)
+    level = cache.levels[-1]
+    records = cache._records[level]
+    if len(records) == 0:
+        return None
+    picks = np.unique(np.linspace(0, len(records) - 1, min(tiles, len(records))).astype(np.int64))
+    thumbs = [cache.image(int(p), level) for p in picks]
+    shapes = [t.shape[:2] for t in thumbs if t is not None]
+    if not shapes:
+        return None
+    h, w = shapes[0]
+    rows = (len(thumbs) + columns - 1) // columns
+    sheet = np.zeros((rows * h, columns * w, 3), dtype=np.uint8)
+    t0 = int(records["timestamp"][0])
+    for k, (p, thumb) in enumerate(zip(picks, thumbs)):
+        r, c = divmod(k, columns)
+        if thumb is None:
+            continue
+        if thumb.shape[:2] != (h, w):
+            thumb = cv2.resize(thumb, (w, h), interpolation=cv2.INTER_AREA)
+        tile = sheet[r * h:(r + 1) * h, c * w:(c + 1) * w]
+        tile[:] = thumb
+        label = f"{(int(records['timestamp'][p]) - t0) / 1e9:.1f}s #{int(records['block_id'][p])}"
+        cv2.putText(tile, label, (2, h - 4), cv2.FONT_HERSHEY_SIMPLEX, 0.3, (0, 255, 0), 1)
+    path = os.path.join(preview_dir(root), CONTACT_SHEET)
+    cv2.imwrite(path, sheet)
+    return path
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python preview_cache.py <source_dir> [<source_dir> ...]")
+        sys.exit(1)
+    for source in sys.argv[1:]:
+        PreviewBuilder(source).build()
@@ -0,0 +1,174 @@
+"""
+文件名称: preview_tap.py
+功能描述:
+    采集预览分接：采集线程只发布当前帧的引用，抽取、去马赛克和显示全部在独立的预览线程中完成。
+    1. 单槽信箱，后到的帧覆盖未取走的帧 (latest-wins)：采集线程 publish() 只是加锁替换一个引用，
+       被覆盖的帧立即释放租约，预览再慢也不会积压，也不会占住多于两个 PvBuffer。
+    2. 先抽取再转换：BayerRG8 按 2x2 像素块半尺寸去马赛克 (R、两个 G 的平均、B 各取一个像素)，
+       块数超过目标尺寸两倍以上时再按块跳采；Mono8 和 RGB8 直接跨步取样。只处理最终显示所需的像素，
+       不再对全分辨率图像 cv2.cvtColor 之后又被 cv2.resize 丢掉大部分像素。
+    3. 显示频率上限 max_fps：两次渲染之间到达的帧只保留最新的一个；
+       等待期间持续调用 cv2.waitKey，窗口保持响应，Esc 触发 on_escape 回调。
+    4. window 为 None 时不显示，只保留最新的预览图 (latest())，供其他界面使用。
+
+使用方法:
+    tap = PreviewTap("Source0", on_escape=stop_capture)
+    tap.start()
+    tap.publish(buffer_data, width, height, pixel_type, block_id, lease)   # 采集线程，每帧调用
+    tap.stop()
+
+特别注意事项:
+    1. lease 不为 None 时 publish() 会 retain() 一份引用，预览线程抽取完成 (或该帧被覆盖) 后释放；
+       lease 为 None 时 data 必须是采集线程不再修改的数据 (例如拷贝模式下的副本)。
+    2. 半尺寸去马赛克的预览分辨率最高为原图的一半，只用于监看，不代表保存的图像质量。
+"""
+
+import time
+import threading
+
+import numpy as np
+import cv2
+
+from batch_convert import PIXEL_TYPE_MONO8, PIXEL_TYPE_BAYERRG8, PIXEL_TYPE_RGB8
+
+# === 配置 ===
+PREVIEW_SIZE = (640, 480)  # 显示尺寸 (宽, 高)
+PREVIEW_FPS = 10.0  # 每个源的显示频率上限
+
+
+def decimate(raw, width, height, pixel_type, size=PREVIEW_SIZE):
+    """
+    把一帧原始数据 (任意支持缓冲区协议的对象) 抽取为约 size 大小的 BGR (或灰度) 预览图，
+    不支持的像素格式返回 None。
+    """
+    out_w, out_h = size
+    buf = np.frombuffer(raw, dtype=np.uint8)
+    if pixel_type == PIXEL_TYPE_BAYERRG8:
+        # (行块, 块内行, 列块, 块内列) 视图：每个 2x2 RGGB 块得到一个像素；
+        # 块数超过目标尺寸两倍以上时按块跳采，只拷出需要的像素
+        h2, w2 = height // 2, width // 2
+        quads = buf[:width * height].reshape(height, width)[:2 * h2, :2 * w2].reshape(h2, 2, w2, 2)
+        step = max(1, min(h2 // out_h, w2 // out_w))
+        r, g1, g2, b = (np.ascontiguousarray(quads[::step, i, ::step, j]) for i, j in ((0, 0), (0, 1), (1, 0), (1, 1)))
+        image = cv2.merge((b, cv2.addWeighted(g1, 0.5, g2, 0.5, 0), r))
+    elif pixel_type == PIXEL_TYPE_MONO8:
+        step = max(1, min(height // out_h, width // out_w))
+        image = buf[:width * height].reshape(height, width)[::step, ::step].copy()
+    elif pixel_type == PIXEL_TYPE_RGB8:
+        step = max(1, min(height // out_h, width // out_w))
+        image = np.ascontiguousarray(buf[:width * height * 3].reshape(height, width, 3)[::step, ::step, ::-1])
+    else:
+        return None
+    if image.shape[1] != out_w or image.shape[0] != out_h:
+        image = cv2.resize(image, size, interpolation=cv2.INTER_LINEAR)
+    return image
+
+
+class PreviewTap:
+    """一个源的预览分接：单槽信箱 + 预览线程。"""
+    def __init__(self, name, size=PREVIEW_SIZE, max_fps=PREVIEW_FPS, window=True, on_escape=None):
+        self.name = name
+        self.size = size
+        self.interval = 1.0 / max_fps if max_fps else 0.0
+        self.window = name if window is True else window
+        self.on_escape = on_escape
+        self._entry = None  # (data, width, height, pixel_type, block_id, lease)
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+        self._latest = None
+        self.published = 0
+        self.superseded = 0
+        self.rendered = 0
+
+    def publish(self, data, width, height, pixel_type, block_id, lease=None):
+        """采集线程调用：用当前帧替换信箱中未取走的帧。"""
+        if lease is not None:
+            lease.retain()
+        with self._cond:
+            old = self._entry
+            self._entry = (data, width, height, pixel_type, block_id, lease)
+            self.published += 1
+            if old is not None:
+                self.superseded += 1
+            self._cond.notify()
+        if old is not None and old[5] is not None:
+            old[5].release()
+
+    def _take(self):
+        with self._cond:
+            entry, self._entry = self._entry, None
+        return entry
+
+    def latest(self):
+        """最近一次生成的 (block_id, 预览图)，还没有时返回 None。"""
+        return self._latest
+
+    def _wait_ui(self, seconds):
+        """等待 seconds 秒；显示窗口时用 cv2.waitKey 等待，保持窗口响应并检查 Esc。"""
+        if self.window is None:
+            if seconds > 0:
+                time.sleep(seconds)
+            return
+        if (cv2.waitKey(max(1, int(seconds * 1000))) & 0xFF) == 27 and self.on_escape is not None:
+            self.on_escape()
+
+    def _run(self):
+        next_due = time.perf_counter()
+        while self._running:
+            with self._cond:
+                self._cond.wait_for(lambda: self._entry is not None or not self._running, timeout=0.1)
+            if not self._running:
+                break
+            if self._entry is None:
+                self._wait_ui(0)
+                continue
+            # 显示频率上限：等待期间到达的帧继续覆盖信箱，到时只取最新的一帧
+            self._wait_ui(next_due - time.perf_counter())
+            entry = self._take()
+            if entry is None:
+                continue
+            data, width, height, pixel_type, block_id, lease = entry
+            try:
+                image = decimate(data, width, height, pixel_type, self.size)
+            except Exception as e:
+                print(f"[{self.name}] Preview error: {e}")
+                image = None
+            finally:
+                # 预览图已是独立的数组，可以归还缓冲区
+                if lease is not None:
+                    lease.release()
+            next_due = time.perf_counter() + self.interval
+            if image is None:
+                continue
+            self._latest = (block_id, image)
+            self.rendered += 1
+            if self.window is not None:
+                if image.ndim == 2:
+                    image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+                cv2.putText(image, f"{self.name} ID:{block_id}", (10, 30),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+                cv2.imshow(self.window, image)
+                self._wait_ui(0)
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=f"preview-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止预览线程并释放信箱中未取走的帧。可重复调用。"""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            if self.window is not None:
+                cv2.destroyWindow(self.window)
+        entry = self._take()
+        if entry is not None and entry[5] is not None:
+            entry[5].release()
+
+    def stats(self):
+        return {"published": self.published, "superseded": self.superseded, "rendered": self.rendered}
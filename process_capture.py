@@ -0,0 +1,265 @@
+"""
+文件名称: process_capture.py
+功能描述:
+    进程模式采集：每个源的 RetrieveNextBuffer 循环运行在独立的子进程中，不再与保存、压缩、显示和
+    CSV 格式化等线程争抢同一个解释器的 GIL。
+    1. 父进程为每个源创建一块共享内存 (multiprocessing.shared_memory)，划分为 slot_count 个
+       payload 大小的槽位，另有一个共享的槽位状态数组 (0 空闲 / 1 占用)。
+    2. 子进程打开自己的 PvStreamGEV 和 PvPipeline，取到缓冲区后把数据拷入一个空闲槽位，
+       立即归还 PvBuffer，再通过管道 (multiprocessing.Pipe) 把槽位号和帧元数据发给父进程。
+       没有空闲槽位时丢弃该帧 (保存积压)，不完整的缓冲区只发送 BlockID 和错误码。
+    3. 父进程把槽位当作零拷贝的 PvBuffer 使用：槽位视图交给 WriterPool / 预览，
+       最后一个持有者释放租约 (writer_pool.BufferLease) 后槽位才标记为空闲，回到子进程。
+    4. 采集循环只依赖一个帧源对象 (open / retrieve / release / pipeline_dropped / close)，
+       真实相机使用 EbusSource，基准测试 (benchmarks/bench_capture_jitter.py) 使用合成帧源。
+
+使用方法:
+    capture = ProcessCapture(EbusSource(connection_id, channel, payload_size, buffer_count),
+                             payload_size, slot_count, name="Source0")
+    ip, port = capture.start()            # 子进程打开流后返回本地地址，由父进程调用 SetStreamDestination
+    msg = capture.recv(timeout=0.1)       # ("frame", slot, meta, dropped) 等，见 _capture_main()
+    view = capture.view(slot, size); ...; capture.free(slot)
+    capture.stop(); capture.close()
+
+特别注意事项:
+    1. 子进程使用 spawn 方式启动 (Windows 只支持 spawn；Linux 上 fork 一个已加载 eBUS、已有线程的进程并不安全)，
+       spawn 会在子进程中重新导入主脚本 (模块名为 __mp_main__)，主脚本的模块级代码不能有副作用，
+       或者用 __name__ 判断跳过 (见 play_record.py)。
+    2. host_rx_ns 由子进程的 time.perf_counter_ns() 给出，它是系统范围的单调时钟，
+       父进程可以直接用于 clock_sync 的时钟拟合。
+    3. 每帧多一次拷贝 (PvBuffer -> 共享内存)，换来 PvBuffer 立即归还管道；
+       管道只需少量缓冲区，保存积压由共享内存槽位承担。
+"""
+
+import time
+import threading
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# === 配置 ===
+RETRIEVE_TIMEOUT_MS = 1000
+START_TIMEOUT = 30.0  # 等待子进程打开流的秒数
+SLOT_FREE = 0
+SLOT_BUSY = 1
+
+
+class EbusSource:
+    """
+    子进程中的 eBUS 帧源：打开 PvStreamGEV 和 PvPipeline，逐个取出缓冲区。
+    只保存可序列化的参数，eBUS 在子进程中调用 open() 时才导入。
+    """
+    def __init__(self, connection_id, channel, payload_size, buffer_count):
+        self.connection_id = connection_id
+        self.channel = channel
+        self.payload_size = payload_size
+        self.buffer_count = buffer_count
+        self.stream = None
+        self.pipeline = None
+        self._buffer = None
+
+    def open(self):
+        """打开流和管道，返回 (本地 IP, 端口)。"""
+        import eBUS as eb
+        self.stream = eb.PvStreamGEV()
+        if self.stream.Open(self.connection_id, 0, self.channel).IsFailure():
+            raise RuntimeError(f"Failed to open stream channel {self.channel}")
+        ip = self.stream.GetLocalIPAddress()
+        port = self.stream.GetLocalPort()
+        self.pipeline = eb.PvPipeline(self.stream)
+        self.pipeline.SetBufferSize(self.payload_size)
+        self.pipeline.SetBufferCount(self.buffer_count)
+        self.pipeline.Start()
+        return ip, port
+
+    def retrieve(self, timeout_ms):
+        """
+        取下一个缓冲区，超时返回 None。否则返回 (block_id, code, device_ts, width, height, pixel_type, data)：
+        code 为 0 表示完整的缓冲区，否则为操作结果的错误码；data 在 release() 之前有效。
+        """
+        result, buffer, op_result = self.pipeline.RetrieveNextBuffer(timeout_ms)
+        if result.IsFailure():
+            return None
+        self._buffer = buffer
+        block_id = buffer.GetBlockID()
+        if not op_result.IsOK():
+            return block_id, op_result.GetCode(), 0, 0, 0, 0, None
+        image = buffer.GetImage()
+        data = image.GetDataPointer()[:buffer.GetSize()]
+        return (block_id, 0, buffer.GetTimestamp(), image.GetWidth(), image.GetHeight(),
+                int(image.GetPixelType()), data)
+
+    def release(self):
+        if self._buffer is not None:
+            self.pipeline.ReleaseBuffer(self._buffer)
+            self._buffer = None
+
+    def pipeline_dropped(self):
+        """管道因无空闲缓冲区而丢弃的累计块数，读不到时返回 None。"""
+        params = self.stream.GetParameters()
+        for name in ("PipelineBlocksDropped", "BlocksDropped"):
+            result, value = params.GetIntegerValue(name)
+            if result.IsOK():
+                return value
+        return None
+
+    def close(self):
+        if self.pipeline:
+            self.pipeline.Stop()
+        if self.stream:
+            self.stream.Close()
+
+
+def _take_slot(states, start):
+    """从 start 开始找一个空闲槽位并标记为占用，没有时返回 None。"""
+    count = len(states)
+    for k in range(count):
+        slot = (start + k) % count
+        if states[slot] == SLOT_FREE:
+            states[slot] = SLOT_BUSY
+            return slot
+    return None
+
+
+def _capture_main(source, shm_name, slot_size, states, conn, stop):
+    """
+    子进程的采集循环。发给父进程的消息:
+        ("open", ip, port) / ("error", 信息)                 打开流的结果，总是第一条
+        ("frame", slot, meta, dropped)                       meta = (block_id, host_ts, device_ts, size,
+                                                             width, height, pixel_type, host_rx_ns)
+        ("incomplete", block_id, host_ts, dropped, code)     不完整的缓冲区
+        ("drop", block_id, host_ts, dropped)                 没有空闲槽位，丢弃
+        ("stopped", 统计字典)                                 循环结束，总是最后一条
+    dropped 为管道丢弃计数，只在 BlockID 不连续时读取，其余情况为 None。
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    slots = np.ndarray((len(states), slot_size), dtype=np.uint8, buffer=shm.buf)
+    stats = {"retrieved": 0, "incomplete": 0, "no_slot": 0, "timeouts": 0}
+    try:
+        try:
+            conn.send(("open",) + tuple(source.open()))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+            return
+        last_block = None
+        next_slot = 0
+        while not stop.is_set():
+            frame = source.retrieve(RETRIEVE_TIMEOUT_MS)
+            host_rx_ns = time.perf_counter_ns()
+            if frame is None:
+                stats["timeouts"] += 1
+                continue
+            stats["retrieved"] += 1
+            block_id, code, device_ts, width, height, pixel_type, data = frame
+            host_ts = int(time.time() * 1000)
+            dropped = None
+            if last_block is not None and block_id != last_block + 1:
+                # 只有跳号时才读取管道计数，父进程的 GapTracker 据此区分网络丢失和管道溢出
+                dropped = source.pipeline_dropped()
+            last_block = block_id
+
+            slot = None
+            if code == 0:
+                size = len(data)
+                slot = _take_slot(states, next_slot) if size <= slot_size else None
+                if slot is not None:
+                    slots[slot, :size] = data
+                    next_slot = slot + 1
+            # 数据已拷出，先归还 PvBuffer 再通知父进程
+            source.release()
+
+            if code != 0:
+                stats["incomplete"] += 1
+                conn.send(("incomplete", block_id, host_ts, dropped, code))
+            elif slot is None:
+                stats["no_slot"] += 1
+                conn.send(("drop", block_id, host_ts, dropped))
+            else:
+                conn.send(("frame", slot, (block_id, host_ts, device_ts, size, width, height, pixel_type,
+                                           host_rx_ns), dropped))
+    finally:
+        try:
+            source.close()
+        finally:
+            del slots
+            shm.close()
+            conn.send(("stopped", stats))
+            conn.close()
+
+
+class ProcessCapture:
+    """
+    父进程一侧的句柄：管理一个源的采集子进程、共享内存槽位和消息管道。
+    threaded=True 时同一个采集循环改在本进程的线程中运行 (线程模式)，仅用于与进程模式对比。
+    """
+    def __init__(self, source, slot_size, slot_count, name="capture", threaded=False):
+        self.name = name
+        self.slot_size = slot_size
+        self.slot_count = slot_count
+        self.threaded = threaded
+        ctx = mp.get_context("spawn")
+        self.shm = shared_memory.SharedMemory(create=True, size=slot_size * slot_count)
+        self.slots = np.ndarray((slot_count, slot_size), dtype=np.uint8, buffer=self.shm.buf)
+        self.states = ctx.RawArray("B", slot_count)
+        self._conn, self._child_conn = ctx.Pipe(duplex=False)
+        self._stop = threading.Event() if threaded else ctx.Event()
+        args = (source, self.shm.name, slot_size, self.states, self._child_conn, self._stop)
+        if threaded:
+            self.process = threading.Thread(target=_capture_main, name=f"capture-{name}", daemon=True, args=args)
+        else:
+            self.process = ctx.Process(target=_capture_main, name=f"capture-{name}", daemon=True, args=args)
+        self.stats = None
+
+    def start(self, timeout=START_TIMEOUT):
+        """启动子进程，等待它打开流，返回 (本地 IP, 端口)；失败时抛出 RuntimeError。"""
+        self.process.start()
+        if not self.threaded:
+            # 子进程持有写端，父进程关闭自己的副本，子进程退出后 recv() 才能收到 EOF
+            self._child_conn.close()
+        if not self._conn.poll(timeout):
+            raise RuntimeError(f"[{self.name}] Capture process did not open its stream in {timeout:.0f}s")
+        msg = self._conn.recv()
+        if msg[0] != "open":
+            raise RuntimeError(f"[{self.name}] Capture process failed: {msg[1]}")
+        return msg[1], msg[2]
+
+    def recv(self, timeout=None):
+        """下一条消息，timeout 秒内没有消息时返回 None；子进程已退出且消息取完时抛出 EOFError。"""
+        if timeout is not None and not self._conn.poll(timeout):
+            return None
+        msg = self._conn.recv()
+        if msg[0] == "stopped":
+            self.stats = msg[1]
+        return msg
+
+    def view(self, slot, size):
+        """槽位中前 size 字节的零拷贝视图，free(slot) 之前有效。"""
+        return self.slots[slot, :size]
+
+    def free(self, slot):
+        """把槽位归还给子进程。可能在保存线程中调用。"""
+        self.states[slot] = SLOT_FREE
+
+    def in_use(self):
+        return sum(self.states)
+
+    def stop(self):
+        """通知子进程结束采集循环，剩余消息仍可通过 recv() 取出。"""
+        self._stop.set()
+
+    def close(self, timeout=10.0):
+        self._stop.set()
+        self.process.join(timeout)
+        if not self.threaded and self.process.is_alive():
+            print(f"[{self.name}] Warning: capture process did not exit, terminating.")
+            self.process.terminate()
+            self.process.join()
+        self._conn.close()
+        del self.slots
+        try:
+            self.shm.close()
+        except BufferError:
+            # 仍有槽位视图未释放 (例如显示队列中的图像)，映射随视图一起回收
+            print(f"[{self.name}] Warning: shared memory still referenced at close.")
+        self.shm.unlink()
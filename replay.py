@@ -4,122 +4,163 @@
 1. 多进程并行处理：利用 CPU 多核加速图像转换和保存。
 2. 颜色修正：修复保存时的 RGB/BGR 通道反转问题。
 3. 模式分离：将批量转换和播放功能分开，互不干扰。
-4. 元数据优化：直接读取 metadata.csv，避免遍历数万个文件的 IO 开销。
+4. 元数据优化：直接 memmap 二进制帧索引 frames.idx (旧录制退回 metadata.csv)，避免遍历数万个文件的 IO 开销。
+5. 分段容器：通过 segment_store.SegmentReader 从段文件中按偏移读取帧，每个进程每个段只映射一次，
+   多卷录制按 volumes.txt 自动定位段文件。
+6. 自动解码：按帧索引中记录的编解码器还原压缩帧 (frame_codec.py)，未压缩的帧仍是零拷贝读取。
+7. 转换引擎：工作进程之间只传递描述符 (段号/偏移或共享内存槽位)，在途帧数有上限，
+   并输出读取/转换/写入各阶段的吞吐 (convert_engine.py)。
+8. 流式处理：任务从帧索引分块惰性生成，结果边完成边统计，实时输出进度和预计剩余时间，错误按类型汇总，
+   内存占用不随录制长度增长。
+9. 增量转换：输出目录中的转换清单 (convert_manifest.py) 记录每帧的源数据位置、CRC32 和转换设置指纹，
+   重新运行时只转换新增、变化或设置已改变的帧，中断后可继续。
+10. 视频导出：EXPORT_MODE = "video" 时直接把录制编码为视频 (video_export.py)，按录制时间戳重采样到恒定帧率，
+    多进程并行编码各片段后拼接。
+11. 直接播放：播放不再读取转换出的 BMP，而是由 playback.py 从段文件预取解码，按录制时间戳控制节奏，
+    支持变速、跳转和单步 (LRU 缓存)。EXPORT_MODE = "play" 时无需先转换即可查看录制。
+12. 预览缓存：播放时后台构建 1/4、1/16 预览金字塔和联系表 (preview_cache.py)，拖动浏览使用预览，
+    放大 (z) 时才解码全分辨率帧。
 """
 
 import os
-import numpy as np
-import cv2
-from concurrent.futures import ProcessPoolExecutor
 import time
 
+import frame_index
+import segment_store
+import convert_engine
+import convert_manifest
+import video_export
+import playback
+import preview_cache
+
 # === 配置 ===
 INPUT_DIR = "C:/Yuyuan/Camera/Test/TTT/Source1"
 OUTPUT_DIR = "C:/Yuyuan/Camera/Test/TTT/PIC/Source1"
-PIXEL_TYPE_MONO8 = 0x01080001
-PIXEL_TYPE_BAYERRG8 = 0x01080009
-
-def process_single_frame(file_info):
-    """
-    单个文件的处理函数，设计为可以被多进程调用
-    """
-    bin_path, width, height, pixel_type, save_path = file_info
-    
-    try:
-        with open(bin_path, 'rb') as f:
-            raw = f.read()
-
-        if pixel_type == PIXEL_TYPE_MONO8:
-            image = np.frombuffer(raw, dtype=np.uint8).reshape((height, width))
-            cv2.imwrite(save_path, image)
-            
-        elif pixel_type == PIXEL_TYPE_BAYERRG8:
-            bayer = np.frombuffer(raw, dtype=np.uint8).reshape((height, width))
-            # 注意：保存为图片时使用 BGR，否则颜色会反转
-            image = cv2.cvtColor(bayer, cv2.COLOR_BayerRG2BGR)
-            cv2.imwrite(save_path, image)
-        else:
-            return f"Unsupported pixel type: {pixel_type}"
-            
-        return None # Success
-    except Exception as e:
-        return f"Error processing {bin_path}: {str(e)}"
+# 转换引擎: "mmap" 工作进程直接映射段文件；"shm" 由父进程读入共享内存后只传槽位号
+ENGINE_MODE = "mmap"
+WORKERS = None  # 工作进程数，None 表示 CPU 核数
+BATCH_SIZE = 8  # 相同几何的帧每批转换的帧数 (batch_convert.py)
+MAX_INFLIGHT = None  # 同时在途的帧数上限，None 表示工作进程数 x BATCH_SIZE x 2
+# 转换设置：输出格式、去马赛克算法 (bilinear/vng/ea)、文件名模板。修改后只有受影响的帧会重新转换
+SETTINGS = dict(convert_engine.DEFAULT_SETTINGS)
+# 跳过已转换的帧前重新读取源数据比对 CRC32 (更慢，但能发现源数据被修改)
+VERIFY_CHECKSUMS = False
+# 导出模式: "images" 逐帧图片 (增量转换后播放)；"video" 直接导出视频；"play" 不转换，直接播放录制
+EXPORT_MODE = "images"
+VIDEO_PATH = os.path.join(OUTPUT_DIR, "session.mp4")
+VIDEO_FPS = None  # 输出帧率，None 表示按录制帧间隔估计
+VIDEO_FOURCC = video_export.DEFAULT_FOURCC
+# 转换后是否播放 (playback.py 直接解码段文件，按录制时间戳控制节奏)
+PLAYBACK = True
+PLAYBACK_SPEED = 1.0
+# 播放时在后台构建预览缓存 (preview_cache.py)，未放大时用 1/4 预览显示和拖动
+PREVIEWS = True
+
+
+def export_video(index):
+    exporter = video_export.VideoExporter(INPUT_DIR, fps=VIDEO_FPS, workers=WORKERS,
+                                          fourcc=VIDEO_FOURCC, settings=SETTINGS)
+    stats = exporter.export(index, VIDEO_PATH)
+    print(f"Video export finished in {stats['seconds']:.2f}s: {stats['frames']} frames at {stats['fps']:.2f} fps "
+          f"from {stats['source_frames']} recorded ({stats['stitch']}) -> {stats['output']}")
+    if len(exporter.errors):
+        print(f"Errors: {len(exporter.errors)}")
+        print(exporter.errors.report())
+
 
 def main():
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     
-    # 1. 读取 metadata.csv
-    csv_path = os.path.join(INPUT_DIR, "metadata.csv")
-    if not os.path.exists(csv_path):
-        print(f"Error: metadata.csv not found in {INPUT_DIR}")
+    # 1. 读取帧索引
+    if not frame_index.has_index(INPUT_DIR):
+        print(f"Error: frame index not found in {INPUT_DIR}")
         print("Please run play_record.py first to generate data.")
         return
 
-    tasks = []
     print("Reading metadata...")
-    with open(csv_path, "r", encoding="utf-8") as f:
-        header = f.readline() # 跳过表头
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            # block_id,timestamp,width,height,pixel_type,payload_size,filename
-            parts = line.split(",")
-            if len(parts) < 7:
-                continue
-            
-            try:
-                width = int(parts[2])
-                height = int(parts[3])
-                pixel_type = int(parts[4])
-                filename = parts[6]
-                
-                bin_path = os.path.join(INPUT_DIR, filename)
-                save_name = filename.replace(".bin", ".bmp")
-                save_path = os.path.join(OUTPUT_DIR, save_name)
-                
-                tasks.append((bin_path, width, height, pixel_type, save_path))
-            except ValueError:
-                continue
-
-    print(f"Found {len(tasks)} frames.")
-
-    if not tasks:
+    index = frame_index.load_index(INPUT_DIR)
+    print(f"Found {len(index)} frames.")
+
+    if len(index) == 0:
         print("No tasks found.")
         return
 
-    # 3. 并行处理 (转换模式)
-    print("Starting batch conversion (Parallel)...")
+    if EXPORT_MODE == "video":
+        export_video(index)
+        return
+    if EXPORT_MODE == "play":
+        play(index)
+        return
+
+    # 3. 并行处理 (转换模式)：任务惰性生成，结果按完成顺序逐个统计
+    print(f"Starting batch conversion (Parallel, {ENGINE_MODE})...")
     start_time = time.time()
     
-    # 使用 ProcessPoolExecutor 利用多核 CPU
-    # chunksize 设置为 10 可以减少进程间通信开销
-    with ProcessPoolExecutor() as executor:
-        results = list(executor.map(process_single_frame, tasks, chunksize=10))
+    slot_size = int(index.records["stored_size"].max()) if ENGINE_MODE == "shm" else 0
+    engine = convert_engine.ConversionEngine(INPUT_DIR, workers=WORKERS, mode=ENGINE_MODE,
+                                             max_inflight=MAX_INFLIGHT, slot_size=slot_size, settings=SETTINGS,
+                                             batch_size=BATCH_SIZE)
+    manifest = convert_manifest.ConversionManifest(OUTPUT_DIR)
+    verify_reader = segment_store.SegmentReader(INPUT_DIR) if VERIFY_CHECKSUMS else None
+    progress = convert_engine.Progress(len(index))
+    errors = convert_engine.ErrorSummary()
+    fingerprints = {}
+
+    def fingerprint(pixel_type):
+        if pixel_type not in fingerprints:
+            fingerprints[pixel_type] = convert_engine.settings_fingerprint(SETTINGS, pixel_type)
+        return fingerprints[pixel_type]
+
+    def pending_tasks():
+        # 清单中已是最新的帧直接跳过
+        for task in convert_engine.iter_tasks(index, OUTPUT_DIR, SETTINGS):
+            if manifest.is_current(task, fingerprint(task.pixel_type), verify_reader):
+                progress.skip()
+            else:
+                yield task
+
+    try:
+        for task, error, crc in engine.run(pending_tasks()):
+            if error is not None:
+                errors.add(error)
+            else:
+                manifest.record(task, fingerprint(task.pixel_type), crc)
+            progress.update(error)
+    finally:
+        manifest.close()
+        engine.close()
+        if verify_reader:
+            verify_reader.close()
 
     # 统计结果
-    errors = [r for r in results if r is not None]
     duration = time.time() - start_time
     print(f"Conversion finished in {duration:.2f}s. Errors: {len(errors)}")
-    if errors:
-        print("First 5 errors:", errors[:5])
-
-    # 4. 播放模式 (可选)
-    # 如果需要播放，读取刚刚生成的 BMP 文件（比实时解压 RAW 快得多）
-    print("Starting playback...")
-    cv2.namedWindow("Playback", cv2.WINDOW_NORMAL)
-    cv2.resizeWindow("Playback", 800, 600)
-    
-    for task in tasks:
-        save_path = task[4]
-        if os.path.exists(save_path):
-            img = cv2.imread(save_path)
-            if img is not None:
-                cv2.imshow("Playback", img)
-                if cv2.waitKey(30) == 27:
-                    break
-    
-    cv2.destroyAllWindows()
+    if len(errors):
+        print(errors.report())
+    for stage, r in engine.counters.report().items():
+        if r["fps"]:
+            print(f"  {stage}: {r['frames']} frames, {r['fps']:.1f} fps, {r['mb_per_s']:.1f} MB/s per worker")
+
+    # 4. 播放模式 (可选)：直接从段文件解码播放，不依赖转换出的图片
+    if PLAYBACK:
+        play(index)
+
+
+def play(index):
+    print("Starting playback (Space pause, a/d step, j/l seek, -/+ speed, r reverse, z zoom, Esc quit)...")
+    builder = previews = None
+    if PREVIEWS:
+        builder = preview_cache.PreviewBuilder(INPUT_DIR, index=index, settings=SETTINGS).start()
+        builder.ready.wait()
+        previews = preview_cache.PreviewCache(INPUT_DIR)
+    player = playback.Player(INPUT_DIR, index=index, speed=PLAYBACK_SPEED, settings=SETTINGS, previews=previews)
+    try:
+        player.run()
+    finally:
+        player.close()
+        if builder:
+            builder.stop()
+    print(f"Playback stats: {player.stats()}")
 
 if __name__ == "__main__":
     main()
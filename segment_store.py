@@ -0,0 +1,285 @@
+"""
+文件名称: segment_store.py
+功能描述:
+    分段追加式录制容器，替代 "每帧一个 .bin 文件" 的保存方式。
+    1. 每个源目录下写入若干预分配的大段文件 (segment_000000.dat, ...)，帧数据首尾相接追加。
+    2. 每个段文件旁有一个紧凑的偏移索引 (segment_000000.idx)，每帧一条定长二进制记录。
+    3. 提供 SegmentReader，供 replay.py 和 read_from_raw.py 按 (段号, 偏移) 直接读取帧，
+       不再需要对每一帧执行 open().read()。帧的元数据见 frame_index.py。
+    4. 支持多卷条带化：一个源的段文件可以分布在多个磁盘上，每个段整体落在一个卷上，
+       卷列表记录在主目录的 volumes.txt 中，读取时自动定位。
+    5. 松散文件模式：旧录制 (每帧一个 .bin + .json) 用 migrate_legacy.py 迁移但不重新打包时，
+       目录中的 loose_files.txt 列出各帧的 .bin 文件，帧索引中的段号即该列表的行号，
+       SegmentReader 按行号直接读取对应文件。
+
+特别注意事项:
+    1. 采集线程调用 reserve() 预留空间（只在锁内计算偏移，极快），保存线程调用 write() 按偏移写入，
+       多个保存线程可以并发写同一个段。
+    2. 段文件先按 SEGMENT_SIZE 预分配，封段（写满或 close）后截断到实际使用长度。
+    3. 如果程序异常退出，段文件尾部可能残留预分配的空洞，读取时以帧索引 / .idx 中的记录为准。
+"""
+
+import os
+import csv
+import mmap
+import struct
+import threading
+from collections import namedtuple
+
+# === 配置 ===
+SEGMENT_SIZE = 1 << 30  # 每个段文件预分配 1 GiB
+SEGMENT_NAME = "segment_{:06d}.dat"
+INDEX_NAME = "segment_{:06d}.idx"
+METADATA_NAME = "metadata.csv"  # 旧版文本元数据，仅用于读取
+VOLUMES_NAME = "volumes.txt"
+LOOSE_FILES_NAME = "loose_files.txt"  # 松散文件模式下段号 -> .bin 文件名
+
+# 段索引记录: block_id, timestamp(ms), offset, size
+INDEX_RECORD = struct.Struct("<QqQI")
+
+FrameRecord = namedtuple(
+    "FrameRecord",
+    "block_id timestamp width height pixel_type payload_size segment offset volume",
+    defaults=(0,),  # 单卷录制的旧 metadata.csv 没有 volume 列
+)
+
+_O_BINARY = getattr(os, "O_BINARY", 0)  # Windows 下必须以二进制方式打开
+_HAS_PWRITE = hasattr(os, "pwrite")
+
+
+def segment_path(root, number):
+    return os.path.join(root, SEGMENT_NAME.format(number))
+
+
+def _next_segment_number(roots):
+    """续写已有目录时，从所有卷上的最大段号之后开始编号，避免覆盖旧数据。"""
+    numbers = [-1]
+    for root in roots:
+        for name in os.listdir(root):
+            if name.startswith("segment_") and name.endswith(".dat"):
+                try:
+                    numbers.append(int(name[8:-4]))
+                except ValueError:
+                    continue
+    return max(numbers) + 1
+
+
+def read_volumes(root):
+    """读取主目录下的卷列表；单卷录制没有 volumes.txt，返回 [root]。"""
+    path = os.path.join(root, VOLUMES_NAME)
+    if not os.path.exists(path):
+        return [root]
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.rstrip("\n") for line in f if line.strip()]
+
+
+def read_loose_files(root):
+    """读取松散文件列表；不是松散文件模式的目录返回 None。"""
+    path = os.path.join(root, LOOSE_FILES_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.rstrip("\n") for line in f]
+
+
+def _write_volumes(roots):
+    path = os.path.join(roots[0], VOLUMES_NAME)
+    roots = [os.path.abspath(r) for r in roots]
+    if os.path.exists(path):
+        if [os.path.abspath(r) for r in read_volumes(roots[0])] != roots:
+            raise ValueError(f"Volume list differs from existing {path}")
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        f.writelines(r + "\n" for r in roots)
+
+
+def _preallocate(fd, size):
+    # Linux 上 posix_fallocate 会真正分配连续块；其他平台退化为扩展文件长度
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError:
+            pass
+    os.ftruncate(fd, size)
+
+
+class _Segment:
+    def __init__(self, root, volume, number, size):
+        self.volume = volume
+        self.number = number
+        self.fd = os.open(segment_path(root, number), os.O_RDWR | os.O_CREAT | os.O_TRUNC | _O_BINARY)
+        _preallocate(self.fd, size)
+        self.index = open(os.path.join(root, INDEX_NAME.format(number)), "wb")
+        self.used = 0
+        self.pending = 0
+        self.sealed = False
+        # 仅在没有 os.pwrite 的平台 (Windows) 上用于保护 lseek + write
+        self.io_lock = threading.Lock()
+
+    def write_at(self, data, offset):
+        view = memoryview(data).cast("B")
+        if _HAS_PWRITE:
+            while view:
+                n = os.pwrite(self.fd, view, offset)
+                view = view[n:]
+                offset += n
+        else:
+            with self.io_lock:
+                os.lseek(self.fd, offset, os.SEEK_SET)
+                while view:
+                    n = os.write(self.fd, view)
+                    view = view[n:]
+
+    def sync(self):
+        # fdatasync 不刷新文件元数据，开销更小；Windows 上退化为 fsync
+        getattr(os, "fdatasync", os.fsync)(self.fd)
+
+    def finish(self):
+        os.ftruncate(self.fd, self.used)
+        os.close(self.fd)
+        self.index.close()
+
+
+class SegmentWriter:
+    """
+    单个源的段文件写入器。reserve() 与 write() 可在不同线程中调用。
+
+    root 为主目录 (帧索引所在目录)；volumes 为该源在各个卷上的目录列表 (第一个应为 root)，
+    choose_volume(段号) 在每次新建段时被调用，返回新段所在卷的下标。
+    sync=True 时每帧写入后都刷盘，write() 返回即表示数据已持久化 (吞吐会明显下降)。
+    """
+    def __init__(self, root, segment_size=SEGMENT_SIZE, volumes=None, choose_volume=None, sync=False):
+        self.roots = list(volumes) if volumes else [root]
+        for r in self.roots:
+            os.makedirs(r, exist_ok=True)
+        if len(self.roots) > 1:
+            _write_volumes(self.roots)
+        self.root = root
+        self.segment_size = segment_size
+        self.choose_volume = choose_volume
+        self.sync = sync
+        self._lock = threading.Lock()
+        self._segments = {}
+        self._current = None
+        self._next_number = _next_segment_number(self.roots)
+
+    def reserve(self, size):
+        """为一帧预留空间，返回 (卷下标, 段号, 偏移)。"""
+        with self._lock:
+            seg = self._current
+            if seg is None or (seg.used > 0 and seg.used + size > self.segment_size):
+                if seg is not None:
+                    self._seal(seg)
+                number = self._next_number
+                volume = self.choose_volume(number) if self.choose_volume else 0
+                seg = _Segment(self.roots[volume], volume, number, max(size, self.segment_size))
+                self._next_number += 1
+                self._segments[seg.number] = seg
+                self._current = seg
+            offset = seg.used
+            seg.used += size
+            seg.pending += 1
+            return seg.volume, seg.number, offset
+
+    def cancel(self, number):
+        """放弃一次预留（例如保存队列已满而丢帧），预留区域保留为空洞。"""
+        with self._lock:
+            self._complete(self._segments[number])
+
+    def write(self, number, offset, data, block_id=0, timestamp=0):
+        """把帧数据写入预留位置，成功后追加一条段索引记录。"""
+        with self._lock:
+            seg = self._segments[number]
+        try:
+            seg.write_at(data, offset)
+            if self.sync:
+                seg.sync()
+            record = INDEX_RECORD.pack(block_id, timestamp, offset, memoryview(data).nbytes)
+        except BaseException:
+            with self._lock:
+                self._complete(seg)
+            raise
+        with self._lock:
+            seg.index.write(record)
+            self._complete(seg)
+
+    def close(self):
+        """封存当前段。仍有未完成写入的段会在最后一次 write() 返回时自动收尾。"""
+        with self._lock:
+            if self._current is not None:
+                self._seal(self._current)
+                self._current = None
+
+    def _seal(self, seg):
+        seg.sealed = True
+        if seg.pending == 0:
+            self._finish(seg)
+
+    def _complete(self, seg):
+        seg.pending -= 1
+        if seg.sealed and seg.pending == 0:
+            self._finish(seg)
+
+    def _finish(self, seg):
+        seg.finish()
+        del self._segments[seg.number]
+
+
+class SegmentReader:
+    """
+    只读访问一个源的段文件。每个段只 mmap 一次，read() 返回零拷贝的 memoryview。
+
+    多卷录制默认使用 volumes.txt 中的卷目录；盘符变化时可通过 volumes 参数覆盖。
+    找不到的段会再到主目录中查找 (例如各卷数据已被拷贝到同一个目录)。
+    松散文件模式的目录 (有 loose_files.txt) 按段号读取对应的 .bin 文件，不做映射 (文件数可能远超映射数上限)。
+    """
+    def __init__(self, root, volumes=None):
+        self.root = root
+        self.roots = list(volumes) if volumes else read_volumes(root)
+        self._maps = {}
+        self._loose = read_loose_files(root)
+
+    def _locate(self, name, volume):
+        path = os.path.join(self.roots[volume], name) if volume < len(self.roots) else None
+        if path is None or not os.path.exists(path):
+            path = os.path.join(self.root, name)
+        return path
+
+    def read(self, number, offset, size, volume=0):
+        if self._loose is not None:
+            with open(os.path.join(self.root, self._loose[number]), "rb") as f:
+                f.seek(offset)
+                return memoryview(f.read(size))
+        mm = self._maps.get(number)
+        if mm is None:
+            with open(self._locate(SEGMENT_NAME.format(number), volume), "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[number] = mm
+        return memoryview(mm)[offset:offset + size]
+
+    def index_records(self, number, volume=0):
+        """读取一个段的偏移索引，返回按偏移排序的 (block_id, timestamp, offset, size) 列表。"""
+        with open(self._locate(INDEX_NAME.format(number), volume), "rb") as f:
+            data = f.read()
+        usable = len(data) - len(data) % INDEX_RECORD.size
+        return sorted(INDEX_RECORD.iter_unpack(data[:usable]), key=lambda r: r[2])
+
+    def close(self):
+        # 仍被外部 memoryview 引用的映射会在引用释放后由 GC 关闭
+        self._maps.clear()
+
+
+def iter_frames(root):
+    """逐行解析旧版 metadata.csv，产出 FrameRecord。格式不完整的行会被跳过。"""
+    path = os.path.join(root, METADATA_NAME)
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.reader(f)
+        next(reader, None)  # 跳过表头
+        for parts in reader:
+            if len(parts) < len(FrameRecord._fields) - 1:
+                continue
+            try:
+                yield FrameRecord(*(int(p) for p in parts[:len(FrameRecord._fields)]))
+            except ValueError:
+                continue
@@ -0,0 +1,198 @@
+"""
+文件名称: stage_metrics.py
+功能描述:
+    采集线程热路径的分阶段耗时统计。
+    1. 每个线程通过 recorder() 取得自己的 StageRecorder，mark() 用 time.perf_counter_ns() 记录
+       上一个时间点到现在的耗时，计入该阶段的对数分桶直方图 (每个 2 的幂 4 个子桶，相对误差约 19%)。
+       每个直方图只被所属线程写入，热路径上没有锁。
+    2. MetricsExporter 周期性汇总所有线程的直方图，计算本周期内各阶段的 count/p50/p95/p99/max，
+       以 JSON Lines 写入滚动的指标文件，并可选地在 localhost 上提供 HTTP 查询 (GET /metrics)。
+
+使用方法:
+    rec = metrics.recorder("Source0")
+    t = rec.start()
+    result = pipeline.RetrieveNextBuffer(1000)
+    t = rec.mark("retrieve", t)
+    ...
+    t = rec.mark("submit", t)
+
+特别注意事项:
+    1. 汇总线程读取直方图时不加锁，个别样本可能计入下一个周期，但不会丢失或重复计数。
+    2. 每次 mark() 的开销约 1 微秒，200 fps 下每帧 6 个阶段的总开销远低于 1%。
+"""
+
+import json
+import time
+import logging
+import threading
+import logging.handlers
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# === 配置 ===
+SUB_BUCKETS = 4  # 每个 2 的幂内的子桶数 (必须是 2 的幂)
+_SUB_BITS = SUB_BUCKETS.bit_length() - 1
+BUCKET_COUNT = 64 * SUB_BUCKETS
+PERCENTILES = (50, 95, 99)
+
+
+def bucket_index(ns):
+    """耗时 (纳秒) 对应的直方图桶。"""
+    if ns < SUB_BUCKETS:
+        return max(ns, 0)
+    bits = ns.bit_length() - 1
+    return (bits - _SUB_BITS + 1) * SUB_BUCKETS + ((ns >> (bits - _SUB_BITS)) & (SUB_BUCKETS - 1))
+
+
+def bucket_value(index):
+    """桶的代表值 (桶区间中点，纳秒)。"""
+    if index < SUB_BUCKETS:
+        return float(index)
+    bits = index // SUB_BUCKETS + _SUB_BITS - 1
+    low = (SUB_BUCKETS + index % SUB_BUCKETS) << (bits - _SUB_BITS)
+    return low + (1 << (bits - _SUB_BITS)) / 2
+
+
+class StageRecorder:
+    """单个线程的分阶段直方图。只能在创建它的线程中调用 mark()。"""
+    def __init__(self, name):
+        self.name = name
+        self.histograms = {}
+
+    @staticmethod
+    def start():
+        return time.perf_counter_ns()
+
+    def mark(self, stage, since):
+        """把 since 到现在的耗时计入 stage，返回当前时间点，作为下一个阶段的起点。"""
+        now = time.perf_counter_ns()
+        hist = self.histograms.get(stage)
+        if hist is None:
+            hist = self.histograms[stage] = [0] * BUCKET_COUNT
+        hist[bucket_index(now - since)] += 1
+        return now
+
+    def snapshot(self):
+        return {stage: list(hist) for stage, hist in list(self.histograms.items())}
+
+
+def summarize(counts):
+    """由一个阶段的桶计数计算 count / p50 / p95 / p99 / max (毫秒)。"""
+    total = sum(counts)
+    if total == 0:
+        return {"count": 0}
+    result = {"count": total}
+    targets = [(p, total * p / 100) for p in PERCENTILES]
+    seen = 0
+    for i, c in enumerate(counts):
+        if not c:
+            continue
+        seen += c
+        while targets and seen >= targets[0][1]:
+            p, _ = targets.pop(0)
+            result[f"p{p}_ms"] = bucket_value(i) / 1e6
+        last = i
+    result["max_ms"] = bucket_value(last) / 1e6
+    return result
+
+
+class StageMetrics:
+    """所有线程的 StageRecorder 注册表。"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._recorders = []
+        self._previous = {}
+
+    def recorder(self, name):
+        """为调用线程创建一个新的 StageRecorder (每个采集线程调用一次)。"""
+        rec = StageRecorder(name)
+        with self._lock:
+            self._recorders.append(rec)
+        return rec
+
+    def collect(self):
+        """汇总自上次 collect() 以来的增量，返回 {recorder 名: {阶段: 统计}}。"""
+        with self._lock:
+            recorders = list(self._recorders)
+        report = {}
+        for rec in recorders:
+            stages = {}
+            for stage, counts in rec.snapshot().items():
+                key = (id(rec), stage)
+                previous = self._previous.get(key)
+                self._previous[key] = counts
+                if previous is not None:
+                    counts = [a - b for a, b in zip(counts, previous)]
+                stages[stage] = summarize(counts)
+            report.setdefault(rec.name, {}).update(stages)
+        return report
+
+
+class MetricsExporter:
+    """
+    周期性汇总 StageMetrics：写入滚动的 JSON Lines 指标文件 (path 为 None 时不写)，
+    http_port 不为 None 时在 127.0.0.1 上提供最近一次汇总 (GET /metrics)。
+    """
+    def __init__(self, metrics, path=None, interval=5.0, http_port=None,
+                 max_bytes=10 * 2**20, backups=5):
+        self.metrics = metrics
+        self.interval = interval
+        self.latest = {}
+        self._stop = threading.Event()
+        self._logger = None
+        if path:
+            self._logger = logging.getLogger(f"stage_metrics.{id(self)}")
+            self._logger.propagate = False
+            self._logger.setLevel(logging.INFO)
+            handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes,
+                                                           backupCount=backups, delay=True)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger.addHandler(handler)
+        self._server = None
+        if http_port is not None:
+            self._server = ThreadingHTTPServer(("127.0.0.1", http_port), self._handler_class())
+            threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _handler_class(self):
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = json.dumps(exporter.latest).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.export()
+
+    def export(self):
+        self.latest = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "stages": self.metrics.collect()}
+        if self._logger:
+            self._logger.info(json.dumps(self.latest))
+        return self.latest
+
+    def close(self):
+        """停止汇总线程，写出最后一个周期，并关闭 HTTP 服务和指标文件。"""
+        self._stop.set()
+        self._thread.join()
+        self.export()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+        if self._logger:
+            for handler in list(self._logger.handlers):
+                handler.close()
+                self._logger.removeHandler(handler)
@@ -0,0 +1,70 @@
+"""
+文件名称: test_clock_sync.py
+功能描述:
+    clock_sync.ClockSync 的无硬件测试：同一设备的两个源交错登记样本时，漂移拟合应收敛且不应重置模型。
+
+使用方法:
+    python -m pytest tests
+"""
+
+import os
+import sys
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import clock_sync
+
+DRIFT_PPM = 50.0
+OFFSET_NS = 123456789
+
+
+def feed_interleaved(clock, seconds=300, fps=30.0, sources=("Source0", "Source1"), seed=1):
+    """
+    模拟同一设备的多个源：设备时钟相对主机漂移 DRIFT_PPM，每帧主机接收时间带 0.1~3 ms 的随机延迟，
+    各源的采集线程按随机顺序调用 observe() (不同源的设备时间戳相互交错、前后颠倒)。
+    """
+    rng = random.Random(seed)
+    samples = []
+    interval_ns = 1e9 / fps
+    for k, source in enumerate(sources):
+        # 各源的曝光时刻错开半帧以内
+        phase = k * interval_ns / (2 * len(sources))
+        for i in range(int(seconds * fps)):
+            device_ns = int(i * interval_ns + phase)
+            host_ns = int(OFFSET_NS + device_ns * (1 + DRIFT_PPM * 1e-6) + rng.uniform(1e5, 3e6))
+            samples.append((host_ns, device_ns, source))
+    samples.sort()
+    # 打乱相邻样本的登记顺序 (不同线程被调度的先后)
+    for i in range(0, len(samples) - 1, 2):
+        if rng.random() < 0.5:
+            samples[i], samples[i + 1] = samples[i + 1], samples[i]
+    for host_ns, device_ns, source in samples:
+        clock.observe(device_ns, host_ns, source)
+    return samples
+
+
+def test_interleaved_sources_converge():
+    clock = clock_sync.ClockSync()
+    samples = feed_interleaved(clock)
+    stats = clock.stats()
+    assert stats["resets"] == 0
+    assert stats["points"] >= 100
+    assert abs(stats["drift_ppm"] - DRIFT_PPM) < 1.0
+    # 对齐时间位于真实曝光时刻 (无延迟的主机时间) 附近，且不晚于任何样本的接收时间
+    host_ns, device_ns, _ = samples[-1]
+    exposure_ns = OFFSET_NS + device_ns * (1 + DRIFT_PPM * 1e-6)
+    aligned = clock.to_host(device_ns)
+    assert abs(aligned - exposure_ns) < 1e6
+    assert aligned <= host_ns
+
+
+def test_device_timestamp_reset():
+    clock = clock_sync.ClockSync()
+    feed_interleaved(clock, seconds=10)
+    # 设备时间戳复位 (GevTimestampControlReset)：从 0 重新开始
+    for i in range(3):
+        clock.observe(i * 33333333, 20_000_000_000 + i * 33333333, "Source0")
+    assert clock.stats()["resets"] == 1
+    # 另一个源随后的新时间戳不应再次触发重置
+    clock.observe(40_000_000, 20_041_000_000, "Source1")
+    assert clock.stats()["resets"] == 1
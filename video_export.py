@@ -0,0 +1,256 @@
+"""
+文件名称: video_export.py
+功能描述:
+    把录制直接导出为视频文件 (cv2.VideoWriter)，不经过逐帧 BMP。
+    1. 按录制的时间戳重采样到恒定帧率：输出第 k 帧显示时刻 t0 + k / fps 之前最近的一帧录制帧，
+       丢帧或采集间隔变长时重复上一帧，突发时丢弃多余的帧，视频时长与真实时间线一致。
+       时间戳优先使用 aligned_ts (设备时间戳换算到主机时钟，见 clock_sync.py)，其次 host_rx_ns，最后 host_ts。
+    2. 输出帧序列按 part_seconds 切成若干片段，由多个进程并行编码为独立的片段文件：
+       每个进程用自己的 SegmentReader 直接映射段文件读取，进程之间只传递片段的帧描述。
+    3. 片段编码完成后按顺序拼接：有 ffmpeg 时用 concat 直接复制码流 (不重新编码)，
+       否则用 OpenCV 逐帧读出片段再写入最终文件。
+    4. 同时写出 <视频名>.frames.csv，记录每个输出帧对应的 block_id 和时间戳，便于从视频定位原始帧。
+
+使用方法:
+    exporter = VideoExporter(INPUT_DIR, fps=None, workers=None)
+    exporter.export(index, "session.mp4")
+
+特别注意事项:
+    1. 视频尺寸取第一帧的宽高，几何不同的帧会被缩放。Mono8 帧以灰度写入彩色视频。
+    2. 单帧读取或解码失败时重复上一帧 (片段开头则为黑帧)，错误按类型汇总，不中断导出。
+    3. fps 为 None 时按录制帧间隔的中位数估计。
+"""
+
+import os
+import csv
+import time
+import shutil
+import tempfile
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import cv2
+
+import segment_store
+import frame_codec
+import batch_convert
+import convert_engine
+
+# === 配置 ===
+DEFAULT_FOURCC = "mp4v"
+PART_SECONDS = 10.0  # 每个并行编码片段的时长 (秒)
+DEFAULT_FPS = 30.0  # 无法从录制估计帧率时使用
+TIMELINE_FIELDS = ("aligned_ts", "host_rx_ns")  # 按优先级选择时间线字段 (纳秒)
+FRAMES_SUFFIX = ".frames.csv"
+
+
+def timeline(records):
+    """返回 (字段名, 纳秒时间戳数组)：使用第一个所有帧都有值的时间线字段，否则用 host_ts (毫秒) 换算。"""
+    for field in TIMELINE_FIELDS:
+        values = np.asarray(records[field], dtype=np.int64)
+        if len(values) and np.all(values > 0):
+            return field, values
+    return "host_ts", np.asarray(records["host_ts"], dtype=np.int64) * 1000000
+
+
+def estimate_fps(ts):
+    """按帧间隔的中位数估计帧率；ts 为已排序的纳秒时间戳。"""
+    intervals = np.diff(ts)
+    intervals = intervals[intervals > 0]
+    if len(intervals) == 0:
+        return DEFAULT_FPS
+    return 1e9 / float(np.median(intervals))
+
+
+def resample(ts, fps):
+    """
+    恒定帧率重采样：ts 为已排序的纳秒时间戳，返回每个输出帧对应的 ts 下标。
+    输出第 k 帧取时刻 ts[0] + k / fps 之前 (含) 的最后一帧。
+    """
+    period = 1e9 / fps
+    count = int((ts[-1] - ts[0]) // period) + 1
+    slots = ts[0] + np.round(np.arange(count) * period).astype(np.int64)
+    return np.searchsorted(ts, slots, side="right") - 1
+
+
+# === 工作进程状态 ===
+_reader = None
+_converters = {}
+
+
+def _init_worker(root):
+    global _reader
+    _reader = segment_store.SegmentReader(root)
+
+
+def _to_bgr(rec, demosaic, size):
+    """读取、解码一帧并转换为 size 大小的 BGR 图像。"""
+    width, height, pixel_type = int(rec["width"]), int(rec["height"]), int(rec["pixel_type"])
+    key = (width, height, pixel_type)
+    conv = _converters.get(key)
+    if conv is None:
+        conv = _converters[key] = batch_convert.BatchConverter(width, height, pixel_type, 1, demosaic)
+    stored = _reader.read(int(rec["segment"]), int(rec["offset"]), int(rec["stored_size"]), int(rec["volume"]))
+    payload = frame_codec.decode(int(rec["codec"]), stored, int(rec["payload_size"]))
+    image = next(conv.convert([payload]))
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    if (width, height) != size:
+        image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    return image
+
+
+def _encode_part(path, records, picks, fps, size, fourcc, demosaic):
+    """
+    编码一个片段：picks[k] 是输出第 k 帧在 records 中的下标，连续重复的下标只解码一次。
+    返回 (写入帧数, 解码帧数, [错误信息])。
+    """
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+    if not writer.isOpened():
+        raise IOError(f"Cannot open video writer for {path} (fourcc {fourcc})")
+    errors = []
+    decoded = 0
+    image = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+    last = -1
+    try:
+        for pick in picks:
+            if pick != last:
+                last = pick
+                rec = records[pick]
+                try:
+                    image = _to_bgr(rec, demosaic, size)
+                    decoded += 1
+                except Exception as e:
+                    errors.append(f"{type(e).__name__}: {e} (block {int(rec['block_id'])})")
+            # VideoWriter.write 会拷贝数据，复用的转换输出缓冲区可以直接写入
+            writer.write(image)
+    finally:
+        writer.release()
+    return len(picks), decoded, errors
+
+
+def stitch(parts, output, fps, size, fourcc=DEFAULT_FOURCC):
+    """按顺序拼接片段文件。有 ffmpeg 时直接复制码流，否则用 OpenCV 重新编码。返回使用的方法。"""
+    if len(parts) == 1:
+        shutil.move(parts[0], output)
+        return "move"
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg:
+        listing = os.path.join(os.path.dirname(parts[0]), "parts.txt")
+        with open(listing, "w", encoding="utf-8") as f:
+            for p in parts:
+                f.write("file '{}'\n".format(os.path.abspath(p).replace("'", "'\\''")))
+        result = subprocess.run([ffmpeg, "-y", "-loglevel", "error", "-f", "concat", "-safe", "0",
+                                 "-i", listing, "-c", "copy", output], capture_output=True, text=True)
+        if result.returncode == 0:
+            return "ffmpeg"
+        print(f"[Video] ffmpeg concat failed, falling back to OpenCV: {result.stderr.strip()}")
+    writer = cv2.VideoWriter(output, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+    if not writer.isOpened():
+        raise IOError(f"Cannot open video writer for {output} (fourcc {fourcc})")
+    try:
+        for p in parts:
+            cap = cv2.VideoCapture(p)
+            while True:
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                writer.write(frame)
+            cap.release()
+    finally:
+        writer.release()
+    return "opencv"
+
+
+class VideoExporter:
+    """
+    录制 -> 视频导出。export(index, output) 返回统计字典；
+    errors 为 convert_engine.ErrorSummary，记录解码失败的帧。
+    """
+    def __init__(self, root, fps=None, workers=None, part_seconds=PART_SECONDS, fourcc=DEFAULT_FOURCC,
+                 settings=None, keep_parts=False):
+        self.root = root
+        self.fps = fps
+        self.workers = workers or os.cpu_count() or 1
+        self.part_seconds = part_seconds
+        self.fourcc = fourcc
+        self.settings = settings or convert_engine.DEFAULT_SETTINGS
+        self.keep_parts = keep_parts
+        self.errors = convert_engine.ErrorSummary()
+
+    def plan(self, index):
+        """
+        计算时间线和重采样结果，返回 (按时间排序的记录下标, 排序后的时间戳, 输出帧 -> 排序下标, 字段名, 帧率)。
+        """
+        field, ts = timeline(index.records)
+        order = np.argsort(ts, kind="stable")
+        ts = ts[order]
+        fps = self.fps or estimate_fps(ts)
+        return order, ts, resample(ts, fps), field, fps
+
+    def export(self, index, output):
+        if len(index) == 0:
+            raise ValueError("No frames to export")
+        start = time.perf_counter()
+        order, ts, picks, field, fps = self.plan(index)
+        first = index.records[order[0]]
+        size = (int(first["width"]), int(first["height"]))
+        demosaic = convert_engine.DEMOSAIC_CODES[self.settings["demosaic"]]
+        per_part = max(1, int(round(self.part_seconds * fps)))
+        out_dir = os.path.dirname(os.path.abspath(output))
+        os.makedirs(out_dir, exist_ok=True)
+        ext = os.path.splitext(output)[1] or ".mp4"
+        work_dir = tempfile.mkdtemp(prefix="parts_", dir=out_dir)
+        print(f"[Video] {len(index)} frames -> {len(picks)} output frames at {fps:.2f} fps "
+              f"(timeline {field}), {(len(picks) + per_part - 1) // per_part} parts")
+
+        parts = []
+        written = decoded = 0
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                     initargs=(self.root,)) as executor:
+                futures = {}
+                for n, lo in enumerate(range(0, len(picks), per_part)):
+                    chunk = picks[lo:lo + per_part]
+                    # 只把本片段用到的记录交给工作进程
+                    used, local = np.unique(chunk, return_inverse=True)
+                    path = os.path.join(work_dir, f"part_{n:05d}{ext}")
+                    parts.append(path)
+                    future = executor.submit(_encode_part, path, index.records[order[used]], local,
+                                             fps, size, self.fourcc, demosaic)
+                    futures[future] = n
+                progress = convert_engine.Progress(len(futures))
+                for future in as_completed(futures):
+                    frames, count, errors = future.result()
+                    written += frames
+                    decoded += count
+                    for e in errors:
+                        self.errors.add(e)
+                    progress.update()
+            method = stitch(parts, output, fps, size, self.fourcc)
+            self._write_frames(output, index.records[order[picks]], ts[picks])
+        finally:
+            if not self.keep_parts:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+        return {
+            "output": output,
+            "fps": fps,
+            "timeline": field,
+            "frames": written,
+            "decoded": decoded,
+            "source_frames": len(index),
+            "errors": len(self.errors),
+            "stitch": method,
+            "seconds": time.perf_counter() - start,
+        }
+
+    def _write_frames(self, output, records, ts):
+        """输出帧 -> 原始帧的对应表，timeline_ns 为重采样所用的时间线 (字段见返回结果中的 timeline)。"""
+        with open(os.path.splitext(output)[0] + FRAMES_SUFFIX, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["frame", "block_id", "host_ts", "timeline_ns"])
+            for k, (block_id, host_ts, t) in enumerate(zip(records["block_id"].tolist(),
+                                                          records["host_ts"].tolist(), ts.tolist())):
+                writer.writerow([k, block_id, host_ts, t])
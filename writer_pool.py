@@ -0,0 +1,264 @@
+"""
+文件名称: writer_pool.py
+功能描述:
+    多卷条带化保存线程池，替代所有线程写同一个 SAVE_DIR 的 save_worker。
+    1. 每个目标卷 (一块 SSD/NVMe) 拥有独立的保存队列和写入线程，互不阻塞。
+    2. 段的放置策略：
+       - "source": 每个源固定写一个卷 (按源的注册顺序轮流分配)。
+       - "segment": 每个新段按轮询选择卷。
+    3. 统计每个卷的队列深度、积压字节数和写入吞吐 (指数滑动平均)，
+       新建段时绕开预计清空时间明显更长的慢卷。
+
+特别注意事项:
+    1. 放置决策只发生在新建段时，一个段始终完整地落在一个卷上，便于回放时按段定位。
+    2. handler(item) 由调用方提供，负责真正的写入以及写完后的清理 (例如归还 PvBuffer)。
+       录制程序使用 save_frame() 作为 handler，配合 submit_frame() 和 BufferLease 使用。
+"""
+
+import time
+import queue
+import threading
+
+import frame_gaps
+
+# === 配置 ===
+SLOW_FACTOR = 2.0  # 预计清空时间超过最快卷的倍数即视为慢卷
+THROUGHPUT_ALPHA = 0.1  # 吞吐滑动平均系数
+MIN_DRAIN_SECONDS = 0.05  # 积压低于此清空时间的卷不参与慢卷判断
+
+
+class BufferLease:
+    """
+    PvBuffer 的引用计数租约。最后一个持有者调用 release() 时才把缓冲区归还给管道
+    (source.return_buffer)，因此采集线程和保存线程都可以安全地直接访问缓冲区内存。
+    """
+    def __init__(self, source, buffer):
+        self.source = source
+        self.buffer = buffer
+        self._refs = 1
+        self._lock = threading.Lock()
+
+    def retain(self):
+        with self._lock:
+            self._refs += 1
+        return self
+
+    def release(self):
+        with self._lock:
+            self._refs -= 1
+            if self._refs > 0:
+                return
+        self.source.return_buffer(self.buffer)
+
+
+def save_frame(item):
+    """
+    保存线程的写入任务：只负责繁重的二进制数据写入。
+    source 需提供 writer (SegmentWriter)、index (FrameIndexWriter)、planner (BufferPlanner)、
+    gaps (GapTracker) 和 dequeued()。写入成功 (数据和索引记录都已写出) 时返回 True。
+    """
+    source, segment, offset, buffer_data, record, lease = item
+    ok = False
+    try:
+        # 写入采集线程预留好的段内偏移，多个线程可并发写同一个段
+        start = time.perf_counter()
+        source.writer.write(segment, offset, buffer_data, record[0], record[1])
+        source.planner.on_written(time.perf_counter() - start)
+        # 只有真正落盘的帧才进入帧索引
+        source.index.append(*record)
+        ok = True
+    except Exception as e:
+        print(f"[Save Error] {e}")
+        source.gaps.record(frame_gaps.GAP_SAVE_DROP, record[0], record[1], frame_gaps.SAVE_DROP_WRITE_ERROR)
+    finally:
+        # 写完后才把 PvBuffer 归还给管道（拷贝模式下 lease 为 None）
+        if lease is not None:
+            lease.release()
+        source.dequeued()
+    return ok
+
+
+class Volume:
+    """单个目标卷的队列与统计。"""
+    def __init__(self, index, root, queue_size):
+        self.index = index
+        self.root = root
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.threads = []
+        self._lock = threading.Lock()
+        self.pending_bytes = 0
+        self.high_water = 0
+        self.bytes_written = 0
+        self.frames_written = 0
+        self.throughput = 0.0  # 字节/秒，滑动平均
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def drain_seconds(self):
+        """按当前吞吐估计清空积压所需的时间。尚无吞吐数据时视为 0。"""
+        if self.throughput <= 0:
+            return 0.0
+        return self.pending_bytes / self.throughput
+
+    def _queued(self, nbytes):
+        with self._lock:
+            self.pending_bytes += nbytes
+            depth = self.queue.qsize() + 1
+            if depth > self.high_water:
+                self.high_water = depth
+
+    def _cancelled(self, nbytes):
+        with self._lock:
+            self.pending_bytes -= nbytes
+
+    def _written(self, nbytes, seconds):
+        with self._lock:
+            self.pending_bytes -= nbytes
+            self.bytes_written += nbytes
+            self.frames_written += 1
+            if seconds > 0:
+                rate = nbytes / seconds
+                if self.throughput <= 0:
+                    self.throughput = rate
+                else:
+                    self.throughput += THROUGHPUT_ALPHA * (rate - self.throughput)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "root": self.root,
+                "depth": self.queue.qsize(),
+                "high_water": self.high_water,
+                "pending_mb": self.pending_bytes / 2**20,
+                "written_mb": self.bytes_written / 2**20,
+                "frames": self.frames_written,
+                "throughput_mbps": self.throughput / 2**20,
+            }
+
+
+class WriterPool:
+    """
+    每个卷一个队列 + threads_per_volume 个写入线程。
+    handler(item) 在写入线程中执行；submit() 的 nbytes 用于吞吐和积压统计。
+    """
+    def __init__(self, roots, handler, threads_per_volume=2, queue_size=500, placement="segment"):
+        if placement not in ("segment", "source"):
+            raise ValueError(f"Unknown placement: {placement}")
+        self.handler = handler
+        self.placement = placement
+        self.volumes = [Volume(i, r, queue_size) for i, r in enumerate(roots)]
+        self._lock = threading.Lock()
+        self._cursor = 0
+        self._pinned = {}
+        for v in self.volumes:
+            for _ in range(threads_per_volume):
+                t = threading.Thread(target=self._worker, args=(v,), daemon=True)
+                t.start()
+                v.threads.append(t)
+
+    @property
+    def thread_count(self):
+        return sum(len(v.threads) for v in self.volumes)
+
+    def chooser(self, source_name):
+        """返回给 SegmentWriter 使用的 choose_volume 回调。"""
+        with self._lock:
+            if source_name not in self._pinned:
+                self._pinned[source_name] = len(self._pinned) % len(self.volumes)
+        return lambda segment: self.choose(source_name)
+
+    def choose(self, source_name):
+        """为一个新段选择卷：先按放置策略给出候选，再绕开慢卷。"""
+        with self._lock:
+            if self.placement == "source":
+                preferred = self._pinned.get(source_name, 0)
+            else:
+                preferred = self._cursor
+                self._cursor = (self._cursor + 1) % len(self.volumes)
+            drain = [v.drain_seconds() for v in self.volumes]
+            fastest = min(drain)
+            limit = max(fastest * SLOW_FACTOR, MIN_DRAIN_SECONDS)
+            # 从候选卷开始按顺序找第一个不慢的卷
+            for k in range(len(self.volumes)):
+                i = (preferred + k) % len(self.volumes)
+                if drain[i] <= limit:
+                    return i
+            return drain.index(fastest)
+
+    def submit(self, volume, nbytes, item, block=False):
+        """把写入任务放入指定卷的队列；队列已满且 block=False 时抛出 queue.Full。"""
+        v = self.volumes[volume]
+        v._queued(nbytes)
+        try:
+            v.queue.put((nbytes, item), block=block)
+        except queue.Full:
+            v._cancelled(nbytes)
+            raise
+
+    def submit_frame(self, source, volume, segment, offset, buffer_data, record, lease=None, block=False):
+        """
+        把一帧交给 save_frame() 写入。lease 不为 None 时为保存线程额外持有一份引用。
+        保存队列已满时撤销引用和积压计数并返回 False；block=True 时等待队列空位 (基准测试不限速时使用)。
+        """
+        if lease is not None:
+            lease.retain()  # 保存线程的引用，写完后释放
+        backlog = source.enqueued()
+        try:
+            # 压缩后写入的字节数可能小于 payload_size，按实际写入量统计
+            nbytes = memoryview(buffer_data).nbytes
+            self.submit(volume, nbytes, (source, segment, offset, buffer_data, record, lease), block=block)
+        except queue.Full:
+            if lease is not None:
+                lease.release()
+            source.dequeued()
+            return False
+        source.planner.on_enqueue(backlog)
+        return True
+
+    def store_frame(self, source, data, meta, lease=None, codec=0, codec_us=0):
+        """
+        在源的 SegmentWriter 中预留空间并提交写入，失败时撤销预留并返回 False。
+        meta 为 (block_id, host_ts, device_ts, payload_size, width, height, pixel_type, host_rx_ns, aligned_ts)；
+        data 是实际写入的数据 (未压缩时即 payload 本身)。
+        """
+        block_id, host_ts, device_ts, payload_size, width, height, pixel_type, host_rx_ns, aligned_ts = meta
+        stored_size = memoryview(data).nbytes
+        volume, segment, offset = source.writer.reserve(stored_size)
+        record = (block_id, host_ts, device_ts, offset, payload_size, width, height, pixel_type,
+                  segment, volume, 0, stored_size, codec, codec_us, host_rx_ns, aligned_ts)
+        if not self.submit_frame(source, volume, segment, offset, data, record, lease):
+            source.writer.cancel(segment)
+            return False
+        return True
+
+    def _worker(self, volume):
+        while True:
+            entry = volume.queue.get()
+            if entry is None:
+                volume.queue.task_done()
+                break
+            nbytes, item = entry
+            start = time.perf_counter()
+            try:
+                self.handler(item)
+            finally:
+                volume._written(nbytes, time.perf_counter() - start)
+                volume.queue.task_done()
+
+    def join(self):
+        """等待所有卷的队列清空。"""
+        for v in self.volumes:
+            v.queue.join()
+
+    def stop(self):
+        """清空队列后停止所有写入线程。"""
+        for v in self.volumes:
+            for _ in v.threads:
+                v.queue.put(None)
+        for v in self.volumes:
+            for t in v.threads:
+                t.join()
+
+    def stats(self):
+        return [v.stats() for v in self.volumes]